@@ -3,6 +3,11 @@
 import matplotlib as mpl
 mpl.use('Agg')
 import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from PIL import Image
 Image.MAX_IMAGE_PIXELS = None
@@ -11,6 +16,25 @@ import matplotlib.patches as patches
 from matplotlib import pyplot as plt
 from netCDF4 import Dataset
 
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','submission'))
+from flowlines import read_pst_list
+
+''' zoom window (km, m), delay window (microsec) and (km, m, text) labels for panel b) '''
+Zoom = namedtuple('Zoom', ['x1', 'x2', 'y1', 'y2', 'delay1', 'delay2', 'labels'])
+
+DEFAULT_ZOOM = Zoom(400, 475, 0, 1500, 31.5, 49, [])
+
+''' transects whose zoom has been picked by hand; the others use DEFAULT_ZOOM when it falls inside them '''
+ZOOMS = {
+    'CLX/R66a': Zoom(400, 475, 0, 1500, 31.5, 49,
+                     [(430, 500, 'basal unit'), (433, 1300, 'stratigraphic ice'), (415, 200, 'bedrock')]),
+}
+
+def dd_name(pst,platform='MKB2o'):
+    ''' Delay Doppler products are named with the platform, e.g. CLX/MKB2o/R66a for CLX/R66a '''
+    project,line = pst.split('/')
+    return f'{project}/{platform}/{line}'
+
 def read_nc(path,pst):
     delay_doppler = Dataset(os.path.join(path,f'{pst.replace("/","_")}_dd_analysis.nc'),'r',format="NETCDF4")
     return delay_doppler
@@ -18,17 +42,19 @@ def read_nc(path,pst):
 def read_data(path,pst):
     file_path = os.path.join(path,'image',pst.replace('/','_') + '_image.jpg')
     meta_data_path = os.path.join(path,'metadata',pst.replace('/','_') + '_image.csv')
-    print(file_path)
-    if os.path.exists(file_path):
-        img = np.array(np.asarray(Image.open(file_path)))[:,:,0]
-    else:
-        print('nope!')
-        exit()
-    if os.path.exists(meta_data_path):
-        meta = pd.read_csv(meta_data_path)
-    radar=140*(img.astype('float')-255)/256
+    with Image.open(file_path) as image:
+        img = np.asarray(image.getchannel(0) if image.mode != 'L' else image)
+    meta = pd.read_csv(meta_data_path)
+    radar=(140*(img.astype('float32')-255)/256)
     return radar, meta
 
+def missing_inputs(pst,radargram_path,dd_path,platform='MKB2o'):
+    ''' the input files of a transect that do not exist '''
+    files = [os.path.join(radargram_path,'image',pst.replace('/','_') + '_image.jpg'),
+             os.path.join(radargram_path,'metadata',pst.replace('/','_') + '_image.csv'),
+             os.path.join(dd_path,f'{dd_name(pst,platform).replace("/","_")}_dd_analysis.nc')]
+    return [f for f in files if not os.path.exists(f)]
+
 def read_bas_data(bas_path):
     return 
 
@@ -66,14 +92,21 @@ def set_axis_color(ax, color):
     ax.yaxis.label.set_color(color)
     ax.title.set_color(color)
 
-def plot_data(radar,dd,meta,pst):
+def plot_data(radar,dd,meta,pst,outdir=None,zoom=None):
+    ''' zoom defaults to the transect's entry in ZOOMS; the zoom panel is left out when it is not inside the transect '''
     image_top = meta['Elevation of image top [m]'].iloc[0]
     image_bottom = meta['Elevation of image bottom [m]'].iloc[-1]
     image_start = meta['Displayed_distance [km]'].iloc[0]
     image_end = meta['Displayed_distance [km]'].iloc[-1]
 
+    zoom = zoom or ZOOMS.get(pst, DEFAULT_ZOOM)
+    first, last = meta['Displayed_distance [km]'].min(), meta['Displayed_distance [km]'].max()
+    if not first <= zoom.x1 < zoom.x2 <= last:
+        print(f'{pst}: zoom {zoom.x1}-{zoom.x2} km is outside {first:.0f}-{last:.0f} km, leaving it out')
+        zoom = None
+
     #fig,axes = plt.subplots(2,figsize=(7.48, 5))
-    fig,axes = plt.subplots(3,figsize=(7, 5))
+    fig,axes = plt.subplots(3 if zoom else 2,figsize=(7, 5))
 
     print(dd['channels'])
     dd_data = dd['channels']['normalized_max_in_bin'][:,:,:]
@@ -93,69 +126,102 @@ def plot_data(radar,dd,meta,pst):
     axes[0].text(axes[0].get_xlim()[0],-500,"< Gambertsev Subglacial Mountains",color='black',fontsize=8,horizontalalignment='left')
     axes[0].text(650,3750,"< Dome A",color='black',fontsize=8,horizontalalignment='center',verticalalignment='top')
 
-    zoom_x1 = 400
-    zoom_x2 = 475
-    zoom_y1 = 0
-    zoom_y2 = 1500
-
-    delay_dopp_x1 = 400
-    delay_dopp_x2 = 475
-    delay_dopp_y1 = 31.5
-    delay_dopp_y2 = 49
-
-    rect1 = patches.Rectangle((zoom_x1, zoom_y1), (zoom_x2-zoom_x1), (zoom_y2-zoom_y1), linewidth=1, edgecolor='gold', facecolor='none')
-    rect2 = patches.Rectangle((zoom_x1, zoom_y1), (zoom_x2-zoom_x1), (zoom_y2-zoom_y1), linewidth=5, edgecolor='gold', facecolor='none',zorder=10)
-    rect3 = patches.Rectangle((delay_dopp_x1, delay_dopp_y1), (delay_dopp_x2-delay_dopp_x1), (delay_dopp_y2-delay_dopp_y1), linewidth=1, edgecolor='gold', facecolor='none')
-
-    axes[0].add_patch(rect1)
-
-    axes[2].imshow(np.fliplr(np.rot90(dd_data,3)),extent=(image_start,image_start+dd_x,64,0),aspect='auto')
-    axes[2].set_title(f"c) Delay Doppler analysis - blue is more specular", horizontalalignment='left', x=-0)
-    axes[2].set_ylabel("Delay (microsec)")
-    axes[2].add_patch(rect3)
-
-    axes[1].imshow(radar, cmap='bone', vmin=-130,vmax=-60, extent=extent, aspect='auto')
-    axes[1].set_xlim(zoom_x1,zoom_x2)
-    axes[1].set_ylim(zoom_y1,zoom_y2)
-    axes[1].text(430,500,"basal unit",color='ivory')
-    axes[1].text(433,1300,"stratigraphic ice",color='ivory')
-    axes[1].text(415,200,"bedrock",color='ivory')
-    axes[0].set_ylabel('Elevation (m, WGS-84)')
-    axes[1].add_patch(rect2)
-    axes[1].set_title(f"b) Zoom in on basal region of ice sheet", horizontalalignment='left', x=-0)
-    for spine in axes[1].spines.values():
-            spine.set_zorder(5)
-
-    axes[2].set_xlabel('Distance from radial origin (km)')
-
-    plt.tight_layout()
-
-    vert_exag0 = vertical_exaggeration(axes[0])
-    vert_exag1 = vertical_exaggeration(axes[1])
-    axes[0].text(0.01,0.03,f"{vert_exag0:.1f}x vertical exaggeration",
-            horizontalalignment='left',verticalalignment='bottom',
-            transform=axes[0].transAxes,
-            fontsize=6, color='gray')
-    axes[1].text(0.01,0.03,f"{vert_exag1:.1f}x vertical exaggeration",
-            horizontalalignment='left',verticalalignment='bottom',
-            transform=axes[1].transAxes,
-            fontsize=6, color='gray')
+    axes[-1].imshow(np.fliplr(np.rot90(dd_data,3)),extent=(image_start,image_start+dd_x,64,0),aspect='auto')
+    axes[-1].set_title(f"{'c' if zoom else 'b'}) Delay Doppler analysis - blue is more specular", horizontalalignment='left', x=-0)
+    axes[-1].set_ylabel("Delay (microsec)")
+    axes[-1].set_xlabel('Distance from radial origin (km)')
+
+    if zoom:
+        rect1 = patches.Rectangle((zoom.x1, zoom.y1), (zoom.x2-zoom.x1), (zoom.y2-zoom.y1), linewidth=1, edgecolor='gold', facecolor='none')
+        rect2 = patches.Rectangle((zoom.x1, zoom.y1), (zoom.x2-zoom.x1), (zoom.y2-zoom.y1), linewidth=5, edgecolor='gold', facecolor='none',zorder=10)
+        rect3 = patches.Rectangle((zoom.x1, zoom.delay1), (zoom.x2-zoom.x1), (zoom.delay2-zoom.delay1), linewidth=1, edgecolor='gold', facecolor='none')
+        axes[0].add_patch(rect1)
+        axes[2].add_patch(rect3)
+
+        axes[1].imshow(radar, cmap='bone', vmin=-130,vmax=-60, extent=extent, aspect='auto')
+        axes[1].set_xlim(zoom.x1,zoom.x2)
+        axes[1].set_ylim(zoom.y1,zoom.y2)
+        for x,y,label in zoom.labels:
+            axes[1].text(x,y,label,color='ivory')
+        axes[1].add_patch(rect2)
+        axes[1].set_title(f"b) Zoom in on basal region of ice sheet", horizontalalignment='left', x=-0)
+        for spine in axes[1].spines.values():
+                spine.set_zorder(5)
+
+    fig.tight_layout()
+
+    for ax in axes[:-1]:
+        ax.text(0.01,0.03,f"{vertical_exaggeration(ax):.1f}x vertical exaggeration",
+                horizontalalignment='left',verticalalignment='bottom',
+                transform=ax.transAxes,
+                fontsize=6, color='gray')
 
     #set_axis_color(axes[0], 'black')
     #set_axis_color(axes[2], 'black')
 
-    outdir = os.getcwd().replace('code','targ')
+    outdir = outdir or os.getcwd().replace('code','targ')
     os.makedirs(outdir,exist_ok=True)
-    plt.savefig(f'{outdir}/{pst.replace("/","_")}.png',dpi=400,transparent=False)
+    fig.savefig(f'{outdir}/{pst.replace("/","_")}.png',dpi=400,transparent=False)
+    plt.close(fig)
 
     outfile.to_csv(f'{outdir}/{pst.replace("/","_")}.xy',sep='\t',index=False,header=False,na_rep="nan")
 
-pst = 'CLX/R66a'
-pst_long = 'CLX/MKB2o/R66a'
-
-radar,meta = read_data('/disk/kea/WAIS/targ/comm/DATA-OPR/projected_images_COLDEX',pst)
-dd = read_nc('/disk/kea/WAIS/targ/artl/coldex_basal_grl24/delay_doppler/HiCARS_delay_doppler',pst_long)
-
-plot_data(radar,dd,meta,pst)
-#for column in list(meta.columns):
-#    print(column)
+def render(pst,radargram_path,dd_path,outdir=None,platform='MKB2o',zoom=None):
+    ''' Render one transect; returns (pst, seconds taken, missing input files) and never raises for missing inputs '''
+    start = time.time()
+    missing = missing_inputs(pst,radargram_path,dd_path,platform)
+    if missing:
+        return pst, time.time() - start, missing
+    # every worker process starts from the default matplotlib settings
+    plt.rcdefaults()
+    radar,meta = read_data(radargram_path,pst)
+    dd = read_nc(dd_path,dd_name(pst,platform))
+    try:
+        plot_data(radar,dd,meta,pst,outdir=outdir,zoom=zoom)
+    finally:
+        dd.close()
+    return pst, time.time() - start, []
+
+def _render(args):
+    return render(*args)
+
+def render_all(psts,radargram_path,dd_path,outdir=None,platform='MKB2o',workers=None,zooms=None):
+    ''' Render transects on a process pool, one transect per task; returns the transects that were skipped
+    zooms maps transects to a Zoom overriding their entry in ZOOMS '''
+    workers = max(1, min(workers or os.cpu_count(), len(psts)))
+    zooms = zooms or {}
+    jobs = [(pst,radargram_path,dd_path,outdir,platform,zooms.get(pst)) for pst in psts]
+    start = time.time()
+    if workers == 1:
+        results = [_render(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_render,jobs))
+    skipped = []
+    for pst, seconds, missing in results:
+        if missing:
+            print(f'{pst}: skipped, missing {", ".join(missing)}')
+            skipped.append(pst)
+        else:
+            print(f'{pst}: rendered in {seconds:.1f}s')
+    print(f'rendered {len(psts) - len(skipped)} of {len(psts)} transects in {time.time() - start:.1f}s with {workers} workers')
+    return skipped
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    orig = os.getcwd().replace('code','orig')
+    parser = argparse.ArgumentParser(description='renders radargram, zoom and delay Doppler panels for radial transects')
+    parser.add_argument('transects', nargs='*', help='transects to render, e.g. CLX/R66a; defaults to those in the transect list')
+    parser.add_argument('--pst-list', default=os.path.join(here,'pst_list.txt'), help='file listing transects, one per line')
+    parser.add_argument('--radargrams', default=os.path.join(orig,'projected_images_COLDEX'), help='projected radargram folder')
+    parser.add_argument('--delay-doppler', default=os.path.join(orig,'DelayDoppler'), help='delay Doppler folder')
+    parser.add_argument('--platform', default='MKB2o', help='platform in the delay Doppler file names')
+    parser.add_argument('--outdir', default=None, help='output folder, defaults to targ')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the number of cores')
+    args = parser.parse_args()
+
+    psts = args.transects or read_pst_list(args.pst_list)
+    render_all(psts,args.radargrams,args.delay_doppler,outdir=args.outdir,platform=args.platform,workers=args.workers)
+
+if __name__ == "__main__":
+    main()
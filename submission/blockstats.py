@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+'''Block reduction of scattered data onto a regular lattice
+
+Blocks follow GMT's gridline registration as used by blockmean: the block for a
+point is the nearest node of region at the given spacing, and points outside
+region are dropped. Block locations are the mean position of the points in the
+block, as blockmean reports by default.
+
+Sums are accumulated with np.bincount over fixed size chunks of points, so
+float32 inputs of 10^8 points are reduced without full length float64
+temporaries. Order statistics (median, min, max) need one sort by block.
+'''
+
+import numpy as np
+import pandas as pd
+
+STATISTICS = ('mean', 'rms', 'std', 'count', 'min', 'max', 'median')
+
+
+def block_index(x, y, region, spacing):
+    '''flat block index for every point, -1 for points outside region
+
+    returns:
+        index array, and the number of blocks in x and y
+    '''
+    nx = int(round((region[1] - region[0]) / spacing)) + 1
+    ny = int(round((region[3] - region[2]) / spacing)) + 1
+    inside = (x >= region[0]) & (x <= region[1]) & (y >= region[2]) & (y <= region[3])
+    col = np.rint((x - region[0]) / spacing)
+    row = np.rint((y - region[2]) / spacing)
+    index = np.where(inside, row * nx + col, -1).astype('int64')
+    return index, nx, ny
+
+
+def _sums(x, y, z, region, spacing, chunksize, weights=None):
+    '''per block count and sums of x, y, z and z**2, accumulated chunk by chunk
+
+    z is shaped (nfields, npoints); with weights, counts and sums are weighted
+    '''
+    nx = int(round((region[1] - region[0]) / spacing)) + 1
+    ny = int(round((region[3] - region[2]) / spacing)) + 1
+    nblocks = nx * ny
+    count = np.zeros(nblocks, dtype='int64' if weights is None else 'float64')
+    sum_x = np.zeros(nblocks)
+    sum_y = np.zeros(nblocks)
+    sum_z = np.zeros((len(z), nblocks))
+    sum_zz = np.zeros((len(z), nblocks))
+
+    for start in range(0, len(x), chunksize):
+        chunk = slice(start, start + chunksize)
+        index, _, _ = block_index(x[chunk], y[chunk], region, spacing)
+        inside = index >= 0
+        index = index[inside]
+        if weights is None:
+            w = 1
+            count += np.bincount(index, minlength=nblocks)
+        else:
+            w = weights[chunk][inside].astype('float64')
+            count += np.bincount(index, weights=w, minlength=nblocks)
+        sum_x += np.bincount(index, weights=w*x[chunk][inside], minlength=nblocks)
+        sum_y += np.bincount(index, weights=w*y[chunk][inside], minlength=nblocks)
+        for i, field in enumerate(z):
+            values = field[chunk][inside].astype('float64')
+            sum_z[i] += np.bincount(index, weights=w*values, minlength=nblocks)
+            sum_zz[i] += np.bincount(index, weights=w*values*values, minlength=nblocks)
+    return count, sum_x, sum_y, sum_z, sum_zz
+
+
+def block_mean(x, y, z, region, spacing, rms=False, weights=None, chunksize=2**24):
+    '''mean position and mean (or RMS) value of every occupied block, for one or more fields
+
+    arguments:
+        x, y: point coordinates
+        z: values, shaped (npoints,) or (nfields, npoints), with no NaNs
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        spacing: block size in projected units
+        rms: return the root mean square of the values instead of the mean
+        weights: optional point weights, e.g. the number of raster nodes a point already
+                 averages (see raster_block_mean), so it counts as that many points
+    returns:
+        x, y of the occupied blocks and the block values shaped like z
+    '''
+    z = np.asarray(z)
+    single = z.ndim == 1
+    z = np.atleast_2d(z)
+
+    count, sum_x, sum_y, sum_z, sum_zz = _sums(x, y, z, region, spacing, chunksize, weights=weights)
+    occupied = np.flatnonzero(count)
+    n = count[occupied]
+    bz = np.sqrt(sum_zz[:, occupied] / n) if rms else sum_z[:, occupied] / n
+    return sum_x[occupied] / n, sum_y[occupied] / n, (bz[0] if single else bz)
+
+
+def block_fields(x, y, z, region, spacing, rms=False, weights=None, chunksize=2**24):
+    '''mean position of every occupied block, and the mean (or RMS) of each field's values in it
+
+    Unlike block_mean, fields may have NaNs at different points. Block positions
+    come from every point, so they are shared by all fields, and each field's
+    block value averages only its own valid values.
+
+    arguments:
+        as for block_mean, with z shaped (nfields, npoints) and NaN where a field is missing
+    returns:
+        x, y of the occupied blocks and the block values shaped (nfields, nblocks),
+        NaN in blocks where a field has no value
+    '''
+    nx = int(round((region[1] - region[0]) / spacing)) + 1
+    ny = int(round((region[3] - region[2]) / spacing)) + 1
+    nblocks = nx * ny
+    count = np.zeros(nblocks)
+    sum_x = np.zeros(nblocks)
+    sum_y = np.zeros(nblocks)
+    field_count = np.zeros((len(z), nblocks))
+    sum_z = np.zeros((len(z), nblocks))
+
+    for start in range(0, len(x), chunksize):
+        chunk = slice(start, start + chunksize)
+        index, _, _ = block_index(x[chunk], y[chunk], region, spacing)
+        inside = index >= 0
+        index = index[inside]
+        w = np.ones(len(index)) if weights is None else weights[chunk][inside].astype('float64')
+        count += np.bincount(index, weights=w, minlength=nblocks)
+        sum_x += np.bincount(index, weights=w*x[chunk][inside], minlength=nblocks)
+        sum_y += np.bincount(index, weights=w*y[chunk][inside], minlength=nblocks)
+        for i, field in enumerate(z):
+            values = field[chunk][inside].astype('float64')
+            valid = np.isfinite(values)
+            values = values[valid]**2 if rms else values[valid]
+            field_count[i] += np.bincount(index[valid], weights=w[valid], minlength=nblocks)
+            sum_z[i] += np.bincount(index[valid], weights=w[valid]*values, minlength=nblocks)
+
+    occupied = np.flatnonzero(count)
+    n = count[occupied]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bz = sum_z[:, occupied] / field_count[:, occupied]
+    return sum_x[occupied] / n, sum_y[occupied] / n, (np.sqrt(bz) if rms else bz)
+
+
+def raster_block_mean(xs, ys, read, region, spacing, rows=1024):
+    '''mean position and value of the nodes of a raster in every occupied block
+
+    The raster is read a band of rows at a time and each node is assigned to a
+    block as a point at its location would be, so the result is what block_mean
+    gives for the raster converted to points, without making the points.
+
+    arguments:
+        xs, ys: raster node coordinates
+        read: function(row_start, row_stop) returning those rows of the raster, NaN where missing
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        spacing: block size in projected units
+        rows: number of raster rows read at a time
+    returns:
+        x, y and value of the occupied blocks, and the number of nodes in each
+    '''
+    nx = int(round((region[1] - region[0]) / spacing)) + 1
+    ny = int(round((region[3] - region[2]) / spacing)) + 1
+    nblocks = nx * ny
+    col = np.where((xs >= region[0]) & (xs <= region[1]), np.rint((xs - region[0]) / spacing), -1).astype('int64')
+    row = np.where((ys >= region[2]) & (ys <= region[3]), np.rint((ys - region[2]) / spacing), -1).astype('int64')
+    columns = np.flatnonzero(col >= 0)
+
+    count = np.zeros(nblocks, dtype='int64')
+    sum_x = np.zeros(nblocks)
+    sum_y = np.zeros(nblocks)
+    sum_z = np.zeros(nblocks)
+    for start in range(0, len(ys), rows):
+        stop = min(start + rows, len(ys))
+        band = np.flatnonzero(row[start:stop] >= 0)
+        if len(band) == 0 or len(columns) == 0:
+            continue
+        values = np.asarray(read(start, stop), dtype='float64')[np.ix_(band, columns)]
+        valid = np.isfinite(values)
+        r, c = np.nonzero(valid)
+        index = row[start + band[r]] * nx + col[columns[c]]
+        count += np.bincount(index, minlength=nblocks)
+        sum_x += np.bincount(index, weights=xs[columns[c]], minlength=nblocks)
+        sum_y += np.bincount(index, weights=ys[start + band[r]], minlength=nblocks)
+        sum_z += np.bincount(index, weights=values[valid], minlength=nblocks)
+
+    occupied = np.flatnonzero(count)
+    n = count[occupied]
+    return sum_x[occupied] / n, sum_y[occupied] / n, sum_z[occupied] / n, n
+
+
+def block_statistics(x, y, z, region, spacing, statistics=STATISTICS, chunksize=2**24):
+    '''statistics of the values in every occupied block
+
+    arguments:
+        x, y: point coordinates
+        z: values; points with NaN values are ignored
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        spacing: block size in projected units
+        statistics: any of 'mean', 'rms', 'std' (sample), 'count', 'min', 'max', 'median'
+    returns:
+        pandas dataframe with the mean x and y of each block, the block index and
+        one column per statistic
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    z = np.asarray(z)
+    valid = np.isfinite(z)
+    if not valid.all():
+        x, y, z = x[valid], y[valid], z[valid]
+
+    count, sum_x, sum_y, sum_z, sum_zz = _sums(x, y, z[np.newaxis], region, spacing, chunksize)
+    occupied = np.flatnonzero(count)
+    n = count[occupied]
+    mean = sum_z[0, occupied] / n
+
+    table = pd.DataFrame({'x': sum_x[occupied] / n, 'y': sum_y[occupied] / n, 'block': occupied})
+    if 'mean' in statistics:
+        table['mean'] = mean
+    if 'rms' in statistics:
+        table['rms'] = np.sqrt(sum_zz[0, occupied] / n)
+    if 'std' in statistics:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (sum_zz[0, occupied] - n * mean**2) / (n - 1)
+        table['std'] = np.sqrt(np.maximum(variance, 0))
+    if 'count' in statistics:
+        table['count'] = n
+
+    if {'min', 'max', 'median'} & set(statistics):
+        index, _, _ = block_index(x, y, region, spacing)
+        inside = index >= 0
+        index, values = index[inside], z[inside]
+        order = np.lexsort((values, index))
+        values = values[order]
+        first = np.concatenate([[0], np.cumsum(n)[:-1]])
+        if 'min' in statistics:
+            table['min'] = values[first]
+        if 'max' in statistics:
+            table['max'] = values[first + n - 1]
+        if 'median' in statistics:
+            table['median'] = (values[first + (n - 1) // 2].astype('float64') + values[first + n // 2]) / 2
+    return table
+
+
+def statistic_grid(table, column, region, spacing):
+    '''a column of block_statistics on the block lattice (the gridline registered nodes
+    of region at spacing), NaN in empty blocks'''
+    nx = int(round((region[1] - region[0]) / spacing)) + 1
+    ny = int(round((region[3] - region[2]) / spacing)) + 1
+    grid = np.full(nx * ny, np.nan)
+    grid[table['block'].to_numpy()] = table[column].to_numpy()
+    return grid.reshape(ny, nx)
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+'''Builds the data products and figures, rerunning only what is out of date
+
+Every stage (a python script or shell script run from 'code') is a task that
+declares its inputs (files or folders in 'orig' and 'targ') and its outputs in
+'targ'. A task's fingerprint is a hash of its command line (which carries its
+parameters, such as the region), the content of its inputs and of the code it
+runs, including local modules it imports. A task reruns when its fingerprint
+or one of its outputs has changed since its last successful run.
+
+Tasks that produce another task's inputs run first; independent tasks run in
+parallel. File hashes are memoised on size and mtime (see cache.file_signature),
+so a rebuild with nothing changed only stats the files.
+
+    python3 build.py                 # build everything that is out of date
+    python3 build.py overview -n     # show what the overview maps need rebuilt
+    python3 build.py grids --force   # rerun the gridding and what depends on it
+'''
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from cache import files_signature
+from products import STORES
+
+'''inputs and outputs are paths starting with 'orig/' or 'targ/'; code lists extra scripts a task runs'''
+Task = namedtuple('Task', ['name', 'command', 'inputs', 'outputs', 'code'], defaults=[[]])
+
+REGION = [-200e3, 800e3, -200e3, 400e3]
+RADARGRAMS = 'orig/projected_images_COLDEX'
+PYRAMIDS = 'targ/radargrams'
+GRIDS = ['bedelv', 'icethk', 'srfelv', 'specularity_content', 'roughness', 'basal_layer_thickness', 'fract_basal_ice_percent']
+'''grids whose block count and spread are written too (srfelv is gridded from weighted points)'''
+BLOCK_GRIDS = ['bedelv', 'icethk', 'specularity_content', 'roughness', 'basal_layer_thickness']
+CUESTAS = ['CLX_R68b', 'CLX_R69a', 'CLX_R70b']
+VELOCITY = ['VX', 'VY', 'VELM', 'FLOW_DIRECTION', 'EFFECTIVE_STRAIN_RATE', 'LONGITUDINAL_STRAIN_RATE', 'TRANSVERSE_STRAIN_RATE']
+
+
+def tasks(region=REGION, tile_size=None, workers=None, store=None):
+    '''the task graph for the paper's products'''
+    grid_args = ['--region', *[str(r) for r in region]]
+    stores = [f'targ/{s}' for s in STORES]
+    if tile_size:
+        grid_args += ['--tile-size', str(tile_size)]
+    if workers:
+        grid_args += ['--workers', str(workers)]
+    if store:
+        grid_args += ['--store', store]
+    return [
+        Task('ice_flow', ['python3', 'process_ice_flow_data.py'],
+             ['orig/Mouginot2019/antarctic_ice_vel_phase_map_v01.h5'],
+             [f'targ/Mouginot2019/{c}.tif' for c in VELOCITY]),
+        Task('grids', ['python3', 'process_data.py', *grid_args],
+             ['orig/2022_COLDEX_UTIG.IRSPC2', 'orig/2023_COLDEX_UTIG.IRSPC2', 'orig/ICECAP2_SPC.CRIPR2',
+              'orig/COLDEX_SRF', 'orig/ICECAP2_SPC.CLUTP2', 'orig/SOAR-PPT-las_srfelv.grid',
+              'orig/ATL14_A*_0325_100m_004_05.nc', 'orig/yan_basal_layer', f'{RADARGRAMS}/metadata', 'orig/*.csv'],
+             [*[f'targ/{g}.tif' for g in GRIDS], *[f'targ/{g}_blocks.tif' for g in BLOCK_GRIDS],
+              'targ/hipass_bed.xyz', *(stores if store else [])]),
+        Task('radargrams', ['python3', 'radargram.py'],
+             [f'{RADARGRAMS}/image', f'{RADARGRAMS}/metadata'],
+             [PYRAMIDS]),
+        Task('context', ['python3', 'make_context_map.py'],
+             ['orig/rema/rema_mosaic_1km_v2.0_filled_cop30_dem.tif', RADARGRAMS, PYRAMIDS],
+             ['targ/coldex_context_map.png']),
+        Task('cuestas', ['python3', 'make_coldex_cuestas_figure.py'],
+             ['orig/Sanderson_2023', 'orig/DelayDoppler', RADARGRAMS, PYRAMIDS],
+             ['targ/coldex_cuestas.png', *[f'targ/{c}.cuestas.xy' for c in CUESTAS]]),
+        Task('sketch', ['python3', 'make_sketch_profile.py'],
+             ['targ/bedelv.tif', 'targ/icethk.tif', 'targ/fract_basal_ice_percent.tif',
+              'orig/2023_Antarctica_BaslerMKB.csv', RADARGRAMS, PYRAMIDS, *stores],
+             ['targ/coldex_sketch_profile.png', 'targ/coldex_sketch_profile.pdf']),
+        Task('overview', ['bash', 'make_coldex_overview_maps.sh'],
+             ['targ/srfelv.tif', 'targ/bedelv.tif', 'targ/icethk.tif',
+              'targ/specularity_content.tif', 'targ/roughness.tif',
+              'targ/fract_basal_ice_percent.tif', 'targ/hipass_bed.xyz',
+              'targ/Mouginot2019/VX.tif', 'targ/Mouginot2019/VY.tif',
+              *[f'targ/{c}.cuestas.xy' for c in CUESTAS],
+              'orig/Sanderson_2023', 'orig/clipped_bnd.gmt', f'{RADARGRAMS}/metadata'],
+             ['targ/coldex_overview_maps.png', 'targ/coldex_south_pole_basin_maps.png']),
+    ]
+
+
+def resolve(path, code):
+    '''absolute path for an 'orig/...' or 'targ/...' path, relative to the code directory'''
+    root, _, rest = path.partition('/')
+    return os.path.join(code.replace('code', root), rest)
+
+
+def _files(path):
+    '''files named by path: a file, every file under a folder, or a glob'''
+    if '*' in os.path.basename(path):
+        folder = os.path.dirname(path)
+        pattern = re.compile(re.escape(os.path.basename(path)).replace(r'\*', '.*') + '$')
+        if not os.path.isdir(folder):
+            return []
+        return sorted(os.path.join(folder, f) for f in os.listdir(folder) if pattern.match(f))
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+    return [path]
+
+
+def signature(path):
+    '''content hashes of the files named by path, or None if there are none'''
+    files = [f for f in _files(path) if os.path.exists(f)]
+    if not files:
+        return None
+    return [(os.path.relpath(f, os.path.dirname(path)), sig[3]) for f, sig in zip(files, files_signature(files))]
+
+
+def local_modules(script, code):
+    '''script plus the modules in the code directory it imports, directly or not'''
+    found = []
+    pending = [script]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(code, name)
+        if name in found or not os.path.exists(path):
+            continue
+        found.append(name)
+        with open(path) as f:
+            source = f.read()
+        if name.endswith('.py'):
+            for node in ast.walk(ast.parse(source)):
+                if isinstance(node, ast.Import):
+                    pending += [f'{alias.name}.py' for alias in node.names]
+                elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                    pending.append(f'{node.module}.py')
+        else:
+            pending += re.findall(r'python3?\s+(\S+\.py)', source)
+    return sorted(found)
+
+
+def fingerprint(task, code):
+    '''hash of everything a task's outputs depend on'''
+    script = next(arg for arg in task.command if arg.endswith(('.py', '.sh')))
+    modules = sorted({m for s in [script, *task.code] for m in local_modules(s, code)})
+    description = {
+        'command': task.command,
+        'code': [signature(os.path.join(code, m)) for m in modules],
+        'inputs': {path: signature(resolve(path, code)) for path in task.inputs},
+    }
+    return _digest(description)
+
+
+def output_signatures(task, code):
+    '''hash of a task's outputs as they are now'''
+    return _digest({path: signature(resolve(path, code)) for path in task.outputs})
+
+
+def _digest(description):
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def dependencies(graph):
+    '''names of the tasks producing each task's inputs'''
+    producers = {out: task.name for task in graph for out in task.outputs}
+    depends = {}
+    for task in graph:
+        depends[task.name] = {producers[out] for out in producers for path in task.inputs
+                              if (out == path or out.startswith(path.rstrip('/') + '/')) and producers[out] != task.name}
+    return depends
+
+
+def _load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(path, state):
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def _run(task, code, logs):
+    '''runs a task, logging its output; returns the return code and time taken'''
+    start = time.time()
+    with open(os.path.join(logs, f'{task.name}.log'), 'w') as log:
+        result = subprocess.run(task.command, cwd=code, stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode, time.time() - start
+
+
+def build(graph, targets=None, workers=None, force=False, dry_run=False, code=None):
+    '''runs the out of date tasks needed for targets
+
+    arguments:
+        graph: list of Task tuples
+        targets: task names to bring up to date, defaults to every task
+        workers: number of tasks run at once, defaults to the number of cores
+        force: rerun targets even if up to date (tasks downstream rerun if their inputs change)
+        dry_run: only report which tasks are out of date, assuming upstream tasks rerun
+    returns:
+        dictionary of task name to 'fresh', 'ran', 'stale', 'failed' or 'skipped'
+    '''
+    code = code or os.getcwd()
+    targ = code.replace('code', 'targ')
+    logs = os.path.join(targ, 'logs')
+    os.makedirs(logs, exist_ok=True)
+    state_path = os.path.join(targ, 'build_state.json')
+    state = _load_state(state_path)
+
+    tasks_by_name = {task.name: task for task in graph}
+    depends = dependencies(graph)
+    wanted = set()
+    pending = list(targets or tasks_by_name)
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending += depends[name]
+    forced = set(targets or tasks_by_name) if force else set()
+
+    status = {}
+    running = {}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        while len(status) < len(wanted):
+            for name in sorted(wanted - set(status) - set(running)):
+                upstream = [status.get(d) for d in depends[name]]
+                if any(s in ('failed', 'skipped') for s in upstream):
+                    status[name] = 'skipped'
+                    continue
+                if not all(s in ('fresh', 'ran', 'stale') for s in upstream):
+                    continue
+                task = tasks_by_name[name]
+                key = fingerprint(task, code)
+                previous = state.get(name, {})
+                if (name not in forced and 'stale' not in upstream and previous.get('fingerprint') == key
+                        and previous.get('outputs') == output_signatures(task, code)):
+                    status[name] = 'fresh'
+                elif dry_run:
+                    status[name] = 'stale'
+                else:
+                    print(f'running {name}: {" ".join(task.command)}')
+                    running[name] = (key, pool.submit(_run, task, code, logs))
+            if not running:
+                if len(status) < len(wanted) and not any(
+                        all(d in status for d in depends[n]) for n in wanted - set(status)):
+                    raise ValueError(f'circular dependencies between {", ".join(sorted(wanted - set(status)))}')
+                continue
+
+            done, _ = wait([future for _, future in running.values()], return_when=FIRST_COMPLETED)
+            for name in [n for n, (_, future) in running.items() if future in done]:
+                key, future = running.pop(name)
+                returncode, seconds = future.result()
+                if returncode:
+                    status[name] = 'failed'
+                    print(f'{name} failed after {seconds:.1f} s, see {os.path.join(logs, name + ".log")}')
+                else:
+                    status[name] = 'ran'
+                    state[name] = {'fingerprint': key, 'outputs': output_signatures(tasks_by_name[name], code)}
+                    _save_state(state_path, state)
+                    print(f'{name} done in {seconds:.1f} s')
+
+    for name in sorted(status):
+        print(f'    {name:<12} {status[name]}')
+    print(f'build finished in {time.time() - start:.2f} s')
+    return status
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='builds the COLDEX grids and figures, rerunning only what is out of date')
+    parser.add_argument('targets', nargs='*', help='tasks to build, defaults to all')
+    parser.add_argument('--jobs', '-j', type=int, default=None, help='number of tasks run at once')
+    parser.add_argument('--force', '-f', action='store_true', help='rerun the targets even if up to date')
+    parser.add_argument('--dry-run', '-n', action='store_true', help='only list the out of date tasks')
+    parser.add_argument('--list', '-l', action='store_true', help='list the tasks and their dependencies')
+    parser.add_argument('--region', nargs=4, type=float, default=REGION, metavar=('X_MIN', 'X_MAX', 'Y_MIN', 'Y_MAX'))
+    parser.add_argument('--tile-size', type=float, default=None, help='grid in tiles of this size')
+    parser.add_argument('--grid-workers', type=int, default=None, help='processes used inside the gridding task')
+    parser.add_argument('--store', choices=['zarr', 'netcdf'], default=None, help='also write the chunked product store')
+    args = parser.parse_args()
+
+    graph = tasks(region=args.region, tile_size=args.tile_size, workers=args.grid_workers, store=args.store)
+    if args.list:
+        depends = dependencies(graph)
+        for task in graph:
+            print(f'{task.name:<12} <- {", ".join(sorted(depends[task.name])) or "-"}')
+        return
+    unknown = set(args.targets) - {task.name for task in graph}
+    if unknown:
+        parser.error(f'unknown task(s) {", ".join(sorted(unknown))}')
+    status = build(graph, targets=args.targets, workers=args.jobs, force=args.force, dry_run=args.dry_run)
+    if 'failed' in status.values():
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
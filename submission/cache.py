@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+'''Content addressed cache for ingested survey tables
+
+The normalised tables returned by read_opr, read_bedmap and read_utig are stored
+as Parquet files in a 'cache' directory under 'targ'. The cache key covers the
+size, modification time and content hash of the source file(s), the reader and
+all of its parameters (including defaults such as the EPSG code), and the source
+code of the reader's module and the local modules it imports (such as
+roughness.py and utig.py), so a change to any of them forces a fresh read.
+
+Tables are also kept in memory, so a file read once is shared by every consumer
+in the same run. Shared tables should be treated as read only.
+'''
+
+import os
+import ast
+import json
+import hashlib
+import inspect
+
+import pandas as pd
+
+_memory = {}
+_signatures = {}
+_code = {}
+_parquet = True
+
+
+def cache_dir():
+    '''default location of the on disk cache'''
+    return os.path.join(os.getcwd().replace('code','targ'),'cache')
+
+
+def _file_hash(path, blocksize=2**20):
+    '''sha1 of a file's contents, read in blocks'''
+    sha = hashlib.sha1()
+    with open(path,'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _load_signatures(cache):
+    '''hashes from earlier runs, keyed on path, size and mtime'''
+    path = os.path.join(cache,'signatures.json')
+    if not _signatures and os.path.exists(path):
+        with open(path) as f:
+            _signatures.update(json.load(f))
+    return _signatures
+
+
+def _save_signatures(cache):
+    '''merges hashes into the signature file, which may be shared by several worker processes'''
+    os.makedirs(cache,exist_ok=True)
+    path = os.path.join(cache,'signatures.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            _signatures.update({k: v for k, v in json.load(f).items() if k not in _signatures})
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp,'w') as f:
+        json.dump(_signatures,f)
+    os.replace(tmp,path)
+
+
+def file_signature(path, cache=None):
+    '''returns (path, size, mtime, hash) for a file, or a list of them for every
+    text file in a folder (as read by read_utig)
+
+    hashes are only recomputed when the size or mtime of a file has changed
+    '''
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path,f) for f in os.listdir(path) if 'txt' in f)
+    else:
+        files = [path]
+    return files_signature(files, cache=cache)
+
+
+def files_signature(files, cache=None):
+    '''returns (path, size, mtime, hash) for each of a list of files, see file_signature'''
+    cache = cache or cache_dir()
+    signatures = _load_signatures(cache)
+
+    sig = []
+    updated = False
+    for f in files:
+        stat = os.stat(f)
+        memo = f'{os.path.abspath(f)}:{stat.st_size}:{stat.st_mtime_ns}'
+        if memo not in signatures:
+            signatures[memo] = _file_hash(f)
+            updated = True
+        sig.append((os.path.basename(f), stat.st_size, stat.st_mtime_ns, signatures[memo]))
+
+    if updated:
+        _save_signatures(cache)
+    return sig
+
+
+def code_signature(reader):
+    '''hash of the source of the reader's module and of the modules beside it that it imports, directly or not'''
+    path = inspect.getsourcefile(reader)
+    if path not in _code:
+        folder = os.path.dirname(path)
+        found = []
+        pending = [os.path.basename(path)]
+        while pending:
+            name = pending.pop()
+            if name in found or not os.path.exists(os.path.join(folder,name)):
+                continue
+            found.append(name)
+            with open(os.path.join(folder,name)) as f:
+                tree = ast.parse(f.read())
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    pending += [f'{alias.name}.py' for alias in node.names]
+                elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                    pending.append(f'{node.module}.py')
+        sha = hashlib.sha1()
+        for name in sorted(found):
+            sha.update(name.encode())
+            sha.update(_file_hash(os.path.join(folder,name)).encode())
+        _code[path] = sha.hexdigest()
+    return _code[path]
+
+
+def cache_key(reader, path, cache=None, **kwargs):
+    '''builds the cache key for reader(path, **kwargs)'''
+    bound = inspect.signature(reader).bind(path, **kwargs)
+    bound.apply_defaults()
+    params = {k: v for k, v in bound.arguments.items() if k != 'path'}
+    description = {
+        'reader': reader.__name__,
+        'code': code_signature(reader),
+        'source': file_signature(path, cache=cache),
+        'params': params,
+    }
+    return hashlib.sha1(json.dumps(description,sort_keys=True,default=str).encode()).hexdigest()
+
+
+def cached(reader, path, cache=None, key=None, **kwargs):
+    '''returns reader(path, **kwargs), reading from memory or the Parquet cache if possible
+
+    arguments:
+        reader: one of read_opr, read_bedmap or read_utig (or a reader with the same signature)
+        path: path to the file or folder passed to the reader
+        cache: directory for the Parquet files, defaults to targ/cache
+        key: the cache_key of this call, if the caller already has it
+        kwargs: passed through to the reader and included in the key
+    returns:
+        pandas dataframe, shared with other callers asking for the same key
+    '''
+    global _parquet
+    cache = cache or cache_dir()
+    key = key or cache_key(reader, path, cache=cache, **kwargs)
+
+    if key in _memory:
+        return _memory[key]
+
+    name = os.path.basename(os.path.normpath(path)).split('.')[0]
+    parquet_path = os.path.join(cache,f'{reader.__name__}_{name}_{key[:16]}.parquet')
+
+    data = None
+    if _parquet and os.path.exists(parquet_path):
+        try:
+            data = pd.read_parquet(parquet_path)
+            print(f'Read {path} from cache')
+        except ImportError:
+            _parquet = False
+
+    if data is None:
+        data = reader(path, **kwargs)
+        if _parquet:
+            os.makedirs(cache,exist_ok=True)
+            try:
+                data.to_parquet(parquet_path,index=False)
+            except ImportError:
+                print('pyarrow is not installed, survey tables will only be cached in memory')
+                _parquet = False
+
+    _memory[key] = data
+    return data
+
+
+def remember(key, data):
+    '''shares a table read elsewhere (e.g. in a worker process) with later callers'''
+    _memory[key] = data
+
+
+def clear_memory():
+    '''drops tables held in memory, leaving the on disk cache intact'''
+    _memory.clear()
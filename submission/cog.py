@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''Cloud optimised GeoTIFF output for gridded products
+
+Every product is written once, as a tiled, DEFLATE compressed float32 COG with
+internal overviews. The masked grid is band 1, so GMT and other readers that take
+the first band see the same values as the former {name}.xyz_val.tif; the
+unmasked (filtered only) grid is band 2. Readers can then fetch a window, or an
+overview level, without reading the whole file.
+'''
+
+import os
+
+import numpy as np
+import rasterio
+from rasterio.shutil import copy as copy_dataset
+from rasterio.transform import from_origin
+from rasterio.windows import Window, from_bounds
+import xarray as xr
+
+BANDS = ('masked', 'unmasked')
+
+
+def write_cog(path, grids, descriptions=BANDS, epsg=3031, blocksize=512, rows=2048):
+    '''writes one or more grids on the same nodes as the bands of a COG
+
+    arguments:
+        path: output file
+        grids: an xarray grid, or a list of them, with ascending x and y coordinates
+               (as made by natural_neighbour.to_dataarray); may be memory mapped
+        descriptions: band descriptions, one per grid
+        epsg: the grid projection EPSG identifier
+        blocksize: internal tile size in pixels
+        rows: grids are copied this many rows at a time, so memory mapped grids are never loaded whole
+
+    The bands are staged in a temporary tiled GeoTIFF beside path, from which GDAL
+    builds the COG and its overviews a block at a time.
+    '''
+    if isinstance(grids, xr.DataArray):
+        grids = [grids]
+    xs, ys = grids[0].x.values, grids[0].y.values
+    dx, dy = float(xs[1] - xs[0]), float(ys[1] - ys[0])
+    profile = {'driver': 'GTiff', 'width': len(xs), 'height': len(ys), 'count': len(grids),
+               'dtype': 'float32', 'nodata': np.nan, 'crs': f'EPSG:{epsg}',
+               'transform': from_origin(xs[0] - dx / 2, ys[-1] + dy / 2, dx, dy),
+               'tiled': True, 'blockxsize': blocksize, 'blockysize': blocksize}
+
+    staging_path = f'{path}.{os.getpid()}.staging.tif'
+    try:
+        with rasterio.open(staging_path, 'w', **profile) as staging:
+            for band, (grid, description) in enumerate(zip(grids, descriptions), start=1):
+                staging.set_band_description(band, description)
+                values = grid.values if isinstance(grid, xr.DataArray) else grid
+                # rows of the file run north to south, so the grids are flipped in blocks
+                for stop in range(len(ys), 0, -rows):
+                    start = max(stop - rows, 0)
+                    block = np.asarray(values[start:stop], dtype='float32')[::-1]
+                    staging.write(block, band, window=Window(0, len(ys) - stop, len(xs), stop - start))
+        with rasterio.open(staging_path) as staging:
+            copy_dataset(staging, path, driver='COG', compress='DEFLATE', predictor='YES',
+                         blocksize=blocksize, overview_resampling='average', overviews='AUTO')
+    finally:
+        if os.path.exists(staging_path):
+            os.remove(staging_path)
+
+
+def read_cog(path, band='masked', region=None, spacing=None):
+    '''reads a window of a band, at full resolution or decimated from the overviews
+
+    arguments:
+        path: COG written by write_cog
+        band: band number, or 'masked' / 'unmasked'
+        region: optional projected region (x_min, x_max, y_min, y_max) to read
+        spacing: optional node spacing to read at; coarser spacings come from the overviews
+    returns:
+        xarray grid with ascending x and y coordinates
+    '''
+    band = BANDS.index(band) + 1 if isinstance(band, str) else band
+    with rasterio.open(path) as src:
+        full = Window(0, 0, src.width, src.height)
+        window = full
+        if region is not None:
+            res = src.res
+            window = from_bounds(region[0] - res[0] / 2, region[2] - res[1] / 2,
+                                 region[1] + res[0] / 2, region[3] + res[1] / 2, src.transform)
+            window = window.round_offsets().round_lengths().intersection(full)
+        shape = (int(window.height), int(window.width))
+        if spacing is not None and spacing > src.res[0]:
+            factor = spacing / src.res[0]
+            shape = (max(1, int(round(shape[0] / factor))), max(1, int(round(shape[1] / factor))))
+        values = src.read(band, window=window, out_shape=shape)
+        transform = src.window_transform(window) * rasterio.Affine.scale(window.width / shape[1], window.height / shape[0])
+
+    xs = transform.c + transform.a * (np.arange(shape[1]) + 0.5)
+    ys = transform.f + transform.e * (np.arange(shape[0]) + 0.5)
+    return xr.DataArray(values[::-1], coords={'y': ys[::-1], 'x': xs}, dims=('y', 'x'))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''Coverage masks: grid nodes within a given distance of survey points
+
+Replaces running a full pygmt.surface solve with maxradius only to find which
+nodes are NaN. Distances come from a KD-tree of the points (exact), or from a
+Euclidean distance transform of the points rasterised to the grid (faster for
+very dense data, within half a cell). Masks are cached on the identity of the
+point set, so every grid built from the same survey points reuses them.
+'''
+
+import hashlib
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.ndimage import distance_transform_edt
+
+from natural_neighbour import grid_nodes, to_dataarray
+
+_masks = {}
+
+
+def point_set_key(x, y):
+    '''hash identifying a set of point locations'''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(x, dtype='float64').tobytes())
+    digest.update(np.ascontiguousarray(y, dtype='float64').tobytes())
+    return digest.hexdigest()
+
+
+def coverage_mask(x, y, region, spacing, maxradius, method='kdtree'):
+    '''grid of 1 where a node is within maxradius of a point, NaN elsewhere
+
+    arguments:
+        x, y: point coordinates; only points inside region are used, as with surface
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        spacing: grid node spacing in projected units
+        maxradius: how far from datapoints values are permitted in projected units
+        method: 'kdtree' for exact distances, 'edt' for a distance transform on the grid
+    returns:
+        xarray DataArray on the gridline registered nodes of region
+    '''
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    key = (point_set_key(x, y), tuple(region), spacing, maxradius, method)
+    if key in _masks:
+        return _masks[key]
+
+    inside = (x >= region[0]) & (x <= region[1]) & (y >= region[2]) & (y <= region[3])
+    x, y = x[inside], y[inside]
+    xs, ys = grid_nodes(region, spacing)
+
+    if method == 'edt':
+        occupied = np.zeros((len(ys), len(xs)), dtype=bool)
+        occupied[np.rint((y - region[2]) / spacing).astype(int), np.rint((x - region[0]) / spacing).astype(int)] = True
+        covered = distance_transform_edt(~occupied) * spacing <= maxradius
+    else:
+        xx, yy = np.meshgrid(xs, ys)
+        distance, _ = cKDTree(np.column_stack([x, y])).query(
+                np.column_stack([xx.ravel(), yy.ravel()]), distance_upper_bound=maxradius)
+        covered = np.isfinite(distance).reshape(len(ys), len(xs))
+
+    mask = to_dataarray(np.where(covered, 1.0, np.nan), region, spacing)
+    _masks[key] = mask
+    return mask
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''Windowed delay Doppler colour composites
+
+The delay Doppler analysis files hold normalized_max_in_bin as an
+(aperture, fast_time, direction) cube. Only the apertures inside the requested
+along track distance window are read, and the composite (red and green from
+the mean of the first two directions, blue from the third) is built straight
+into a uint8 (band, y, x) array. Composites are kept in memory, keyed on the
+file, scale and window, so later panels of the same transect cost nothing.
+'''
+
+import os
+
+import numpy as np
+import xarray as xr
+from netCDF4 import Dataset
+
+_composites = {}
+
+
+def dd_file(path, transect):
+    '''the delay Doppler analysis file of a transect, e.g. CLX_MKB2o_R66a'''
+    return os.path.join(path, f'{transect.replace("/","_")}_dd_analysis.nc')
+
+
+def aperture_range(apertures, x0, x1, window=None, increment=20):
+    '''positions (start, stop) along the distance axis inside window, see read_delay_doppler'''
+    if window is None:
+        return 0, apertures
+    spacing = increment / 1000
+    start = max(0, int(np.ceil((window[0] - min(x0, x1)) / spacing - 1e-9)))
+    stop = min(apertures, int(np.floor((window[1] - min(x0, x1)) / spacing + 1e-9)) + 1)
+    return start, max(start, stop)
+
+
+def read_delay_doppler(path, transect, x0=0, x1=0, window=None, increment=20, scale=20):
+    '''a delay Doppler colour composite, read only inside a distance window
+
+    arguments:
+        path: folder holding the analysis files
+        transect: full transect name, e.g. CLX/MKB2o/R66a
+        x0, x1: distances (km) at the start and end of the radargram; apertures run
+                from x0 towards x1 and are spaced increment m apart
+        window: optional (distance_min, distance_max) in km to read
+        increment: aperture spacing in m
+        scale: normalized values at or above scale are saturated
+    returns:
+        uint8 xarray (band, y, x) composite with ascending distance (x) and delay (y, microseconds) coordinates.
+        As in the figures so far, the row labelled with the kth delay holds the kth delay from the end.
+    '''
+    key = (os.path.abspath(dd_file(path, transect)), x0, x1,
+           None if window is None else tuple(window), increment, scale)
+    if key in _composites:
+        return _composites[key]
+
+    with Dataset(dd_file(path, transect), 'r') as ds:
+        channels = ds.groups['channels']
+        fast_time = channels.variables['fast_time'][:]
+        cube = channels.variables['normalized_max_in_bin']
+        apertures = cube.shape[0]
+        start, stop = aperture_range(apertures, x0, x1, window=window, increment=increment)
+        # with x0 > x1 distance falls along the transect, so position k holds aperture apertures - 1 - k
+        reverse = x0 > x1
+        first, last = (apertures - stop, apertures - start) if reverse else (start, stop)
+        data = np.ma.filled(cube[first:last, :, :], 0)
+
+    # (aperture, fast_time) planes seen as (y, x) views, flipped in y and, if reversed, in x
+    view = (slice(None, None, -1), slice(None, None, -1) if reverse else slice(None))
+    rgb = np.empty((3, data.shape[1], data.shape[0]), dtype='uint8')
+    red = np.add(data[:, :, 0], data[:, :, 1])
+    red /= 2
+    red /= scale
+    blue = data[:, :, 2] / scale
+    for band, values in ((0, red), (2, blue)):
+        np.clip(values, 0, 1, out=values)
+        values *= 255
+        rgb[band] = values.T[view]
+    rgb[1] = rgb[0]
+
+    distance = min(x0, x1) + np.arange(start, stop) * (increment / 1000)
+    composite = xr.DataArray(rgb, dims=['band', 'y', 'x'],
+                             coords={'y': 1e6 * np.asarray(fast_time) / 2, 'x': distance})
+    _composites[key] = composite
+    return composite
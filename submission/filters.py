@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+'''NaN aware spatial filters for gridded products
+
+Isotropic Gaussian, cosine arch and boxcar filters with the full width given in
+projected units, following GMT grdfilter's definitions (-D0): the Gaussian has
+width = 6 sigma, and all kernels are truncated at width/2.
+
+NaN nodes are handled by normalised convolution: the filtered value is the
+weighted mean of the valid nodes under the kernel, as grdfilter computes it.
+Convolutions are done with FFTs, several grids of the same shape are filtered
+in one batched call, and large grids are processed in tiles with a halo of the
+kernel radius so memory stays bounded.
+
+Can also be run as a replacement for 'gmt grdfilter in.grd -Fc30e3 -D0 -Gout.grd':
+    python3 filters.py in.grd -Fc30e3 -Gout.grd
+'''
+
+import argparse
+
+import numpy as np
+import xarray as xr
+from scipy.signal import fftconvolve
+
+KINDS = {'g': 'gaussian', 'c': 'cosine', 'b': 'boxcar'}
+
+
+def kernel(kind, width, spacing):
+    '''filter weights on a square of nodes
+
+    arguments:
+        kind: 'gaussian', 'cosine' or 'boxcar' (or GMT's 'g', 'c', 'b')
+        width: full width of the filter in projected units
+        spacing: grid node spacing in projected units
+    '''
+    kind = KINDS.get(kind, kind)
+    radius = width / 2
+    n = int(np.floor(radius / spacing))
+    offsets = spacing * np.arange(-n, n + 1)
+    d = np.hypot(*np.meshgrid(offsets, offsets))
+    if kind == 'gaussian':
+        weights = np.exp(-0.5 * (d / (width / 6))**2)
+    elif kind == 'cosine':
+        weights = 0.5 * (1 + np.cos(np.pi * d / radius))
+    elif kind == 'boxcar':
+        weights = np.ones_like(d)
+    else:
+        raise ValueError(f'unknown filter {kind}')
+    weights[d > radius] = 0
+    return weights
+
+
+def _convolve(values, valid, weights):
+    '''normalised convolution of a (nfields, ny, nx) stack'''
+    stack = np.concatenate([np.where(valid, values, 0), valid]).astype('float64')
+    smoothed = fftconvolve(stack, weights[np.newaxis], mode='same', axes=(1, 2))
+    total, norm = np.split(smoothed, 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(norm > 1e-9 * weights.sum(), total / norm, np.nan)
+
+
+def filter_grids(grids, kind='gaussian', width=None, spacing=None, tile=2048):
+    '''filters one or more grids of the same shape
+
+    arguments:
+        grids: an xarray DataArray or numpy array, or a list of them, shaped (ny, nx)
+        kind: 'gaussian', 'cosine' or 'boxcar' (or GMT's 'g', 'c', 'b')
+        width: full width of the filter in projected units
+        spacing: grid node spacing, taken from the x coordinate of a DataArray if not given
+        tile: grids larger than tile x tile nodes are filtered in tiles of this size
+    returns:
+        filtered grid(s), matching the input type
+    '''
+    single = not isinstance(grids, (list, tuple))
+    if single:
+        grids = [grids]
+    if spacing is None:
+        spacing = float(abs(grids[0].x[1] - grids[0].x[0]))
+
+    weights = kernel(kind, width, spacing)
+    halo = weights.shape[0] // 2
+
+    # only a tile and its halo of every grid is held in float64 at a time, read by window
+    # from the inputs (which may be memory mapped or lazily loaded), so memory follows the tile size
+    ny, nx = grids[0].shape
+    filtered = [np.empty((ny, nx), dtype=grid.dtype if isinstance(grid, xr.DataArray) else 'float64') for grid in grids]
+    for i0 in range(0, ny, tile):
+        for j0 in range(0, nx, tile):
+            i1, j1 = min(i0 + tile, ny), min(j0 + tile, nx)
+            a0, b0 = max(i0 - halo, 0), max(j0 - halo, 0)
+            a1, b1 = min(i1 + halo, ny), min(j1 + halo, nx)
+            values = np.stack([np.asarray(_window(grid, a0, a1, b0, b1), dtype='float64') for grid in grids])
+            result = _convolve(values, np.isfinite(values), weights)
+            for output, part in zip(filtered, result):
+                output[i0:i1, j0:j1] = part[i0-a0:i1-a0, j0-b0:j1-b0]
+
+    outputs = []
+    for grid, result in zip(grids, filtered):
+        if isinstance(grid, xr.DataArray):
+            result = grid.copy(data=result)
+        outputs.append(result)
+    return outputs[0] if single else outputs
+
+
+def _window(grid, a0, a1, b0, b1):
+    '''rows a0:a1 and columns b0:b1 of a grid, read without loading the rest of it'''
+    if isinstance(grid, xr.DataArray):
+        return grid[a0:a1, b0:b1].values
+    return grid[a0:a1, b0:b1]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='NaN aware grid filter, a drop in for gmt grdfilter -D0')
+    parser.add_argument('ingrid')
+    parser.add_argument('-F', dest='filter', required=True, help='filter type (g, c or b) and full width, e.g. c30e3')
+    parser.add_argument('-G', dest='outgrid', required=True)
+    args = parser.parse_args()
+
+    grid = xr.open_dataarray(args.ingrid)
+    filtered = filter_grids(grid, kind=args.filter[0], width=float(args.filter[1:]))
+    grid.close()
+    filtered.to_netcdf(args.outgrid)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+'''Flowlines and particle paths traced through the surface velocity grids
+
+Many seed points (for example every sample of a radar transect) are integrated
+at once with fourth order Runge-Kutta steps, looking velocities up by bilinear
+interpolation in the float32 VX and VY grids written by process_ice_flow_data.
+Flowlines follow the flow direction in steps of fixed length; particle paths
+follow the velocity in steps of fixed time. Tracing upstream gives where the ice
+at each seed came from.
+
+Traces are written as GMT multisegment files, one segment per seed:
+    python3 flowlines.py CLX/R66a CLX/R68b -G flowlines.gmt
+    python3 flowlines.py --pst-list ../cuestas/pst_list.txt --every 20
+'''
+
+import argparse
+import os
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from products import product
+
+METADATA = 'projected_images_COLDEX/metadata'
+
+
+'''velocity components vx, vy (float32, m/yr) on nodes x0 + j*dx, y0 + i*dy'''
+Field = namedtuple('Field', ['x0', 'y0', 'dx', 'dy', 'vx', 'vy'])
+
+
+def velocity_field(vx, vy):
+    '''Field from VX and VY xarray grids with ascending x and y coordinates'''
+    return Field(float(vx.x[0]), float(vx.y[0]), float(vx.x[1] - vx.x[0]), float(vx.y[1] - vx.y[0]),
+                 np.ascontiguousarray(vx.values, dtype='float32'), np.ascontiguousarray(vy.values, dtype='float32'))
+
+
+def bilinear(field, x, y):
+    '''bilinearly interpolated velocity at x, y; NaN outside the grid or next to missing nodes'''
+    ny, nx = field.vx.shape
+    fx = (x - field.x0) / field.dx
+    fy = (y - field.y0) / field.dy
+    inside = (fx >= 0) & (fx <= nx - 1) & (fy >= 0) & (fy <= ny - 1)
+    i = np.clip(np.floor(np.where(inside, fy, 0)).astype('int64'), 0, ny - 2)
+    j = np.clip(np.floor(np.where(inside, fx, 0)).astype('int64'), 0, nx - 2)
+    ty = np.where(inside, fy - i, 0).astype('float32')
+    tx = np.where(inside, fx - j, 0).astype('float32')
+
+    def lookup(grid):
+        value = ((grid[i, j] * (1 - tx) + grid[i, j + 1] * tx) * (1 - ty)
+                 + (grid[i + 1, j] * (1 - tx) + grid[i + 1, j + 1] * tx) * ty)
+        return np.where(inside, value, np.nan)
+    return lookup(field.vx), lookup(field.vy)
+
+
+def load_velocity(region=None, margin=0, targ=None):
+    '''the velocity field, read only inside region grown by margin'''
+    if region is not None:
+        region = [region[0] - margin, region[1] + margin, region[2] - margin, region[3] + margin]
+    return velocity_field(product('velocity_x', region=region, targ=targ),
+                          product('velocity_y', region=region, targ=targ))
+
+
+def trace(x, y, field, step=1000, nsteps=500, upstream=True, mode='flowline', min_speed=0.01):
+    '''traces every seed point through the velocity field
+
+    arguments:
+        x, y: seed coordinates
+        field: Field, see velocity_field
+        step: step length in m for flowlines, or time step in years for particle paths
+        nsteps: maximum number of steps
+        upstream: trace against the flow, towards where the ice came from
+        mode: 'flowline' to follow the flow direction, 'particle' to follow the velocity
+        min_speed: seeds stop where the speed falls below this, in m/yr
+    returns:
+        x, y arrays shaped (nsteps + 1, nseeds), NaN after a trace leaves the grid or stalls
+    '''
+    sign = -1 if upstream else 1
+
+    def rate(px, py):
+        vx, vy = bilinear(field, px, py)
+        speed = np.hypot(vx, vy)
+        stalled = ~(speed >= min_speed)
+        if mode == 'flowline':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                vx, vy = vx / speed, vy / speed
+        vx = np.where(stalled, np.nan, vx)
+        vy = np.where(stalled, np.nan, vy)
+        return sign * vx, sign * vy
+
+    xs = np.full((nsteps + 1, len(x)), np.nan)
+    ys = np.full((nsteps + 1, len(x)), np.nan)
+    xs[0], ys[0] = x, y
+    active = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    for n in range(nsteps):
+        if len(active) == 0:
+            break
+        px, py = xs[n, active], ys[n, active]
+        k1x, k1y = rate(px, py)
+        k2x, k2y = rate(px + 0.5 * step * k1x, py + 0.5 * step * k1y)
+        k3x, k3y = rate(px + 0.5 * step * k2x, py + 0.5 * step * k2y)
+        k4x, k4y = rate(px + step * k3x, py + step * k3y)
+        nx = px + step / 6 * (k1x + 2 * k2x + 2 * k3x + k4x)
+        ny = py + step / 6 * (k1y + 2 * k2y + 2 * k3y + k4y)
+        moving = np.isfinite(nx) & np.isfinite(ny)
+        active = active[moving]
+        xs[n + 1, active] = nx[moving]
+        ys[n + 1, active] = ny[moving]
+    return xs, ys
+
+
+def write_gmt(path, xs, ys, labels=None):
+    '''writes traces as a GMT multisegment file, one segment per seed'''
+    with open(path, 'w') as f:
+        for k in range(xs.shape[1]):
+            keep = np.isfinite(xs[:, k])
+            if keep.sum() < 2:
+                continue
+            label = labels[k] if labels is not None else k
+            f.write(f'> -L{label}\n')
+            np.savetxt(f, np.column_stack([xs[keep, k], ys[keep, k]]), fmt='%.1f', delimiter='\t')
+
+
+def transect_seeds(transects, every=1, orig=None):
+    '''seed points along transects from their projected radargram metadata
+
+    returns:
+        x, y and a label for every seed, 'transect:sample'
+    '''
+    orig = orig or os.getcwd().replace('code', 'orig')
+    x, y, labels = [], [], []
+    for transect in transects:
+        path = os.path.join(orig, METADATA, f'{transect.replace("/", "_")}_image.csv')
+        if not os.path.exists(path):
+            print(f'could not find {path}')
+            continue
+        metadata = pd.read_csv(path, usecols=['EPSG 3031 Easting [m]', 'EPSG 3031 Northing [m]']).iloc[::every]
+        x.append(metadata['EPSG 3031 Easting [m]'].to_numpy())
+        y.append(metadata['EPSG 3031 Northing [m]'].to_numpy())
+        labels += [f'{transect}:{i}' for i in metadata.index]
+    if not x:
+        return np.array([]), np.array([]), []
+    return np.concatenate(x), np.concatenate(y), labels
+
+
+def read_pst_list(path):
+    '''transect names, one per line'''
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='traces flowlines or particle paths from radar transects through the surface velocity')
+    parser.add_argument('transects', nargs='*', help='transects to seed from, e.g. CLX/R66a')
+    parser.add_argument('--pst-list', help='file listing transects to seed from, one per line')
+    parser.add_argument('--every', type=int, default=10, help='seed from every nth transect sample')
+    parser.add_argument('--mode', choices=['flowline', 'particle'], default='flowline')
+    parser.add_argument('--step', type=float, default=1000, help='step in m (flowline) or years (particle)')
+    parser.add_argument('--nsteps', type=int, default=500)
+    parser.add_argument('--downstream', action='store_true', help='trace with the flow instead of against it')
+    parser.add_argument('--margin', type=float, default=300e3, help='velocity read beyond the seeds, in m')
+    parser.add_argument('-G', dest='outfile', default=None, help='output file, defaults to targ/flowlines.gmt')
+    args = parser.parse_args()
+
+    transects = list(args.transects)
+    if args.pst_list:
+        transects += read_pst_list(args.pst_list)
+    x, y, labels = transect_seeds(transects, every=args.every)
+    if len(x) == 0:
+        parser.error('no seed points')
+
+    field = load_velocity(region=[x.min(), x.max(), y.min(), y.max()], margin=args.margin)
+    xs, ys = trace(x, y, field, step=args.step, nsteps=args.nsteps, upstream=not args.downstream, mode=args.mode)
+    outfile = args.outfile or os.path.join(os.getcwd().replace('code', 'targ'), 'flowlines.gmt')
+    write_gmt(outfile, xs, ys, labels)
+    print(f'traced {len(x)} seeds from {len(transects)} transects to {outfile}')
+
+
+if __name__ == "__main__":
+    main()
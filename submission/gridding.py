@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+'''Array level gridding pipeline: block reduce, interpolate, filter and mask
+
+Shared by bin_and_grid_fields in process_data and by the tiled gridding in
+tiling.py. Nothing here writes files.
+'''
+
+import numpy as np
+
+from blockstats import block_fields
+from natural_neighbour import sibson_weights, sibson_apply, to_dataarray
+from coverage import coverage_mask
+from filters import filter_grids
+
+
+def sibson_interpolate(bx, by, bz, region, spacing, max_radius=None):
+    '''natural neighbour interpolation of block values shaped (nfields, nblocks)'''
+    return sibson_apply(sibson_weights(bx, by, region, spacing, max_radius=max_radius), bz)
+
+
+def group_by_missing(valid):
+    '''groups field indices whose valid entries (points or blocks) are identical'''
+    groups = []
+    for i in range(len(valid)):
+        for group in groups:
+            if np.array_equal(valid[group[0]], valid[i]):
+                group.append(i)
+                break
+        else:
+            groups.append([i])
+    return groups
+
+
+def grid_fields(x, y, values, region, blockspacing, grdspacing, maxradius, filter, rms=False, weights=None,
+        interpolate=sibson_interpolate, max_radius=None):
+    '''grids several fields sharing the same points
+
+    Every point with a value of any field is assigned to a block once, and block
+    positions come from all of them, so fields missing values at different points
+    still share positions. Interpolation weights and the coverage mask depend only
+    on which blocks hold values, so they are computed once for every group of fields
+    occupying the same blocks, and applied to all fields of the group together.
+    Fields occupying different blocks do not share them: roughness, for example,
+    has no value at the zero corners, so it is interpolated apart from thickness.
+
+    arguments:
+        x, y: point coordinates
+        values: field values shaped (nfields, npoints), NaN where missing
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        blockspacing: the size of the bins used to reduce the input data in projected units
+        grdspacing: the size of final gridded cells in projected units
+        maxradius: how far from datapoints interpolated values are permitted in projected units
+        filter: size of the Gaussian filter to apply to the data in projected units
+        rms: Boolean to process data as RMS
+        weights: optional point weights for the block means, see blockstats.block_fields
+        interpolate: function(bx, by, bz, region, spacing, max_radius) returning (nfields, ny, nx) grids
+        max_radius: optional cap on the Sibson lending radius in projected units, see
+                    natural_neighbour.sibson_weights. It bounds the cost in large gaps but
+                    changes values inside the mask too, so gridding is exact without it
+    returns:
+        list of (filtered, masked) xarray grids, one pair per field
+    '''
+    valid = np.isfinite(values) & np.isfinite(x) & np.isfinite(y)
+    used = valid.any(axis=0)
+    x, y, values, valid = x[used], y[used], values[:, used], valid[:, used]
+    bx, by, bz = block_fields(x, y, values, region, blockspacing, rms=rms,
+                              weights=None if weights is None else weights[used])
+    occupied = np.isfinite(bz)
+
+    results = [None] * len(values)
+    for group in group_by_missing(occupied):
+        keep = occupied[group[0]]
+        if not keep.any():
+            empty = to_dataarray(np.full(_shape(region, grdspacing), np.nan), region, grdspacing)
+            for i in group:
+                results[i] = (empty, empty.copy())
+            continue
+        fields = interpolate(bx[keep], by[keep], bz[group][:, keep], region, grdspacing, max_radius=max_radius)
+        interpolated = [to_dataarray(field, region, grdspacing) for field in fields]
+        points = valid[group].any(axis=0)
+        mask = coverage_mask(x[points], y[points], region, grdspacing, maxradius)
+        filtered = filter_grids(interpolated, kind='gaussian', width=filter, spacing=grdspacing)
+        for i, grd_fil in zip(group, filtered):
+            results[i] = (grd_fil, grd_fil * mask)
+    return results
+
+
+def _shape(region, spacing):
+    return (int(round((region[3] - region[2]) / spacing)) + 1,
+            int(round((region[1] - region[0]) / spacing)) + 1)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+'''Parallel ingestion of survey files
+
+Each file (or UTIG folder) is an independent job: read, reproject and compute
+roughness. Jobs are run on a process pool and results are returned in the order
+the jobs were given, so concatenating them gives the same frames as reading the
+files one after another.
+'''
+
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pyproj import Transformer
+
+from cache import cached, cache_key, remember
+
+'''func is called as func(path, **kwargs); cached jobs go through cache.cached'''
+Job = namedtuple('Job', ['name', 'func', 'path', 'kwargs', 'cached'], defaults=[{}, True])
+
+
+def _run(job):
+    '''runs a single job, returning the cache key, the result and the time taken'''
+    start = time.time()
+    if job.cached:
+        key = cache_key(job.func, job.path, **job.kwargs)
+        data = cached(job.func, job.path, key=key, **job.kwargs)
+    else:
+        key = None
+        data = job.func(job.path, **job.kwargs)
+    return key, data, time.time() - start
+
+
+def run_jobs(jobs, workers=None):
+    '''runs ingestion jobs, in parallel if workers > 1
+
+    arguments:
+        jobs: list of Job tuples
+        workers: number of worker processes, defaults to the number of cores.
+                 1 runs every job in this process
+    returns:
+        dictionary of results keyed on job name, in the same order as jobs
+    '''
+    workers = workers or os.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+    start = time.time()
+
+    if workers == 1:
+        outputs = [_run(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            outputs = list(pool.map(_run, jobs))
+
+    results = {}
+    print(f'Ingested {len(jobs)} sources on {workers} worker(s) in {time.time() - start:.1f} s')
+    for job, (key, data, seconds) in zip(jobs, outputs):
+        if key is not None:
+            remember(key, data)
+        print(f'    {job.name:<50} {len(data):>10} rows {seconds:8.1f} s')
+        results[job.name] = data
+    return results
+
+
+def expand_region(region, halo=0):
+    '''grows a projected region (x_min, x_max, y_min, y_max) by halo on every side'''
+    return [region[0] - halo, region[1] + halo, region[2] - halo, region[3] + halo]
+
+
+def geographic_bounds(region, epsg=3031):
+    '''cheap geographic bounds enclosing a projected region
+
+    Only defined for south polar stereographic projections, where longitude is the
+    bearing from the pole and latitude depends only on the distance from the pole.
+
+    arguments:
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        epsg: the grid projection EPSG identifier
+    returns:
+        (lat_min, lat_max, lon_centre, lon_min, lon_max), with longitudes relative to
+        lon_centre and None when the region holds the pole. None if epsg is not 3031.
+    '''
+    if epsg != 3031:
+        return None
+
+    x_min, x_max, y_min, y_max = region
+    corners_x = np.array([x_min, x_min, x_max, x_max])
+    corners_y = np.array([y_min, y_max, y_min, y_max])
+    r_max = np.max(np.hypot(corners_x, corners_y))
+    r_min = np.hypot(np.clip(0, x_min, x_max), np.clip(0, y_min, y_max))
+
+    transformer = Transformer.from_crs(epsg,4326,always_xy=True)
+    _, lats = transformer.transform([0, 0], [r_min, r_max])
+    lat_min, lat_max = min(lats) - 1e-6, max(lats) + 1e-6
+
+    if r_min == 0:
+        return lat_min, lat_max, None, None, None
+
+    centre = np.degrees(np.arctan2((x_min + x_max)/2, (y_min + y_max)/2))
+    bearings = _wrap(np.degrees(np.arctan2(corners_x, corners_y)) - centre)
+    return lat_min, lat_max, centre, bearings.min() - 1e-6, bearings.max() + 1e-6
+
+
+def _wrap(angle):
+    '''wraps angles in degrees into [-180, 180)'''
+    return (np.asarray(angle) + 180) % 360 - 180
+
+
+def geographic_mask(lon, lat, bounds):
+    '''boolean mask of points inside the bounds from geographic_bounds'''
+    lat_min, lat_max, centre, lon_min, lon_max = bounds
+    mask = (lat >= lat_min) & (lat <= lat_max)
+    if centre is not None:
+        relative = _wrap(lon - centre)
+        mask &= (relative >= lon_min) & (relative <= lon_max)
+    return mask
+
+
+def projected_mask(x, y, region):
+    '''boolean mask of points inside a projected region'''
+    return (x >= region[0]) & (x <= region[1]) & (y >= region[2]) & (y <= region[3])
+
+
+def prefilter(lon='LON', lat='LAT', region=None, halo=0, epsg=3031):
+    '''returns a function that drops rows well outside region + halo, for use on chunks
+    before reprojection. Returns None if no cheap test is available.'''
+    if region is None:
+        return None
+    bounds = geographic_bounds(expand_region(region, halo), epsg=epsg)
+    if bounds is None:
+        return None
+    def reduce(chunk):
+        return chunk.loc[geographic_mask(chunk[lon].to_numpy(), chunk[lat].to_numpy(), bounds)]
+    return reduce
+
+
+def read_csv_in_region(path, lon='LON', lat='LAT', region=None, halo=0, epsg=3031, chunksize=2**20, **kwargs):
+    '''reads a csv file in chunks, dropping rows outside region + halo before they accumulate
+
+    arguments:
+        path: path to the csv file
+        lon, lat: names of the geographic coordinate columns
+        region: array with projected coordinates with x_min, x_max, y_min, y_max, or None to keep everything
+        halo: distance to grow the region by in projected units
+        epsg: the grid projection EPSG identifier
+        kwargs: passed to pandas.read_csv
+    returns:
+        pandas dataframe
+    '''
+    reduce = prefilter(lon=lon, lat=lat, region=region, halo=halo, epsg=epsg)
+    if reduce is None:
+        return pd.read_csv(path, **kwargs)
+
+    chunks = []
+    with pd.read_csv(path, chunksize=chunksize, **kwargs) as reader:
+        for chunk in reader:
+            chunks.append(reduce(chunk))
+    return pd.concat(chunks)
@@ -4,15 +4,14 @@ import os
 import io
 import pygmt
 import xarray as xr
-from PIL import Image
-Image.MAX_IMAGE_PIXELS = None
 import rioxarray as rxa
 import numpy as np
 import pandas as pd
 import re
-from netCDF4 import Dataset
 from h5py import File
 from matplotlib import pyplot as plt
+from radargram import read_metadata, load_radargram, calibrate
+from delay_doppler import read_delay_doppler
 
 
 def read_grd(path):
@@ -20,85 +19,11 @@ def read_grd(path):
     raster = rxa.open_rasterio(path)
     return raster.sel(band=1)
 
-def read_nc(path,pst,x0=0,x1=0,increment=20,scale=20):
-    ds = Dataset(os.path.join(path,f'{pst.replace("/","_")}_dd_analysis.nc'),'r',format="NETCDF4")
-    fast_time = ds['channels'].variables['fast_time'][:]
-    apertures = ds['channels'].variables['normalized_max_in_bin'].shape[0]
-
-# Extract variables
-    data = ds.groups["channels"].variables["normalized_max_in_bin"][:]  # Shape (aperture, fast_time, direction)
-    ds.close()
-
-
-# Extract the three directions as RGB channels
-    r = ((data[:, :, 0] + data[:, :, 1]))/2 # Red channel
-    g = r  # Green channel
-    b = data[:, :, 2]  # Blue channel
-
-
-# Stack into an RGB image (PyGMT expects a grid, so we reshape as needed)
-    rgb = np.stack([r, g, b], axis=-1)  # Shape (aperture, fast_time, 3)
-
-# Normalize the data for RGB - controls contrast
-    rgb = rgb / scale
-    rgb = np.clip(rgb, a_min=0, a_max=1)
-    rgb = (rgb * 255).astype('uint8')
-
-# Convert to xarray DataArray for PyGMT compatibility
-    rgb_xr = xr.DataArray(np.transpose(rgb), dims=["band","y", "x"])
-
-    distance = np.arange(0,apertures,1)*(increment/1000)
-
-    if x0 > x1:
-        distance = distance[::-1] + min([x0,x1])
-        rgb_xr[:,:,::-1]
-    else:
-        distance = distance + min([x0,x1])
-
-    #rgb_xr = rgb_xr.copy().assign_coords({"y": (0.2*np.flipud(fast_time))})
-    rgb_xr.coords["y"] = ("y", 1e6 * fast_time/2)
-    rgb_xr = rgb_xr.assign_coords(y=rgb_xr.y[::-1])
-    rgb_xr = rgb_xr[:, ::-1, :]
-    rgb_xr.coords["x"] = ("x", distance)
-
-    return rgb_xr
-
 def read_layer(path,flight='A10B',origin_x=964892.757,origin_y=384953.176):
     data = pd.read_csv(path,comment='#')
     data['Distance'] = (np.sqrt((data['projection_x_coordinate (m)']-origin_x)**2 + (data['projection_y_coordinate (m)']-origin_y)**2))/1000
     return data[data['trajectory_id'].str.contains(flight)]
 
-def read_radargram(path,transect):
-    radargram_path=os.path.join(path,'image',f'{transect.replace("/","_")}_image.jpg')
-    img = np.array(np.asarray(Image.open(radargram_path)))[:,:,0]
-    radar=140*(img.astype('float')-255)/256
-    nrows, ncols = radar.shape
-
-
-    metadata_path=os.path.join(path,'image',f'{transect.replace("/","_")}_image.csv')
-    metadata=pd.read_csv(os.path.join(path,'metadata',f'{transect.replace("/","_")}_image.csv'))
-    x0=metadata['Displayed_distance [km]'].iloc[0]
-    x1=metadata['Displayed_distance [km]'].iloc[-1]
-    y0=metadata['Elevation of image bottom [m]'].iloc[0]
-    y1=metadata['Elevation of image top [m]'].iloc[0]
-    region=[min([x0,x1]),max([x0,x1]),y0,y1]
-
-
-    XYD = metadata[['EPSG 3031 Easting [m]','EPSG 3031 Northing [m]','Displayed_distance [km]']]
-
-    x_spacing = abs((x1 - x0)/ncols)
-    y_spacing = abs((y1 - y0)/nrows)
-
-    x_vals = np.linspace(x0, x1, ncols)
-    y_vals = np.linspace(y1, y0, nrows)
-
-    X, Y = np.meshgrid(x_vals, y_vals)
-
-    xyz_table = np.column_stack((X.ravel(), Y.ravel(), radar.ravel()))
-
-    radar_grd = pygmt.xyz2grd(xyz_table,region=region,spacing=f'{x_spacing}/{y_spacing}')
-    return radar_grd, region, XYD
-
 def get_bounds(line,length=45):
 
     mapping={
@@ -163,10 +88,11 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
 # make Delay Doppler profile
     dd_transect = 'CLX/R66a'
     dd_full_transect = f'{dd_transect.split("/")[0]}_MKB2o_{dd_transect.split("/")[1]}'
-    data, bounds, xyd = read_radargram(os.path.join(orig,'projected_images_COLDEX'),dd_transect)
+    bounds, _ = read_metadata(os.path.join(orig,'projected_images_COLDEX'),dd_transect)
 
     DelayDoppler_path=os.path.join(orig,'DelayDoppler')
-    dd = read_nc(DelayDoppler_path,dd_full_transect,x0=bounds[0],x1=bounds[1],scale=15)
+    region=[550,850,25,55]
+    dd = read_delay_doppler(DelayDoppler_path,dd_full_transect,x0=bounds[0],x1=bounds[1],window=region[:2],scale=15)
     spec = pd.read_csv(os.path.join(DelayDoppler_path,f'{dd_full_transect}_specularity.gmt'),sep='\t')
     spec['distance'] = np.sqrt((spec['x'] - origin_x)**2 + (spec['y'] - origin_y)**2)/1000
     df = spec[['x','y','distance']]
@@ -175,8 +101,6 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
 # plot Delay Doppler profile
     #fig.grdimage(dd,region=[740,840,30,55],projection=f'X{width}i/-{height*2}i')
 
-    region=[550,850,25,55]
-
     fig.basemap(region=region,projection=f'X{width}i/-{height*2}i',frame=['af','WSne','y+ldelay (µsec)'])
 
     fig.plot(x=region[0],y=region[2]-10,direction=[0,10],style='v0.4i+e+h0+a30+gdodgerblue+p1p,dodgerblue',no_clip=True,pen='8p,dodgerblue')
@@ -237,13 +161,15 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
 
         fig.basemap(frame=['tblr'], region=region, projection=f'X{width}i/{1.5*height}i')
 
-        data, bounds, xyd = read_radargram(os.path.join(orig,'projected_images_COLDEX'),line)
+        bounds, metadata = read_metadata(os.path.join(orig,'projected_images_COLDEX'),line)
+        xyd = metadata[['EPSG 3031 Easting [m]','EPSG 3031 Northing [m]','Displayed_distance [km]']]
 
         xyd_displayed = xyd[xyd['Displayed_distance [km]'].between(x0,x1,inclusive='both')].copy()
         xyd_displayed.drop(columns=['Displayed_distance [km]'],inplace=True)
         xyd_displayed.to_csv(os.path.join(targ,f'{line.replace("/","_")}.cuestas.xy'),header=False,index=False,sep='\t')
 
-        fig.grdimage(data)
+        radar = load_radargram(os.path.join(orig,'projected_images_COLDEX'),line,region=region,size=(width,1.5*height),targ=targ)
+        fig.grdimage(calibrate(radar))
 
         z = z1 - z0
         x = 1000*(x1-x0)
@@ -17,16 +17,16 @@ fi
 #Getting pointers to original data
 #srf=$TARG/srfelv.xyz_val.grd
 #srf=$ORIG/rema/rema_mosaic_1km_v2.0_filled_cop30_dem.tif
-srf=$TARG/srfelv.xyz_val.tif
+srf=$TARG/srfelv.tif
 vel=$TARG/Mouginot2019
 sanderson=$ORIG/Sanderson_2023/EA_H3_162ka.csv
 bnd=$ORIG/clipped_bnd.gmt
 data=$ORIG/projected_images_COLDEX
-bed=$TARG/bedelv.xyz_val.tif
-thk=$TARG/icethk.xyz_val.tif
-spec=$TARG/specularity_content.xyz_val.tif
+bed=$TARG/bedelv.tif
+thk=$TARG/icethk.tif
+spec=$TARG/specularity_content.tif
 basal=$TARG/fract_basal_ice_percent.tif
-rmsd=$TARG/roughness.xyz_val.tif
+rmsd=$TARG/roughness.tif
 hipass=$TARG/hipass_bed.xyz
 
 #Setting up figure geometry for Supplementary Figure 2
@@ -94,7 +94,7 @@ gmt grdgradient $srf -D -S$TARG/srfgrad.grd -G$TARG/srfslopedirection.grd
 echo "gmt grdmath $thk 9.8 MUL 917 MUL $TARG/srfgrad.grd MUL 1000 DIV = $TARG/tau.grd "
 gmt grdmath $thk 9.8 MUL 917 MUL $TARG/srfgrad.grd MUL 1000 DIV = $TARG/tau.grd 
 gmt grdinfo $TARG/tau.grd
-gmt grdfilter $TARG/tau.grd -Fc30e3 -D0 -G$TARG/tau.fil.grd
+python3 filters.py $TARG/tau.grd -Fc30e3 -G$TARG/tau.fil.grd
 gmt grdinfo $TARG/srfgrad.grd
 gmt grdinfo $thk
 
@@ -3,11 +3,11 @@
 import os 
 import pygmt
 import xarray as xr
-from PIL import Image
-Image.MAX_IMAGE_PIXELS = None
 import rioxarray as rxa
 import numpy as np
 import pandas as pd
+from radargram import read_metadata, load_radargram, calibrate
+from transect_index import build_index, geometry
 
 def read_grd(path):
     # Load the GeoTIFF file as an xarray DataArray
@@ -15,43 +15,10 @@ def read_grd(path):
     print(raster)
     return raster.sel(band=1)
 
-def read_radargram(path,transect):
-    radargram_path=os.path.join(path,'image',f'{transect.replace("/","_")}_image.jpg')
-    img = np.array(np.asarray(Image.open(radargram_path)))[:,:,0]
-    print(img)
-    radar=140*(img.astype('float')-255)/256
-    nrows, ncols = radar.shape
-
-
-    metadata_path=os.path.join(path,'image',f'{transect.replace("/","_")}_image.csv')
-    metadata=pd.read_csv(os.path.join(path,'metadata',f'{transect.replace("/","_")}_image.csv'))
-    x0=metadata['Displayed_distance [km]'].iloc[0]
-    x1=metadata['Displayed_distance [km]'].iloc[-1]
-    y0=metadata['Elevation of image bottom [m]'].iloc[0]
-    y1=metadata['Elevation of image top [m]'].iloc[0]
-    region=[x0,x1,y0,y1]
-
-    x_spacing = abs((x1 - x0)/ncols)
-    y_spacing = abs((y1 - y0)/nrows)
-
-    x_vals = np.linspace(x0, x1, ncols)
-    y_vals = np.linspace(y1, y0, nrows)
-
-    X, Y = np.meshgrid(x_vals, y_vals)
-
-    xyz_table = np.column_stack((X.ravel(), Y.ravel(), radar.ravel()))
-
-    radar_grd = pygmt.xyz2grd(xyz_table,region=region,spacing=f'{x_spacing}/{y_spacing}')
-    return radar_grd, region
-
-def read_psts(path=None):
-    transects = {}
-    files = os.listdir(path)
-    for f in files:
-        if 'csv' in f:
-            name=f'{f.split("_")[0]}/{f.split("_")[1]}'
-            transects[name] = pd.read_csv(os.path.join(path,f))
-    return transects
+def read_psts(path=None,tolerance=100):
+    ''' Simplified tracks of every transect, from the transect index '''
+    index = build_index(path)
+    return {name: geometry(index,name,tolerance=tolerance) for name in index}
 
 def plot_transect(fig,transect,geo=False,pen='0.5,dimgray'):
     if geo:
@@ -129,7 +96,8 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
     fig.text(x=166.67,y=-77.83,text='McMurdo Station',justify='TR',font='8p',offset='J0.1c+v')
 
     #make radargram
-    data,bounds=read_radargram(os.path.join(orig,'projected_images_COLDEX'),'CLX/R66a')
+    radargrams=os.path.join(orig,'projected_images_COLDEX')
+    bounds,_=read_metadata(radargrams,'CLX/R66a')
 
     x0=bounds[0]
     x1=bounds[1]
@@ -154,7 +122,7 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
     fig.shift_origin(xshift='0.5i',yshift='-2.1i')
     fig.basemap(region=[bounds[0],bounds[1],z0,z1],frame=['af','WSne','x+lDistance from Dome A origin (km)','y+lWGS 84 Elevation (m)'],projection=f'X{width}i/{height}i')
     pygmt.makecpt(cmap='gray',series='-130/-65/5',continuous=True)
-    fig.grdimage(data,dpi='i')
+    fig.grdimage(calibrate(load_radargram(radargrams,'CLX/R66a',region=[bounds[0],bounds[1],z0,z1],size=(width,height),targ=targ)),dpi='i')
     fig.text(position='TL',text=f'Transect {focus_line}',justify='TL',font='8p,white',offset='J0.1c')
     fig.text(position='BR',text=f'{aspect:.1f}x vertical exageration',justify='BR',font='8p,gray',offset='J0.1c')
     fig.text(x=800,y=1000,text=f'South Pole Basin',justify='MC',font='6p,Helvetica-Bold,ivory')
@@ -168,14 +136,14 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
     
     fig.shift_origin(yshift="1.1i")
     pygmt.makecpt(cmap='gray',series='-130/-90/5',continuous=True)
-    fig.grdimage(data,dpi='i',region=basal_unit_insert2,projection=f'X{width/2}i/{height}i')
+    fig.grdimage(calibrate(load_radargram(radargrams,'CLX/R66a',region=basal_unit_insert2,size=(width/2,height),targ=targ)),dpi='i',region=basal_unit_insert2,projection=f'X{width/2}i/{height}i')
     fig.text(position='BL',text=f'Basal Unit',justify='BL',font='8p,white',offset='J0.2c')
     fig.text(position='TL',text=f'Stratigraphic Ice',justify='TL',font='8p,black',offset='J0.2c')
     fig.plot(data=basal_unit_rect2,pen="2p,gold",style='r+s')
 
     fig.shift_origin(xshift='2i')
     pygmt.makecpt(cmap='gray',series='-130/-90/5',continuous=True)
-    fig.grdimage(data,dpi='i',region=basal_unit_insert1,projection=f'X{width/2}i/{height}i')
+    fig.grdimage(calibrate(load_radargram(radargrams,'CLX/R66a',region=basal_unit_insert1,size=(width/2,height),targ=targ)),dpi='i',region=basal_unit_insert1,projection=f'X{width/2}i/{height}i')
     fig.text(position='BL',text=f'Basal Unit',justify='BL',font='8p,white',offset='J0.2c')
     fig.text(position='TL',text=f'Stratigraphic Ice',justify='TL',font='8p,black',offset='J0.2c')
     fig.plot(data=basal_unit_rect1,pen="2p,orange",style='r+s')
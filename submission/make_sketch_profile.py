@@ -3,14 +3,14 @@
 import os 
 import pygmt
 import xarray as xr
-from PIL import Image
-Image.MAX_IMAGE_PIXELS = None
 import rioxarray as rxa
 import numpy as np
 import pandas as pd
 from pyproj import Transformer
 from datetime import datetime,timezone
 from matplotlib import pyplot as plt
+from products import products, bounds
+from radargram import read_metadata, load_radargram, calibrate
 
 
 def project_to_radial(lon,lat):
@@ -33,36 +33,6 @@ def read_opr_picks(path,frame):
     data = pd.read_csv(path)
     return data[data['FRAME'].astype(str).str.contains(frame)]
 
-def read_radargram(path,transect):
-    ''' Read a JPG formatted Open Polar Radar radargram and associated metadata '''
-    radargram_path=os.path.join(path,'image',f'{transect.replace("/","_")}_image.jpg')
-    img = np.array(np.asarray(Image.open(radargram_path)))[:,:,0]
-    radar=140*(img.astype('float')-255)/256
-    nrows, ncols = radar.shape
-
-
-    metadata_path=os.path.join(path,'image',f'{transect.replace("/","_")}_image.csv')
-    metadata=pd.read_csv(os.path.join(path,'metadata',f'{transect.replace("/","_")}_image.csv'))
-    x0=metadata['Displayed_distance [km]'].iloc[0]
-    x1=metadata['Displayed_distance [km]'].iloc[-1]
-    y0=metadata['Elevation of image bottom [m]'].iloc[0]
-    y1=metadata['Elevation of image top [m]'].iloc[0]
-    region=[x0,x1,y0,y1]
-
-    x_spacing = abs((x1 - x0)/ncols)
-    y_spacing = abs((y1 - y0)/nrows)
-
-    x_vals = np.linspace(x0, x1, ncols)
-    y_vals = np.linspace(y1, y0, nrows)
-
-    X, Y = np.meshgrid(x_vals, y_vals)
-
-    xyz_table = np.column_stack((X.ravel(), Y.ravel(), radar.ravel()))
-
-    radar_grd = pygmt.xyz2grd(xyz_table,region=region,spacing=f'{x_spacing}/{y_spacing}')
-    return radar_grd, region, metadata
-
-
 def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code','orig')):
 
     focus_line='CLX/R75a'
@@ -73,18 +43,17 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
     fig = pygmt.Figure()
 
 #read radargram
-    data,bounds,metadata=read_radargram(os.path.join(orig,'projected_images_COLDEX'),'CLX/R75a')
-
-#obtain gridded products along profile
-    bed_grd = os.path.join(targ,'bedelv.tif')
-    thk_grd = os.path.join(targ,'icethk.tif')
-    basal_grd = os.path.join(targ,'fract_basal_ice_percent.tif')
+    radargrams=os.path.join(orig,'projected_images_COLDEX')
+    _,metadata=read_metadata(radargrams,'CLX/R75a')
 
+#obtain gridded products along profile, reading only the part of each grid around it
     xy = metadata[['EPSG 3031 Easting [m]','EPSG 3031 Northing [m]','Displayed_distance [km]']].copy()
+    region = bounds(xy['EPSG 3031 Easting [m]'],xy['EPSG 3031 Northing [m]'],margin=5e3)
+    grids = products(['bedelv','icethk','fract_basal_ice_percent'],region=region,targ=targ)
 
-    bed = pygmt.grdtrack(grid=bed_grd,points=xy,newcolname='bed')
-    thk = pygmt.grdtrack(grid=thk_grd,points=bed,newcolname='thk')
-    basal = pygmt.grdtrack(grid=basal_grd,points=thk,newcolname='basal')
+    bed = pygmt.grdtrack(grid=grids['bedelv'],points=xy,newcolname='bed')
+    thk = pygmt.grdtrack(grid=grids['icethk'],points=bed,newcolname='thk')
+    basal = pygmt.grdtrack(grid=grids['fract_basal_ice_percent'],points=thk,newcolname='basal')
     basal['strat'] = (basal['basal']/100) * basal['thk'] + basal['bed']  
 
 # set figure bounds
@@ -139,7 +108,7 @@ def plot(targ=os.getcwd().replace('code','targ'),orig=os.getcwd().replace('code'
     fig.shift_origin(yshift='3i')
     fig.basemap(region=[x0,x1,z0,z1],frame=['af','Wsne+gdarkgray','x','y+lWGS 84 Elevation (m)'],projection=f'X{width}i/{height}i')
     pygmt.makecpt(cmap='gray',series='-140/-85/5',continuous=True)
-    fig.grdimage(data,dpi='i')
+    fig.grdimage(calibrate(load_radargram(radargrams,'CLX/R75a',region=[x0,x1,z0,z1],size=(width,height),targ=targ)),dpi='i')
     fig.text(position='TL',text=f'a) Transect {focus_line}',justify='TL',font='8p,white',offset='J0.1c')
     fig.text(position='BR',text=f'{aspect:.1f}x vertical exaggeration',justify='BR',font='8p,gray',offset='J0.1c')
 
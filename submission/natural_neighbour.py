@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+'''In-process natural neighbour (Sibson) interpolation onto a regular grid
+
+Uses the discrete form of Sibson's interpolant (Park et al. 2006,
+https://doi.org/10.1109/TVCG.2006.27): every grid node q finds its nearest data
+point and the distance r_q to it, then lends that point's value to every node
+within r_q of itself. The interpolated value at a node is the mean of the values
+lent to it. As the grid is refined this converges to Sibson's area stealing
+weights, and it needs nothing more than a KD-tree and array arithmetic.
+
+The nearest neighbour lookup and the lending pattern depend only on the point
+locations, so several fields sharing the same points are interpolated together.
+
+Far from data the lending radius grows with the distance to the nearest point.
+Each disk is lent as one run of nodes per row, so the cost grows with the
+radius rather than the area of the disks. Sibson's weights reach far: a node
+near the edge of a large gap takes values from nodes deep inside it, so the
+result is only exact if the radius is left uncapped. An optional cap (used by
+tiled gridding, where it bounds how far a tile depends on its surroundings)
+makes every node lending the full capped radius lend to the same disk, done as
+one FFT convolution.
+'''
+
+import os
+import time
+
+import numpy as np
+import xarray as xr
+from scipy.signal import fftconvolve
+from scipy.spatial import cKDTree
+
+
+def grid_nodes(region, spacing):
+    '''gridline registered node coordinates for region (x_min, x_max, y_min, y_max)'''
+    nx = int(round((region[1] - region[0]) / spacing)) + 1
+    ny = int(round((region[3] - region[2]) / spacing)) + 1
+    return region[0] + spacing * np.arange(nx), region[2] + spacing * np.arange(ny)
+
+
+def nearest_points(x, y, region, spacing):
+    '''nearest data point and distance to it (in grid cells) for every node
+
+    returns:
+        index array and distance array, both shaped (ny, nx)
+    '''
+    xs, ys = grid_nodes(region, spacing)
+    tree = cKDTree(np.column_stack([x, y]))
+    xx, yy = np.meshgrid(xs, ys)
+    distance, index = tree.query(np.column_stack([xx.ravel(), yy.ravel()]))
+    shape = (len(ys), len(xs))
+    return index.reshape(shape), (distance / spacing).reshape(shape)
+
+
+def _offsets(radius):
+    '''integer node offsets within radius, grouped by distance'''
+    r = int(np.ceil(radius))
+    di, dj = np.mgrid[-r:r+1, -r:r+1]
+    d = np.hypot(di, dj).ravel()
+    keep = d <= radius
+    di, dj, d = di.ravel()[keep], dj.ravel()[keep], d[keep]
+    order = np.argsort(d, kind='stable')
+    return di[order], dj[order], d[order]
+
+
+def sibson_weights(x, y, region, spacing, max_radius=None):
+    '''precomputes the discrete Sibson lending pattern for a set of points
+
+    arguments:
+        x, y: data point coordinates
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        spacing: grid node spacing in projected units
+        max_radius: optional cap, in projected units, on how far a node lends its value.
+                    Without it the interpolation is exact. With it, nodes close to the data
+                    can change too, where a node further than max_radius from the data
+                    would have lent to them, as on the edge of a large gap
+    returns:
+        dictionary used by sibson_apply
+    '''
+    index, rho = nearest_points(x, y, region, spacing)
+    cap = np.inf if max_radius is None else max_radius / spacing
+    rho = np.minimum(rho, cap)
+    ny, nx = rho.shape
+
+    '''nodes sorted by decreasing lending radius, so those reaching a row offset are a prefix'''
+    order = np.argsort(-rho.ravel(), kind='stable')
+    sorted_rho = rho.ravel()[order]
+    rows, cols = np.divmod(order, nx)
+
+    '''nodes lending the whole capped radius lead the order; they lend to the same disk of offsets'''
+    capped = int(np.count_nonzero(sorted_rho >= cap))
+    disk = None
+    if capped:
+        di, dj, _ = _offsets(cap)
+        pad = int(np.ceil(cap))
+        disk = np.zeros((2 * pad + 1, 2 * pad + 1))
+        disk[di + pad, dj + pad] = 1
+
+    return {
+        'shape': (ny, nx),
+        'order': order,
+        'index': index.ravel()[order],
+        'rows': rows,
+        'cols': cols,
+        'rho': sorted_rho,
+        'capped': capped,
+        'disk': disk,
+    }
+
+
+def _lend_rows(rows, cols, rho, values, shape, chunk=2**23):
+    '''sums values lent by nodes (sorted by decreasing rho) to every node within rho of them, for each field
+
+    Each disk is added as one run of nodes per row, marked at its two ends, and the
+    runs are filled in by a cumulative sum along the rows, so the cost grows with
+    the radius of the disks rather than their area.
+    '''
+    ny, nx = shape
+    reach = int(np.floor(rho[0])) if len(rho) else 0
+    '''the run ends are marked on a grid padded by reach, so no run needs clipping'''
+    width = nx + 2 * reach + 1
+    base = (rows + reach) * width + cols + reach
+    ends = np.zeros((len(values), (ny + 2 * reach) * width))
+    count = np.searchsorted(-rho, -np.arange(reach + 1), side='right')
+    halves = np.arange(reach + 1)
+
+    pending = []
+    for di in range(reach + 1):
+        n = count[di]
+        # the half width of a disk di rows away is the number of offsets (di, dj >= 1) within its radius,
+        # found by counting the (descending) radii reaching each hypot(di, dj) as _offsets selects them
+        reached = np.searchsorted(-rho[:n], -np.hypot(di, halves), side='right')
+        half = np.repeat(halves[::-1], np.diff(np.r_[0, reached[::-1]]))
+        for shift in ((-di, di) if di else (0,)):
+            pending.append((base[:n] + (shift * width - half), base[:n] + (shift * width + half + 1)))
+        if di == reach or sum(len(start) for start, _ in pending) > chunk:
+            index = np.concatenate([end for pair in pending for end in pair])
+            for field, lent in zip(values, ends):
+                weights = np.concatenate([part for start, _ in pending for part in (field[:len(start)], -field[:len(start)])])
+                lent += np.bincount(index, weights=weights, minlength=len(lent))
+            pending = []
+    total = np.cumsum(ends.reshape(len(values), ny + 2 * reach, width), axis=2)
+    return total[:, reach:reach + ny, reach:reach + nx]
+
+
+def _lend_disk(nodes, values, shape, disk):
+    '''sums values lent by nodes (flat indices) to every node of a disk around them, for each field'''
+    image = np.zeros((len(values), shape[0] * shape[1]))
+    image[:, nodes] = values
+    return fftconvolve(image.reshape(len(values), *shape), disk[None], mode='same', axes=(1, 2))
+
+
+def sibson_apply(weights, z):
+    '''interpolates one or more fields with a precomputed lending pattern
+
+    arguments:
+        weights: output of sibson_weights
+        z: data values, shaped (npoints,) or (nfields, npoints)
+    returns:
+        interpolated grid(s) shaped (ny, nx) or (nfields, ny, nx)
+    '''
+    z = np.asarray(z, dtype='float64')
+    single = z.ndim == 1
+    z = np.atleast_2d(z)
+    shape = weights['shape']
+    capped = weights['capped']
+
+    # the last row counts the values lent to each node
+    lender = np.vstack([z[:, weights['index']], np.ones(len(weights['index']))])
+    total = _lend_rows(weights['rows'][capped:], weights['cols'][capped:], weights['rho'][capped:],
+                       lender[:, capped:], shape)
+    if capped:
+        total += _lend_disk(weights['order'][:capped], lender[:, :capped], shape, weights['disk'])
+        total[-1] = np.rint(total[-1])
+    grids = total[:-1] / total[-1]
+    return grids[0] if single else grids
+
+
+def to_dataarray(grid, region, spacing, name=None):
+    '''wraps a (ny, nx) array as an xarray grid with x and y coordinates'''
+    xs, ys = grid_nodes(region, spacing)
+    return xr.DataArray(grid, coords={'y': ys, 'x': xs}, dims=('y', 'x'), name=name)
+
+
+def sibson(x, y, z, region, spacing, max_radius=None):
+    '''natural neighbour interpolation of scattered x, y, z onto a grid
+
+    arguments:
+        x, y, z: data arrays; points with a NaN value are ignored
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        spacing: the size of final gridded cells in projected units
+        max_radius: optional cap on the lending radius, see sibson_weights
+    returns:
+        xarray DataArray on the gridline registered nodes of region
+    '''
+    x, y, z = (np.asarray(a, dtype='float64') for a in (x, y, z))
+    valid = np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+    weights = sibson_weights(x[valid], y[valid], region, spacing, max_radius=max_radius)
+    return to_dataarray(sibson_apply(weights, z[valid]), region, spacing)
+
+
+def benchmark(npoints=20000, region=(-200e3, 800e3, -200e3, 400e3), spacing=1e3, clustered=False, max_radius=None):
+    '''times the in-process interpolator against the nnbathy subprocess, if it is built
+
+    clustered puts the points in a 100 km square plus the zero corners, as for the
+    basal layer and specularity inputs; max_radius optionally caps the lending radius
+    '''
+    rng = np.random.default_rng(0)
+    if clustered:
+        x = np.r_[rng.uniform(300e3, 400e3, npoints), region[0], region[1], region[0], region[1]]
+        y = np.r_[rng.uniform(100e3, 200e3, npoints), region[2], region[2], region[3], region[3]]
+    else:
+        x = rng.uniform(region[0], region[1], npoints)
+        y = rng.uniform(region[2], region[3], npoints)
+    z = np.sin(x / 50e3) * np.cos(y / 70e3) * 1000
+
+    start = time.time()
+    grd = sibson(x, y, z, region, spacing, max_radius=max_radius)
+    print(f'sibson:  {time.time() - start:6.2f} s for {len(x)} points onto {grd.shape[1]} x {grd.shape[0]} nodes')
+
+    if not os.path.exists('nn-c/nn/nnbathy'):
+        print('nnbathy is not built in nn-c/nn, skipping the subprocess comparison')
+        return
+
+    import pandas as pd
+    from process_data import nnbathy
+    start = time.time()
+    nn = nnbathy(pd.DataFrame({'x': x, 'y': y, 'z': z}), list(region), spacing)
+    print(f'nnbathy: {time.time() - start:6.2f} s')
+    nn_grd = nn.set_index(['y', 'x'])['z'].to_xarray()
+    difference = (grd - nn_grd).values
+    print(f'rms difference {np.sqrt(np.nanmean(difference**2)):.3f}, max {np.nanmax(np.abs(difference)):.3f}')
+
+
+if __name__ == "__main__":
+    benchmark()
+    benchmark(npoints=400, clustered=True)
+    benchmark(npoints=400, clustered=True, max_radius=18e3)
@@ -8,6 +8,7 @@ Generated data products will be placed in a parallel directory called 'targ'
 Writing of some parts of code were aided by ChatGPT
 ''' 
 
+import argparse
 import subprocess
 import os 
 from io import StringIO
@@ -21,119 +22,128 @@ import pandas as pd
 import numpy as np
 import time
 from datetime import datetime, timezone
-from process_dem import compile_srf
-
-def read_opr(path, roughness_interval=400, epsg=3031):
+from process_dem import srf_jobs, combine_srf_sources
+from ingest import Job, run_jobs, read_csv_in_region, prefilter, projected_mask, expand_region
+from utig import read_utig_file
+from roughness import roughness
+from gridding import grid_fields, sibson_interpolate
+from blockstats import block_statistics, statistic_grid
+from natural_neighbour import to_dataarray
+from tiling import grid_fields_tiled
+from cog import write_cog
+from products import write_store, roughness_products
+from transect_index import build_index, time_limits
+
+def read_opr(path, roughness_interval=400, epsg=3031, region=None, halo=0):
     '''reads data as formated at the Open Polar Radar website
     arguments:
         path: path to downloaded csv files
         epsg: the grid projection EPSG identifier
+        region: optional projected region (x_min, x_max, y_min, y_max) to keep points from
+        halo: distance in projected units to keep beyond region, so along track roughness is continuous
     returns:
         pandas dataframe with x, y, bed elevation and ice thickness data
     '''
-    data=pd.read_csv(path)
+    data=read_csv_in_region(path,lon='LON',lat='LAT',region=region,halo=halo,epsg=epsg)
     transformer = Transformer.from_crs(4326,epsg,always_xy=True)
 
     if 'UTCTIMESOD' in data.keys():
-        data['TIME'] = pd.to_datetime(data['FRAME'].apply(str).str[:8],format="%Y%m%d") + pd.to_timedelta(data['UTCTIMESOD'],unit='s')
+        # astype(str) keeps an object column when no rows are left in the region, where apply(str) does not
+        data['TIME'] = pd.to_datetime(data['FRAME'].astype(str).str[:8],format="%Y%m%d") + pd.to_timedelta(data['UTCTIMESOD'],unit='s')
     else:
         data['TIME'] = pd.to_datetime((data['LON'] * 0),unit='s')
     
 
     data['X'], data['Y'] = transformer.transform(data['LON'],data['LAT'])
+    if region is not None:
+        data = data.loc[projected_mask(data['X'],data['Y'],expand_region(region,halo))].copy()
     data['BED'] = (data['ELEVATION'] - data['SURFACE']) - data['THICK']
 
-    data[f'RMSD_{roughness_interval}'] = get_roughness(data, sample_interval=roughness_interval)
+    rmsd = add_roughness(data, roughness_interval, segments=data['FRAME'] if 'FRAME' in data.keys() else None)
 
-    return data[['X','Y','BED','THICK',f'RMSD_{roughness_interval}','TIME']]
+    return data[['X','Y','BED','THICK',*rmsd,'TIME']]
 
-def read_utig(path, roughness_interval=400, epsg=3031):
+def read_utig(path, roughness_interval=400, epsg=3031, usecols=None, dtype=None, region=None, halo=0):
     '''reads UTIG formatted data
 
     arguments:
         path: path to folder with UTIG text files 
         epsg: the grid projection EPSG identifier
+        usecols: optional list of columns to read, columns missing from a file are skipped
+        dtype: optional dictionary of column types
+        region: optional projected region (x_min, x_max, y_min, y_max) to keep points from
+        halo: distance in projected units to keep beyond region, so along track roughness is continuous
     returns:
         pandas dataframe with x, y, bed elevation and ice thickness data
     '''
     transformer = Transformer.from_crs(4326,epsg,always_xy=True)
+    reduce = prefilter(lon='LON',lat='LAT',region=region,halo=halo,epsg=epsg)
     data = []
 
-    '''headers for UTIG data are hidding in the comments, this loop extracts them'''
-    for data_file in os.listdir(path):
+    '''headers for UTIG data are hidding in the comments, read_utig_file extracts them'''
+    for data_file in sorted(os.listdir(path)):
         data_path=os.path.join(path,data_file)
         if 'txt' in data_file:
-            with open(data_path,'r',errors="ignore") as f:
-                this_line = ''
-                for line in f.readlines():
-                    columns_list = this_line
-                    this_line = line
-                    if line[0] == '#':
-                        continue
-                    else:
-                        columns = columns_list.split()[1:]
-                        break
-
-            df = pd.read_csv(data_path,sep=r'\s+',comment='#',names=columns,encoding="ISO-8859-1")
-            data.append(df)
+            data.append(read_utig_file(data_path,usecols=usecols,dtype=dtype,reduce=reduce))
+    if not data:
+        print(f'no UTIG text files in {path}')
+        return pd.DataFrame(columns=['LON','LAT','SEGMENT','X','Y'])
 
     all_data = pd.concat(data)
+    all_data['SEGMENT'] = np.repeat(np.arange(len(data)), [len(d) for d in data])
     all_data['X'], all_data['Y'] = transformer.transform(all_data['LON'],all_data['LAT'])
+    if region is not None:
+        all_data = all_data.loc[projected_mask(all_data['X'],all_data['Y'],expand_region(region,halo))].copy()
 
     if 'THK' in all_data.columns:
         all_data['THICK'] = all_data['THK']
         all_data['BED'] = all_data['BED_ELEVATION']
-        all_data[f'RMSD_{roughness_interval}'] = get_roughness(all_data, sample_interval=roughness_interval)
+        add_roughness(all_data, roughness_interval, segments=all_data['SEGMENT'])
 
     return all_data
 
-def read_bedmap(path, roughness_interval=400, epsg=3031):
+def read_bedmap(path, roughness_interval=400, epsg=3031, region=None, halo=0):
     '''reads Bedmap formatted data from the UK polar data center
     see Fremand et al 2022 (https://doi.org/10.5194/essd-15-2695-2023) for details
 
     arguments:
         path: path to csv files 
         epsg: the grid projection EPSG identifier
+        region: optional projected region (x_min, x_max, y_min, y_max) to keep points from
+        halo: distance in projected units to keep beyond region, so along track roughness is continuous
     returns:
         pandas dataframe with x, y, bed elevation and ice thickness data
     '''
-    data=pd.read_csv(path,comment='#',na_values=-9999)
+    data=read_csv_in_region(path,lon='longitude (degree_east)',lat='latitude (degree_north)',region=region,halo=halo,epsg=epsg,comment='#',na_values=-9999)
     transformer = Transformer.from_crs(4326,epsg,always_xy=True)
     
     data['X'], data['Y'] = transformer.transform(data['longitude (degree_east)'],data['latitude (degree_north)'])
+    if region is not None:
+        data = data.loc[projected_mask(data['X'],data['Y'],expand_region(region,halo))].copy()
     data['BED'] = data['bedrock_altitude (m)']
     data['THICK'] = data['land_ice_thickness (m)']
-    data[f'RMSD_{roughness_interval}'] = get_roughness(data, sample_interval=roughness_interval)
+    rmsd = add_roughness(data, roughness_interval, segments=data['trajectory_id'] if 'trajectory_id' in data.keys() else None)
 
-    return data[['X','Y','BED','THICK',f'RMSD_{roughness_interval}']]
+    return data[['X','Y','BED','THICK',*rmsd]]
 
-def get_roughness(data, sample_interval=400):
+def get_roughness(data, sample_interval=400, segments=None):
     '''Calculates the RMS height between <sample_interval> distances'''
-    start_time = time.time()
-
-    data['GAPS'] = np.sqrt((data['X'].diff().fillna(0)**2) + (data['Y'].diff().fillna(0)**2))
-    data['DISTANCE'] = data['GAPS'].cumsum()
-
-    max_distance = sample_interval * round(np.nanmax(data['DISTANCE'])/sample_interval)
-
-    new_distances = np.arange(0,max_distance,sample_interval)
-
-    interpolated_bed = np.interp(
-        new_distances, 
-        data['DISTANCE'],
-        data['BED']  
-    )
-
-    interpolated_bed_series = pd.Series(interpolated_bed)
-
-    interpolated_rmsd = np.sqrt((interpolated_bed_series.diff() ** 2).rolling(window=5).mean())
+    return roughness(data['X'], data['Y'], data['BED'], intervals=[sample_interval], segments=segments)[sample_interval]
 
-    rmsd = np.interp(
-        data['DISTANCE'],
-        new_distances, 
-        interpolated_rmsd  
-    )
-    return rmsd 
+def add_roughness(data, roughness_interval=400, segments=None):
+    '''adds RMSD_<interval> columns to data for one or a list of roughness intervals
+    arguments:
+        data: pandas dataframe with X, Y and BED in track order
+        roughness_interval: sample interval, or list of intervals, in projected units
+        segments: optional track identifiers (e.g. FRAME), roughness is not computed across a change
+    returns:
+        list of the added column names
+    '''
+    intervals = [roughness_interval] if np.isscalar(roughness_interval) else list(roughness_interval)
+    rmsd = roughness(data['X'], data['Y'], data['BED'], intervals=intervals, segments=segments)
+    for interval in intervals:
+        data[f'RMSD_{interval}'] = rmsd[interval]
+    return [f'RMSD_{interval}' for interval in intervals]
     
 
 
@@ -141,11 +151,16 @@ def bin_and_grid(data,
         name,
         region=None,
         z=None,
+        weight=None,
         blockspacing=None,
         grdspacing=None,
         maxradius=None,
         filter=None,
-        rms=False
+        rms=False,
+        interpolator='sibson',
+        tile_size=None,
+        workers=None,
+        incremental=False
         ):
     '''Code to bin, interpolate, filter and mask grid data
     arguments:
@@ -153,34 +168,102 @@ def bin_and_grid(data,
         name: name of output grid
         region: array with projected coordinates with x_min, x_max, y_min, y_max
         z: the dataframe column to use for the gridded data value
+        weight: optional dataframe column of point weights for the block means, e.g. the
+                number of DEM nodes an already block averaged point stands for
         blockspacing: the size of the bins used to reduce the input data in projected units
         grdspacing: the size of final gridded cells in projected units
         maxradius: how far from datapoints interpolated values are permitted in projected units
         filter: size of the Gaussian filter to apply to the data in projected units
         rms: Boolean to process data as RMS
+        interpolator: 'sibson' for the in-process natural neighbour interpolator,
+                      'nnbathy' for the external nnbathy executable (for comparison)
+        tile_size: if given, grid in square tiles of this size (projected units) with overlapping
+                   halos on a pool of workers, keeping memory proportional to the tile size.
+                   Tiles cap the Sibson lending radius at maxradius + filter (see tiling.grid_fields_tiled),
+                   which changes values near large gaps compared to gridding without tiles
+        workers: number of processes used for tiled gridding, defaults to the number of cores
+        incremental: with tile_size, only regrid tiles whose input points changed since the
+                     last run
     
     returns:
-        two xarray grids - one masked and one unmasked
+        the masked xarray grid
     outputs:
-        two GeoTiffs - one masked and one unmasked
+        a cloud optimised GeoTiff {name}.tif with the masked grid as band 1 and the unmasked grid as band 2,
+        and for unweighted data {name}_blocks.tif with the number of points (band 1) and their
+        standard deviation (band 2) in each block
     '''
-    print(f'Processing {name}')
+    grids = bin_and_grid_fields(data,[name],[z],weight=weight,region=region,blockspacing=blockspacing,grdspacing=grdspacing,
+            maxradius=maxradius,filter=filter,rms=rms,interpolator=interpolator,tile_size=tile_size,workers=workers,incremental=incremental)
+    return grids[name]
+
+def bin_and_grid_fields(data,
+        names,
+        zs,
+        weight=None,
+        region=None,
+        blockspacing=None,
+        grdspacing=None,
+        maxradius=None,
+        filter=None,
+        rms=False,
+        interpolator='sibson',
+        tile_size=None,
+        workers=None,
+        incremental=False
+        ):
+    '''Bins, interpolates, filters and masks several columns sharing the same points
+
+    Block assignment is done once for all columns, and interpolation weights and the
+    coverage mask once for every group of columns holding values in the same blocks
+    (see gridding.grid_fields).
+
+    arguments:
+        as for bin_and_grid, except
+        names: list of output grid names
+        zs: list of dataframe columns, one per name
+    returns:
+        dictionary of masked xarray grids keyed on name
+    outputs:
+        a cloud optimised GeoTiff per name, see bin_and_grid
+    '''
+    print(f'Processing {", ".join(names)}')
     targ=os.getcwd().replace('code','targ')
-    if rms:
-        binned_data = np.sqrt(pygmt.blockmean(x=data['X'], y=data['Y'], z=data[z]**2, region=region, spacing=blockspacing))
+
+    x = data['X'].to_numpy(dtype='float64')
+    y = data['Y'].to_numpy(dtype='float64')
+    values = np.stack([data[z].to_numpy(dtype='float32') for z in zs])
+    weights = data[weight].to_numpy(dtype='float64') if weight else None
+    interpolate = nnbathy_interpolate if interpolator == 'nnbathy' else sibson_interpolate
+
+    if tile_size:
+        results, _ = grid_fields_tiled(x, y, values, names, region, blockspacing, grdspacing, maxradius, filter,
+                rms=rms, weights=weights, interpolate=interpolate, tile_size=tile_size, workers=workers, outdir=os.path.join(targ,'tiles'),
+                incremental=incremental)
     else:
-        binned_data = pygmt.blockmean(x=data['X'], y=data['Y'], z=data[z], region=region, spacing=blockspacing)
-    
-    nn_data = nnbathy(binned_data,region,grdspacing)
-    grd = pygmt.xyz2grd(data=nn_data,region=region,spacing=grdspacing)
-    grd_mask = pygmt.surface(x=data['X'], y=data['Y'], z=data[z], spacing=grdspacing, region=region, maxradius=maxradius)
-    mask = grd_mask.where(grd_mask.isnull(), 1)
-    grd_fil = pygmt.grdfilter(grd,filter=f'g{filter}',distance='0')
-    grd_masked = grd_fil * mask
-    grd_masked.rio.to_raster(os.path.join(targ,f'{name}.xyz_val.tif'))
-    grd_fil.rio.to_raster(os.path.join(targ,f'{name}.xyz.tif'))
-    return grd_masked
+        results = grid_fields(x, y, values, region, blockspacing, grdspacing, maxradius, filter, rms=rms, weights=weights, interpolate=interpolate)
+
+    grids = {}
+    for name, (grd_fil, grd_masked) in zip(names, results):
+        write_cog(os.path.join(targ,f'{name}.tif'),[grd_masked,grd_fil])
+        grids[name] = grd_masked
+
+# data density and spread on the block lattice; weighted points are already block means, so their spread is lost
+    if weight is None:
+        for name, field in zip(names, values):
+            table = block_statistics(x, y, field, region, blockspacing, statistics=('count','std'))
+            write_cog(os.path.join(targ,f'{name}_blocks.tif'),
+                      [to_dataarray(statistic_grid(table,s,region,blockspacing),region,blockspacing) for s in ('count','std')],
+                      descriptions=['count','std'])
+    return grids
     
+def nnbathy_interpolate(bx, by, bz, region, spacing, max_radius=None):
+    '''interpolates block values shaped (nfields, nblocks) with the nnbathy executable (max_radius is not used)'''
+    interpolated = []
+    for field in bz:
+        nn_data = nnbathy(pd.DataFrame({'x': bx, 'y': by, 'z': field}),region,spacing)
+        interpolated.append(pygmt.xyz2grd(data=nn_data,region=region,spacing=spacing).values)
+    return np.stack(interpolated)
+
 def plot(grid,name='None',cmap='thermal',series=None, shade=True):
     '''GMT code to produce quality control plots of the producted grids
     arguments:
@@ -245,11 +328,13 @@ def nnbathy(data,region,spacing):
     '''
     input_data = data.to_csv(sep=' ', header=False, index=False)
     xy = meshgrid(region,spacing)
-    xy.to_csv('template.xy',sep='\t',header=False,index=False)
+# each process has its own template, so tiles gridded in parallel do not overwrite each other's
+    template = f'template.{os.getpid()}.xy'
+    xy.to_csv(template,sep='\t',header=False,index=False)
     
     try:
         process = subprocess.Popen(
-            ['nn-c/nn/nnbathy', '-i', '-', '-o', 'template.xy', '-%'],  # Assuming nnbathy accepts stdin and stdout with '-'
+            ['nn-c/nn/nnbathy', '-i', '-', '-o', template, '-%'],  # Assuming nnbathy accepts stdin and stdout with '-'
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
@@ -268,34 +353,47 @@ def nnbathy(data,region,spacing):
     except FileNotFoundError:
         exit()
         print("nnbathy executable not found. Ensure it's in your PATH.")     
+    finally:
+        os.remove(template)
 
 def read_radials():
     '''Obtain information on which times correspond to radials from transect name'''
-    orig=os.getcwd().replace('code','orig')
-    metadata_path = os.path.join(orig,'projected_images_COLDEX/metadata')
-    limits={}
-    for csv in os.listdir(metadata_path):
-        if 'CLX_R' in csv:
-            path = os.path.join(metadata_path,csv)
-            name=f"{csv.split('_')[0]}/{csv.split('_')[1]}"
-            df = pd.read_csv(path)
-            df['time'] = pd.to_datetime(df['UNIX time [s]'],unit='s')
-            start = df['time'].iloc[0]
-            end = df['time'].iloc[-1]
-            limits[name] = (start,end)
-    return limits
-
-def get_radials(all_mkb=None):
-    '''Read in only radial transects'''
-    limits = read_radials()
-    radials=[]
-    for radial in limits.keys():
-        mask = (all_mkb['TIME'] > limits[radial][0]) & (all_mkb['TIME'] < limits[radial][1])
-        radials.append(all_mkb.loc[mask])
-    return pd.concat(radials)
-
-def read_and_process_data(region,blockspacing=2.5e3,roughness_interval=400):
-    '''Process all data'''
+    return time_limits(build_index(),pattern='CLX/R')
+
+def get_radials(all_mkb=None,limits=None):
+    '''Read in only radial transects, tagging each point with its transect name in RADIAL
+
+    Points are sorted on time once and each radial's time interval (exclusive) is
+    found by binary search. A point inside overlapping intervals appears once per radial.
+    Radials keep the order of limits, and their points the order of all_mkb.
+    '''
+    limits = limits if limits is not None else read_radials()
+    names = list(limits)
+    times = all_mkb['TIME'].to_numpy(dtype='datetime64[ns]')
+    order = np.argsort(times,kind='stable')
+    times = times[order]
+    first = np.searchsorted(times,np.array([limits[r][0] for r in names],dtype='datetime64[ns]'),side='right')
+    last = np.searchsorted(times,np.array([limits[r][1] for r in names],dtype='datetime64[ns]'),side='left')
+    counts = np.maximum(last - first,0)
+
+    rows = np.concatenate([np.sort(order[f:l]) for f,l in zip(first,first + counts)]) if names else np.array([],dtype=int)
+    radial = pd.Categorical.from_codes(np.repeat(np.arange(len(names)),counts),categories=names)
+    return all_mkb.iloc[rows].assign(RADIAL=radial)
+
+def read_and_process_data(region,blockspacing=2.5e3,roughness_interval=400,workers=None,maxradius=8e3,tile_size=None,incremental=False,store=None):
+    '''Process all data
+
+    arguments:
+        region: array with projected coordinates with x_min, x_max, y_min, y_max
+        blockspacing: the size of the bins used to reduce the input data in projected units
+        roughness_interval: sample interval for the RMS roughness in projected units, or a list of them;
+                            the first is gridded as roughness and any others as roughness_<interval>
+        workers: number of processes used to read the input files, defaults to the number of cores
+        maxradius: how far from datapoints interpolated values are permitted in projected units
+        tile_size: if given, grid in tiles of this size in projected units (see bin_and_grid)
+        incremental: only regrid the tiles affected by new or changed input files, implies tiling
+        store: also write every grid into one chunked product store, 'zarr' or 'netcdf' (see products.py)
+    '''
     targ=os.getcwd().replace('code','targ')
     os.makedirs(targ,exist_ok=True)
 
@@ -310,45 +408,55 @@ def read_and_process_data(region,blockspacing=2.5e3,roughness_interval=400):
                'SPECULARITY_CONTENT_FILTERED': [0,0,0,0],
                'basal layer thickness': [0,0,0,0]
                })
-# collecting specularity content data
-    spec=[]
-    spec.append(read_utig(os.path.join(orig,'2022_COLDEX_UTIG.IRSPC2')))
-    spec.append(read_utig(os.path.join(orig,'2023_COLDEX_UTIG.IRSPC2')))
-    spec.append(corners)
-    all_spec = pd.concat(spec)
-
-# collecting thickness and bed elevation data
-    thk=[]
-    thk.append(read_utig(os.path.join(orig,'ICECAP2_SPC.CRIPR2')))
-    
-    mkb=[]
-
-    for f in os.listdir(orig):
+# points further than the interpolation radius plus the roughness window from the region are dropped while reading
+    intervals = [roughness_interval] if np.isscalar(roughness_interval) else list(roughness_interval)
+    halo = maxradius + 5 * max(intervals)
+    reader_args = {'roughness_interval': roughness_interval, 'region': list(region), 'halo': halo}
+
+# every file is read independently, so the reads are spread over a process pool
+    spec_dirs = ['2022_COLDEX_UTIG.IRSPC2','2023_COLDEX_UTIG.IRSPC2']
+    spec_columns = ['LON','LAT','SPECULARITY_CONTENT_FILTERED']
+    jobs = [Job(d, read_utig, os.path.join(orig,d), {'usecols': spec_columns, 'region': list(region), 'halo': halo}) for d in spec_dirs]
+    jobs.append(Job('ICECAP2_SPC.CRIPR2', read_utig, os.path.join(orig,'ICECAP2_SPC.CRIPR2'), reader_args))
+
+    mkb_files = []
+    thk_files = ['ICECAP2_SPC.CRIPR2']
+    for f in sorted(os.listdir(orig)):
         if 'csv' in f:
-            if 'Antarctica_BaslerMKB' in f:
-                print(f'Reading {f} as Open Polar Radar')
-                mkb.append(read_opr(os.path.join(orig,f),roughness_interval=roughness_interval))
-                thk.append(read_opr(os.path.join(orig,f),roughness_interval=roughness_interval))
-            elif 'Antarctica_TO' in f:
+            if 'Antarctica_BaslerMKB' in f or 'Antarctica_TO' in f:
                 print(f'Reading {f} as Open Polar Radar')
-                thk.append(read_opr(os.path.join(orig,f),roughness_interval=roughness_interval))
+                jobs.append(Job(f, read_opr, os.path.join(orig,f), reader_args))
+                if 'Antarctica_BaslerMKB' in f:
+                    mkb_files.append(f)
             else:
                 print(f'Reading {f} as Bedmap')
-                thk.append(read_bedmap(os.path.join(orig,f),roughness_interval=roughness_interval))
-    thk.append(corners)
-    all_thk = pd.concat(thk)
-    all_mkb = pd.concat(mkb)
+                jobs.append(Job(f, read_bedmap, os.path.join(orig,f), reader_args))
+            thk_files.append(f)
+# ATL14 is block averaged while it is read, on the same lattice the surface is gridded with
+    srf_blockspacing = 5e3
+    jobs += srf_jobs(orig,region=region,blockspacing=srf_blockspacing)
 
-    srf = compile_srf(region=region)
+    sources = run_jobs(jobs,workers=workers)
+
+# collecting specularity content data
+    all_spec = pd.concat([sources[d] for d in spec_dirs] + [corners])
+
+# collecting thickness and bed elevation data
+    all_thk = pd.concat([sources[f] for f in thk_files] + [corners])
+    all_mkb = pd.concat([sources[f] for f in mkb_files])
+
+    srf = combine_srf_sources(sources)
     #rms = get_roughness(all_thk)
 
     grids = {}
+    if incremental and not tile_size:
+        tile_size = 200e3
+    tile_args = {'tile_size': tile_size, 'workers': workers, 'incremental': incremental}
 
-
-    grids['roughness'] = bin_and_grid(all_thk,'roughness',region=region,z=f'RMSD_{roughness_interval}',blockspacing=5e3,grdspacing=1e3,maxradius=8e3,filter=10e3)
-    grids['icethk'] = bin_and_grid(all_thk,'icethk',region=region,z='THICK',blockspacing=5e3,grdspacing=1e3,maxradius=8e3,filter=10e3)
-    grids['bedelv'] = bin_and_grid(all_thk,'bedelv',region=region,z='BED',blockspacing=5e3,grdspacing=1e3,maxradius=8e3,filter=10e3)
-    grids['srfelv'] = bin_and_grid(srf,'srfelv',region=region,z='z',blockspacing=5e3,grdspacing=1e3,maxradius=8e3,filter=5e3)
+# the roughness at every interval shares the thickness points, so all are gridded together
+    roughness_names = roughness_products(intervals)
+    grids.update(bin_and_grid_fields(all_thk,roughness_names + ['icethk','bedelv'],[f'RMSD_{i}' for i in intervals] + ['THICK','BED'],region=region,blockspacing=5e3,grdspacing=1e3,maxradius=maxradius,filter=10e3,**tile_args))
+    grids['srfelv'] = bin_and_grid(srf,'srfelv',region=region,z='z',weight='WEIGHT',blockspacing=srf_blockspacing,grdspacing=1e3,maxradius=maxradius,filter=5e3,**tile_args)
 
     print(pygmt.grdinfo(grids['srfelv']))
     print(pygmt.grdinfo(grids['bedelv']))
@@ -359,35 +467,51 @@ def read_and_process_data(region,blockspacing=2.5e3,roughness_interval=400):
         basal_df['X'] = basal_df['x']
         basal_df['Y'] = basal_df['y']
         basal_df = pd.concat([basal_df,corners])
-        grids['basal_layer_thickness'] = bin_and_grid(basal_df,'basal_layer_thickness',region=region,z='basal layer thickness',blockspacing=5e3,grdspacing=1e3,maxradius=8e3,filter=10e3) 
+        grids['basal_layer_thickness'] = bin_and_grid(basal_df,'basal_layer_thickness',region=region,z='basal layer thickness',blockspacing=5e3,grdspacing=1e3,maxradius=maxradius,filter=10e3,**tile_args) 
         grids['fract_basal_ice_percent'] = 100 * (grids['basal_layer_thickness']/grids['icethk'])
+        write_cog(os.path.join(targ,'fract_basal_ice_percent.tif'),grids['fract_basal_ice_percent'],descriptions=['masked'])
         plot(grid=grids['fract_basal_ice_percent'],name='Basal Ice Fractional Thickness',cmap='ocean',series=[0,40,1],shade=False)
     except FileNotFoundError:
         print(f"could not find {os.path.join(orig,'yan_basal_layer','cxa_bil_thickness.csv')}")
     except KeyError:
         print(basal_df)
 
-    grids['spec'] = bin_and_grid(all_spec,'specularity_content',region=region,z='SPECULARITY_CONTENT_FILTERED',blockspacing=5e3,grdspacing=1e3,maxradius=8e3,filter=10e3)
+    grids['spec'] = bin_and_grid(all_spec,'specularity_content',region=region,z='SPECULARITY_CONTENT_FILTERED',blockspacing=5e3,grdspacing=1e3,maxradius=maxradius,filter=10e3,**tile_args)
 
     all_radials = get_radials(all_mkb=all_mkb)
 
-    high_pass = pygmt.grdtrack(grid=grids['bedelv'], points=all_radials, output_type='pandas', newcolname='GRD_BED')
+    high_pass = pygmt.grdtrack(grid=grids['bedelv'], points=all_radials.drop(columns=['RADIAL']), output_type='pandas', newcolname='GRD_BED')
     high_pass['HIGH_PASS_BED'] = high_pass['BED'] - high_pass['GRD_BED']
-    high_pass.drop(columns=['BED','GRD_BED','THICK',f'RMSD_{roughness_interval}','TIME'],inplace=True)
+    high_pass.drop(columns=['BED','GRD_BED','THICK','TIME'] + [f'RMSD_{i}' for i in intervals],inplace=True)
     high_pass.to_csv(os.path.join(targ,'hipass_bed.xyz'),index=False,header=False,sep='\t')
 
-    for g in grids.keys():
-        pygmt.grdsample(grids[g], outgrid = os.path.join(targ,f'{g}.tif=gd:GTiff'))
+    if store:
+        print(f'Wrote product store {write_store(grids,targ,format=store)}')
 
     plot(grid=grids['icethk'],name='Ice Thickness',series=[2000,4000,100])
     plot(grid=grids['bedelv'],name='Bed Elevation',cmap='globe',series=[-2500,2500,100])
     plot(grid=grids['spec'],name='Specularity Content',cmap='ocean',series=[0,0.5,0.1],shade=False)
-    plot(grid=grids['roughness'],name='RMS Roughness @ 400 m',cmap='magma',series=[0,50,1],shade=False)
+    for name,interval in zip(roughness_names,intervals):
+        plot(grid=grids[name],name=f'RMS Roughness @ {interval} m',cmap='magma',series=[0,50,1],shade=False)
     plot(grid=grids['srfelv'],name='Surface Elevation',cmap='viridis',series=[2000,4000,10],shade=True)
                 
 
 def main():
-    read_and_process_data([-200e3,800e3,-200e3,400e3])
+    parser = argparse.ArgumentParser(
+        description='generates ice thickness, bed elevation and related grids from the data in orig')
+    parser.add_argument('--region', nargs=4, type=float, default=[-200e3,800e3,-200e3,400e3],
+        metavar=('X_MIN','X_MAX','Y_MIN','Y_MAX'), help='projected region to grid')
+    parser.add_argument('--roughness-interval', nargs='+', type=int, default=[400],
+        help='one or more roughness sample intervals, the first is gridded as roughness')
+    parser.add_argument('--maxradius', type=float, default=8e3)
+    parser.add_argument('--workers', '-j', type=int, default=None)
+    parser.add_argument('--tile-size', type=float, default=None)
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--store', choices=['zarr','netcdf'], default=None, help='also write a chunked product store')
+    args = parser.parse_args()
+
+    read_and_process_data(args.region,roughness_interval=args.roughness_interval,workers=args.workers,
+            maxradius=args.maxradius,tile_size=args.tile_size,incremental=args.incremental,store=args.store)
 
 if __name__ == "__main__":
     main()
@@ -4,9 +4,11 @@ from netCDF4 import Dataset
 import os
 import pandas as pd
 import numpy as np
-import pygmt
 from pyproj import Transformer
 from matplotlib import pyplot as plt
+from ingest import Job, run_jobs
+from utig import read_utig_file
+from blockstats import raster_block_mean
 
 '''Code to compile laser altimetry data around South Pole'''
 
@@ -16,21 +18,54 @@ def lltoxy(lon,lat,epsg=3031):
     x, y = transformer.transform(lon,lat)
     return x, y
 
-def read_nc(data,region=None):
-    '''reads a IceSat-2 ALT14 dem file and converts to a pandas DataFrame'''
-    cut_grd = pygmt.grdcut(grid=f'{data}?h',region=region,extend=np.nan)
-    xyz = pygmt.grd2xyz(cut_grd)
-    xyz = xyz.dropna()
-    return xyz
+ATL14_TILES = [1,2,3,4]
 
-def get_atl14(orig,region=None):
-    '''retrieves ATL14 DataFrames and combines them. Windows the data using a project units region (x_min,x_max,y_min,y_max)'''
+def read_nc(data,region=None,blockspacing=5e3,rows=1024):
+    '''reads a IceSat-2 ATL14 dem file, block averaged onto the gridding lattice
+
+    The h raster is read in bands of rows inside region only, and reduced straight
+    to blocks (see blockstats.raster_block_mean), rather than converted to points.
+    arguments:
+        data: path to the ATL14 NetCDF file
+        region: projected region (x_min,x_max,y_min,y_max) of the grid the blocks are for
+        blockspacing: block size of that grid in projected units
+    returns:
+        pandas DataFrame with the block X, Y, mean z and the number of nodes averaged as WEIGHT
+    '''
+    with Dataset(data,'r') as nc:
+        xs = nc['x'][:].astype('float64')
+        ys = nc['y'][:].astype('float64')
+        if region is None:
+            region = [xs.min(),xs.max(),ys.min(),ys.max()]
+        half = blockspacing / 2
+        cols = np.flatnonzero((xs >= region[0] - half) & (xs <= region[1] + half))
+        rows_in = np.flatnonzero((ys >= region[2] - half) & (ys <= region[3] + half))
+        if len(cols) == 0 or len(rows_in) == 0:
+            return pd.DataFrame({'X': [], 'Y': [], 'z': [], 'WEIGHT': []})
+        c0, c1 = cols[0], cols[-1] + 1
+        r0, r1 = rows_in[0], rows_in[-1] + 1
+        h = nc['h']
+
+        def read(start, stop):
+            values = np.ma.filled(h[r0+start:r0+stop, c0:c1].astype('float64'), np.nan)
+            values[~(values > 0)] = np.nan
+            return values
+
+        x, y, z, n = raster_block_mean(xs[c0:c1], ys[r0:r1], read, region, blockspacing, rows=rows)
+    return pd.DataFrame({'X': x, 'Y': y, 'z': z, 'WEIGHT': n})
+
+def get_atl14(orig,region=None,blockspacing=5e3):
+    '''retrieves the block averaged ATL14 tiles and combines them. Windows the data using a project units region (x_min,x_max,y_min,y_max)'''
     atl14=[]
-    for i in [1,2,3,4]: 
+    for i in ATL14_TILES:
         print(f'reading ATL14_A{i}')
-        atl14.append(read_nc(os.path.join(orig,f'ATL14_A{i}_0325_100m_004_05.nc'),region=region))
+        atl14.append(read_atl14_tile(orig,tile=i,region=region,blockspacing=blockspacing))
     return pd.concat(atl14)
 
+def read_atl14_tile(orig,tile=1,region=None,blockspacing=5e3):
+    '''reads one of the ATL14 A1-A4 tiles, block averaged'''
+    return read_nc(os.path.join(orig,f'ATL14_A{tile}_0325_100m_004_05.nc'),region=region,blockspacing=blockspacing)
+
 def get_ILUTP2(orig):
     '''retrieves UTIG style *LUTP2 surface laser altimetry files, reprojects and concatenates them'''
     ilutp2=[]
@@ -40,14 +75,14 @@ def get_ILUTP2(orig):
                 if f.split('.')[-1] == 'txt':
                     print(f)
                     try:
-                        data = pd.read_csv(os.path.join(orig,d,f), encoding = "ISO-8859-1", comment='#', header=None, index_col=False, names=['year','day','sec','lon','lat','z'],sep=r"\s+")
+                        data = read_utig_file(os.path.join(orig,d,f), names=['year','day','sec','lon','lat','z'], usecols=['lon','lat','z'])
                         ilutp2.append(data) 
                     except UnicodeDecodeError:
                         print(f'{f} Failed due to UnicodeDecodeError')
 
     data = pd.concat(ilutp2)
     data['X'],data['Y'] = lltoxy(data['lon'],data['lat'])
-    return data.drop(labels=['year','day','sec','lon','lat'],axis=1)
+    return data.drop(labels=['lon','lat'],axis=1)
 
 def get_SOAR(orig):
     '''retrieves UTIG style *LUTP2 surface laser altimetry files, reprojects and concatenates them.'''
@@ -62,23 +97,42 @@ def get_BAS(orig):
     data['z'] = data['surface_altitude (m)']
     return data[['X','Y','z']]
 
-def compile_srf(region=None):
+def srf_jobs(orig,region=None,blockspacing=5e3):
+    '''ingestion jobs for the SOAR, UTIG, BAS and IceSat-2 surface sources; each ATL14 tile is its own job'''
+    atl14 = [Job(f'srf:ATL14_A{i}', read_atl14_tile, orig, {'tile': i, 'region': region, 'blockspacing': blockspacing}, cached=False)
+             for i in ATL14_TILES]
+    return [
+        Job('srf:ILUTP2', get_ILUTP2, orig, cached=False),
+        *atl14,
+        Job('srf:SOAR', get_SOAR, orig, cached=False),
+        Job('srf:BAS', get_BAS, orig, cached=False),
+    ]
+
+def combine_srf(las,dem,soar,bas):
+    '''Combines the surface sources. Filters out any points below sea level
+
+    dem holds ATL14 block means with the number of nodes in each as WEIGHT; every
+    other point has a WEIGHT of 1, so weighted binning matches binning the DEM nodes
+    '''
+    points = pd.concat([las,soar,bas])
+    points['WEIGHT'] = 1.0
+    srf = pd.concat([points,dem])
+    return srf.loc[srf.z > 0]
+
+def combine_srf_sources(sources):
+    '''combine_srf on the results of srf_jobs, keyed on job name'''
+    dem = pd.concat([sources[f'srf:ATL14_A{i}'] for i in ATL14_TILES])
+    return combine_srf(sources['srf:ILUTP2'],dem,sources['srf:SOAR'],sources['srf:BAS'])
+
+def compile_srf(region=None,workers=None,blockspacing=5e3):
     '''Combines SOAR, UTIG, BAS and IceSat-2 data. Filters out any points below sea level'''
     orig=os.getcwd().replace('code','orig')
-    las = get_ILUTP2(orig)
-    soar = get_SOAR(orig)
-    bas = get_BAS(orig)
-    dem = get_atl14(orig,region=region)
-    dem['X'] = dem['x']
-    dem['Y'] = dem['y']
-    dem.drop(labels=['x','y'],axis=1)
-    srf = pd.concat([las,dem,soar,bas])
-    return srf.loc[srf.z > 0]
+    return combine_srf_sources(run_jobs(srf_jobs(orig,region=region,blockspacing=blockspacing),workers=workers))
 
 def grid_srf(srf):
     '''For development - grids the compiled data'''
     from process_data import bin_and_grid
-    srf_grid = bin_and_grid(srf.loc[srf.z > 0],name='srfelv',z='z',region=region,blockspacing=5000,grdspacing=1000,maxradius=15000,filter=3000,rms=False)
+    srf_grid = bin_and_grid(srf.loc[srf.z > 0],name='srfelv',z='z',weight='WEIGHT',region=region,blockspacing=5000,grdspacing=1000,maxradius=15000,filter=3000,rms=False)
     return srf_grid
 
 def main(region=None):
@@ -4,56 +4,142 @@ import argparse
 import os
 import numpy as np
 from h5py import File
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
 import pygmt #required GMT6.5
 
 '''Converts Mouginot's 2019 phase interfometry Antarctic HDF5 velocity map into GIS friendly GeoTiff files'''
 
-def read_and_write(data_dir='Mouginot2019'):
+def window(x, y, region=None):
+    '''row and column slices of the x, y axes inside a projected region (x_min, x_max, y_min, y_max)'''
+    if region is None:
+        return slice(0, len(y)), slice(0, len(x))
+    cols = np.flatnonzero((x >= region[0]) & (x <= region[1]))
+    rows = np.flatnonzero((y >= region[2]) & (y <= region[3]))
+    if len(cols) == 0 or len(rows) == 0:
+        raise ValueError(f'region {region} does not overlap the velocity grid')
+    return slice(rows[0], rows[-1] + 1), slice(cols[0], cols[-1] + 1)
+
+def geotiff_profile(x, y, count=1, blocksize=512):
+    '''GeoTIFF profile for a grid with node coordinates x and y (pixel is area, north up)'''
+    dx = abs(x[1] - x[0])
+    dy = abs(y[1] - y[0])
+    return {'driver': 'GTiff', 'width': len(x), 'height': len(y), 'count': count, 'dtype': 'float32',
+            'crs': 'EPSG:3031', 'transform': from_origin(x.min() - dx/2, y.max() + dy/2, dx, dy),
+            'tiled': True, 'blockxsize': blocksize, 'blockysize': blocksize,
+            'compress': 'deflate', 'predictor': 3, 'BIGTIFF': 'IF_SAFER'}
+
+DERIVED = ['FLOW_DIRECTION', 'EFFECTIVE_STRAIN_RATE', 'LONGITUDINAL_STRAIN_RATE', 'TRANSVERSE_STRAIN_RATE']
+
+def strain_rates(vx, vy, dx, dy):
+    '''flow direction and strain rates from velocity components by central differences
+
+    arguments:
+        vx, vy: velocity components (m/yr) with rows running north to south, as in a GeoTiff
+        dx, dy: node spacing in x and y (m)
+    returns:
+        dictionary of DERIVED grids: flow direction in degrees anticlockwise from grid east,
+        the effective strain rate (second invariant, assuming incompressibility), and the
+        strain rates along and across flow, all in 1/yr
+    '''
+    dvx_dy, dvx_dx = np.gradient(vx, -dy, dx)
+    dvy_dy, dvy_dx = np.gradient(vy, -dy, dx)
+    exx = dvx_dx
+    eyy = dvy_dy
+    exy = 0.5 * (dvx_dy + dvy_dx)
+
+    theta = np.arctan2(vy, vx)
+    c, s = np.cos(theta), np.sin(theta)
+    return {
+        'FLOW_DIRECTION': np.degrees(theta),
+        'EFFECTIVE_STRAIN_RATE': np.sqrt(exx**2 + eyy**2 + exx*eyy + exy**2),
+        'LONGITUDINAL_STRAIN_RATE': exx*c**2 + 2*exy*s*c + eyy*s**2,
+        'TRANSVERSE_STRAIN_RATE': exx*s**2 - 2*exy*s*c + eyy*c**2,
+    }
+
+def write_strain_rates(vx_path, vy_path, rows=1024):
+    '''writes the DERIVED grids next to the VX and VY GeoTiffs, a band of rows at a time
+
+    Each band is read with one row of overlap on either side, so the central
+    differences match those over the whole grid.
+    returns:
+        dictionary of GeoTiff paths keyed on DERIVED name
+    '''
+    outdir = os.path.dirname(vx_path)
+    paths = {}
+    with rasterio.open(vx_path) as src_x, rasterio.open(vy_path) as src_y:
+        dx, dy = src_x.res
+        height, width = src_x.height, src_x.width
+        outputs = {name: rasterio.open(os.path.join(outdir,f'{name}.tif'),'w',**src_x.profile) for name in DERIVED}
+        try:
+            for start in range(0, height, rows):
+                stop = min(start + rows, height)
+                first, last = max(start - 1, 0), min(stop + 1, height)
+                halo = Window(0, first, width, last - first)
+                derived = strain_rates(src_x.read(1, window=halo).astype('float64'),
+                                       src_y.read(1, window=halo).astype('float64'), dx, dy)
+                for name, grid in derived.items():
+                    core = grid[start-first:stop-first].astype('float32')
+                    outputs[name].write(core, 1, window=Window(0, start, width, stop - start))
+        finally:
+            for name, dst in outputs.items():
+                dst.close()
+                paths[name] = dst.name
+    return paths
+
+def read_and_write(data_dir='Mouginot2019', region=None, rows=1024):
+    '''converts every velocity component to a GeoTiff, reading the HDF5 file in bands of rows
+
+    arguments:
+        data_dir: directory under orig holding the HDF5 file, and under targ for the GeoTiffs
+        region: optional projected region (x_min, x_max, y_min, y_max) to clip to
+        rows: number of rows read and written at a time, which bounds memory use
+    returns:
+        dictionary of GeoTiff paths keyed on component, including the speed VELM and
+        the flow direction and strain rates (see strain_rates)
+    '''
     print('converting Mouginot 2019 HDF5...')
     orig = os.getcwd().replace('code','orig')
     targ = os.getcwd().replace('code','targ')
     os.makedirs(os.path.join(targ,data_dir),exist_ok=True)
 
-    print('reading')
-    data = File(os.path.join(orig,data_dir,'antarctic_ice_vel_phase_map_v01.h5'),'r')
-
-    print('getting x and y')
-    x = data['x'][:]
-    y = data['y'][:]
-
-    print('meshing')
-    xx, yy = np.meshgrid(x,y)
-
-    print('unravelling')
-    x_column = np.ravel(xx)
-    y_column = np.ravel(yy)
-
     insar = {}
-
-    region=[min(x),max(x),min(y),max(y)]
-    spacing=(x[1] - x[0])
-
-    for d in list(data.keys()):
-        if d.isupper():
-            print(d)
-            outfile = os.path.join(targ,data_dir,f'{d}.tif=gd:GTiff')
-            z = np.ravel(data[d][:,:])
-            insar[d] = pygmt.xyz2grd(
-                x=x_column,
-                y=y_column,
-                z=z,
-                region=region,
-                spacing=spacing)
-
-            pygmt.xyz2grd(x=x_column,
-                y=y_column,
-                z=z,
-                outgrid=outfile,
-                region=region,
-                spacing=spacing)
-
-    insar['VELM'] = np.sqrt(insar['VX']**2 + insar['VY']**2)
-    pygmt.grdsample(insar['VELM'],outgrid=os.path.join(targ,data_dir,f'VELM.tif=gd:GTiff'))
+    with File(os.path.join(orig,data_dir,'antarctic_ice_vel_phase_map_v01.h5'),'r') as data:
+        x = data['x'][:]
+        y = data['y'][:]
+        row_slice, col_slice = window(x, y, region)
+        x, y = x[col_slice], y[row_slice]
+        profile = geotiff_profile(x, y)
+        # GeoTiff rows run north to south
+        flip = y[0] < y[-1]
+        bands = [(start, min(start + rows, len(y))) for start in range(0, len(y), rows)]
+
+        def read(name, start, stop):
+            if flip:
+                start, stop = len(y) - stop, len(y) - start
+            block = data[name][row_slice.start + start:row_slice.start + stop, col_slice].astype('float32')
+            return block[::-1] if flip else block
+
+        components = [d for d in data.keys() if d.isupper()]
+        outputs = {d: rasterio.open(os.path.join(targ,data_dir,f'{d}.tif'),'w',**profile) for d in components}
+        outputs['VELM'] = rasterio.open(os.path.join(targ,data_dir,'VELM.tif'),'w',**profile)
+        try:
+            for start, stop in bands:
+                window_rows = Window(0, start, len(x), stop - start)
+                blocks = {}
+                for d in components:
+                    blocks[d] = read(d, start, stop)
+                    outputs[d].write(blocks[d], 1, window=window_rows)
+                print(f'rows {start}-{stop} of {len(y)}')
+                outputs['VELM'].write(np.sqrt(blocks['VX']**2 + blocks['VY']**2), 1, window=window_rows)
+        finally:
+            for name, dst in outputs.items():
+                dst.close()
+                insar[name] = dst.name
+
+    print('computing strain rates')
+    insar.update(write_strain_rates(insar['VX'], insar['VY'], rows=rows))
     return insar
     
 def plot(insar):
@@ -75,10 +161,13 @@ def main():
     parser.add_argument('-d','--directory',default='Mouginot2019')
     parser.add_argument('--noconvert','-n',action='store_true')
     parser.add_argument('--plot','-p',action='store_true')
+    parser.add_argument('--region','-R',nargs=4,type=float,default=None,metavar=('X_MIN','X_MAX','Y_MIN','Y_MAX'),
+        help='projected region to clip to, defaults to the whole continent')
+    parser.add_argument('--rows',type=int,default=1024,help='rows converted at a time')
     args = parser.parse_args()
 
     if (not args.noconvert):
-        insar = read_and_write(data_dir=args.directory)
+        insar = read_and_write(data_dir=args.directory,region=args.region,rows=args.rows)
 
     tif_dict = {}
     if args.plot:
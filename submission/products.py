@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+'''Chunked store and accessors for the gridded products
+
+read_and_process_data can write all of its grids into one dataset with shared
+x and y coordinates, chunked in square blocks, as Zarr (if the zarr package is
+installed) or NetCDF4. Opening the store is lazy, so selecting a window reads
+only the chunks that overlap it.
+
+Scripts should get products through product() or products() instead of building
+paths in targ. Where the store does not exist they fall back to the product's
+cloud optimised GeoTIFF, which is also read by window.
+'''
+
+import os
+
+import numpy as np
+import xarray as xr
+
+from cog import read_cog
+
+'''products in the store, and the name of their GeoTIFF in targ (velocity products are never in the store).
+roughness at further sample intervals is stored as roughness_<interval>, see roughness_products'''
+PRODUCTS = {
+    'icethk': 'icethk',
+    'bedelv': 'bedelv',
+    'srfelv': 'srfelv',
+    'spec': 'specularity_content',
+    'roughness': 'roughness',
+    'basal_layer_thickness': 'basal_layer_thickness',
+    'fract_basal_ice_percent': 'fract_basal_ice_percent',
+    'velocity': 'Mouginot2019/VELM',
+    'velocity_x': 'Mouginot2019/VX',
+    'velocity_y': 'Mouginot2019/VY',
+    'flow_direction': 'Mouginot2019/FLOW_DIRECTION',
+    'effective_strain_rate': 'Mouginot2019/EFFECTIVE_STRAIN_RATE',
+    'longitudinal_strain_rate': 'Mouginot2019/LONGITUDINAL_STRAIN_RATE',
+    'transverse_strain_rate': 'Mouginot2019/TRANSVERSE_STRAIN_RATE',
+}
+STORES = ('products.zarr', 'products.nc')
+
+_open = {}
+
+
+def roughness_products(intervals):
+    '''product names of the roughness grids for a list of sample intervals:
+    roughness for the first and roughness_<interval> for any others'''
+    return ['roughness'] + [f'roughness_{interval}' for interval in intervals[1:]]
+
+
+def targ_dir():
+    return os.getcwd().replace('code','targ')
+
+
+def write_store(grids, targ=None, format='zarr', chunks=512):
+    '''writes grids on the same nodes into one chunked dataset
+
+    arguments:
+        grids: dictionary of xarray grids keyed on product name
+        targ: output directory, defaults to targ
+        format: 'zarr', or 'netcdf' for NetCDF4; zarr falls back to NetCDF4 if it is not installed
+        chunks: chunk size in nodes along x and y
+    returns:
+        path of the store
+    '''
+    targ = targ or targ_dir()
+    first = next(iter(grids.values()))
+    data = xr.Dataset({name: (('y', 'x'), np.asarray(grid, dtype='float32')) for name, grid in grids.items()},
+                      coords={'x': first.x.values, 'y': first.y.values})
+    size = {'y': min(chunks, data.sizes['y']), 'x': min(chunks, data.sizes['x'])}
+
+    if format == 'zarr':
+        try:
+            import zarr
+        except ImportError:
+            print('zarr is not installed, writing the product store as NetCDF4')
+            format = 'netcdf'
+
+    if format == 'zarr':
+        path = os.path.join(targ, STORES[0])
+        encoding = {name: {'chunks': (size['y'], size['x'])} for name in grids}
+        data.to_zarr(path, mode='w', encoding=encoding)
+    else:
+        path = os.path.join(targ, STORES[1])
+        encoding = {name: {'chunksizes': (size['y'], size['x']), 'zlib': True, 'complevel': 4} for name in grids}
+        data.to_netcdf(path, engine='netcdf4', encoding=encoding)
+    _open.pop(path, None)
+    return path
+
+
+def open_store(targ=None):
+    '''the product store as a lazily loaded dataset, or None if there is no store'''
+    targ = targ or targ_dir()
+    for store in STORES:
+        path = os.path.join(targ, store)
+        if path in _open:
+            return _open[path]
+        if os.path.exists(path):
+            if store.endswith('.zarr'):
+                data = xr.open_zarr(path, chunks=None)
+            else:
+                data = xr.open_dataset(path, engine='netcdf4', cache=False)
+            _open[path] = data
+            return data
+    return None
+
+
+def product(name, region=None, targ=None):
+    '''a gridded product, read only inside region
+
+    arguments:
+        name: one of PRODUCTS, or any other grid in the store or in targ, such as roughness_800
+        region: optional projected region (x_min, x_max, y_min, y_max) to read
+        targ: directory holding the products, defaults to targ
+    returns:
+        xarray grid with ascending x and y coordinates
+    '''
+    data = open_store(targ)
+    if data is not None and name in data:
+        grid = data[name]
+        if region is not None:
+            grid = grid.sel(x=slice(region[0], region[1]), y=slice(region[2], region[3]))
+        return grid.load()
+    path = product_path(name, targ)
+    if name not in PRODUCTS and not os.path.exists(path):
+        raise KeyError(f'unknown product {name}, expected one of {", ".join(PRODUCTS)} or a grid in the store')
+    return read_cog(path, region=region).rename(name)
+
+
+def products(names, region=None, targ=None):
+    '''several products for the same region, as a dictionary keyed on name'''
+    return {name: product(name, region=region, targ=targ) for name in names}
+
+
+def product_path(name, targ=None):
+    '''path of a product's GeoTIFF, for tools (such as GMT) that take file names; grids
+    not in PRODUCTS, such as roughness_800, are written under their own name'''
+    return os.path.join(targ or targ_dir(), f'{PRODUCTS.get(name, name)}.tif')
+
+
+def bounds(x, y, margin=0):
+    '''projected region enclosing points, grown by margin'''
+    return [np.nanmin(x) - margin, np.nanmax(x) + margin, np.nanmin(y) - margin, np.nanmax(y) + margin]
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+'''Projected Open Polar Radar radargrams as gridded images
+
+A radargram JPEG and its metadata CSV become an xarray grid of the raw uint8
+pixels, with 1-D along track distance (km) and elevation (m) coordinates taken
+from the metadata. There are no per-pixel coordinate tables and nothing is
+rebinned. Pixels are converted to power (dB) only for the window being plotted:
+    radar, region, metadata = read_radargram(path, 'CLX/R66a')
+    fig.grdimage(calibrate(radar, region=[x0, x1, z0, z1]))
+
+Figures read radargrams through a pyramid instead: each JPEG is decoded once
+into targ/radargrams/{transect}, as memory mapped .npy levels of square uint8
+tiles, each level averaging 2 x 2 pixels of the one below. A window is then
+read from the coarsest level that still resolves the plot, touching only the
+tiles it overlaps:
+    radar = load_radargram(path, 'CLX/R66a', region=[450, 500, 600, 1600], size=(2, 1))
+    fig.grdimage(calibrate(radar))
+or, to ingest ahead of time, python3 radargram.py [transects].
+'''
+
+import argparse
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+import xarray as xr
+
+Image.MAX_IMAGE_PIXELS = None
+
+'''power in dB for each pixel value'''
+DB = (140 * (np.arange(256) - 255) / 256).astype('float32')
+TILE = 256
+
+
+def radargram_files(path, transect):
+    '''the image and metadata files of a transect under projected_images_COLDEX'''
+    name = f'{transect.replace("/","_")}_image'
+    return os.path.join(path, 'image', f'{name}.jpg'), os.path.join(path, 'metadata', f'{name}.csv')
+
+
+def read_metadata(path, transect):
+    '''a radargram's region (x_min, x_max, y_bottom, y_top) and its metadata, without reading the image'''
+    metadata = pd.read_csv(radargram_files(path, transect)[1])
+    x0 = metadata['Displayed_distance [km]'].iloc[0]
+    x1 = metadata['Displayed_distance [km]'].iloc[-1]
+    y0 = metadata['Elevation of image bottom [m]'].iloc[0]
+    y1 = metadata['Elevation of image top [m]'].iloc[0]
+    return [min(x0, x1), max(x0, x1), y0, y1], metadata
+
+
+def read_radargram(path, transect):
+    ''' Read a JPG formatted Open Polar Radar radargram and associated metadata
+
+    arguments:
+        path: the projected_images_COLDEX directory
+        transect: transect name, e.g. CLX/R66a
+    returns:
+        uint8 xarray grid with ascending distance (x) and elevation (y) coordinates,
+        its region (x_min, x_max, y_bottom, y_top) and the metadata
+    '''
+    with Image.open(radargram_files(path, transect)[0]) as image:
+        img = np.asarray(image.getchannel(0) if image.mode != 'L' else image)
+    nrows, ncols = img.shape
+
+    region, metadata = read_metadata(path, transect)
+    x0 = metadata['Displayed_distance [km]'].iloc[0]
+    x1 = metadata['Displayed_distance [km]'].iloc[-1]
+    y0, y1 = region[2], region[3]
+
+    # image rows run from the top down, and columns may run against distance; both are flipped as views
+    x = np.linspace(x0, x1, ncols)
+    y = np.linspace(y0, y1, nrows)
+    img = img[::-1]
+    if x0 > x1:
+        img, x = img[:, ::-1], x[::-1]
+    radar = xr.DataArray(img, coords={'y': y, 'x': x}, dims=('y', 'x'), name=transect)
+    return radar, region, metadata
+
+
+def calibrate(radar, region=None):
+    '''the radargram in dB, converting only the pixels inside region (x_min, x_max, y_min, y_max)'''
+    if region is not None:
+        radar = radar.sel(x=slice(region[0], region[1]), y=slice(region[2], region[3]))
+    return radar.copy(data=DB[radar.values])
+
+
+def pyramid_dir(transect, targ=None):
+    return os.path.join(targ or os.getcwd().replace('code','targ'), 'radargrams', transect.replace('/','_'))
+
+
+def _sources(path, transect):
+    return [[os.path.basename(f), os.stat(f).st_size, os.stat(f).st_mtime_ns] for f in radargram_files(path, transect)]
+
+
+def _read_index(folder):
+    index = os.path.join(folder, 'pyramid.json')
+    if not os.path.exists(index):
+        return None
+    with open(index) as f:
+        return json.load(f)
+
+
+def _write_tiles(path, img, tile):
+    '''writes an image as a memory mapped (rows of tiles, columns of tiles, tile, tile) array, edge padded'''
+    nty, ntx = -(-img.shape[0] // tile), -(-img.shape[1] // tile)
+    tiles = np.lib.format.open_memmap(path, mode='w+', dtype='uint8', shape=(nty, ntx, tile, tile))
+    for i in range(nty):
+        band = img[i * tile:(i + 1) * tile]
+        band = np.pad(band, ((0, tile - band.shape[0]), (0, ntx * tile - band.shape[1])), mode='edge')
+        tiles[i] = band.reshape(tile, ntx, tile).transpose(1, 0, 2)
+    tiles.flush()
+
+
+def _halve(img):
+    '''averages 2 x 2 pixels, repeating the last row or column of odd sized images'''
+    img = np.pad(img, ((0, img.shape[0] % 2), (0, img.shape[1] % 2)), mode='edge')
+    summed = img.reshape(img.shape[0] // 2, 2, img.shape[1] // 2, 2).sum(axis=(1, 3), dtype='uint16')
+    return ((summed + 2) // 4).astype('uint8')
+
+
+def build_pyramid(path, transect, targ=None, tile=TILE, force=False):
+    '''decodes a radargram into a tiled pyramid, unless one from the same image and metadata exists
+
+    returns:
+        the pyramid folder
+    '''
+    folder = pyramid_dir(transect, targ)
+    index = _read_index(folder)
+    sources = _sources(path, transect)
+    if not force and index is not None and index['sources'] == sources and index['tile'] == tile:
+        return folder
+
+    radar, region, _ = read_radargram(path, transect)
+    x, y = radar.x.values, radar.y.values
+    staging = f'{folder}.{os.getpid()}'
+    os.makedirs(staging, exist_ok=True)
+    img = radar.values
+    shapes = []
+    while True:
+        _write_tiles(os.path.join(staging, f'level{len(shapes)}.npy'), img, tile)
+        shapes.append(list(img.shape))
+        if max(img.shape) <= tile:
+            break
+        img = _halve(img)
+
+    index = {'transect': transect, 'region': [float(r) for r in region], 'tile': tile, 'shapes': shapes,
+             'x': [float(x[0]), float(x[1] - x[0])], 'y': [float(y[0]), float(y[1] - y[0])], 'sources': sources}
+    with open(os.path.join(staging, 'pyramid.json'), 'w') as f:
+        json.dump(index, f)
+    if os.path.exists(folder):
+        shutil.rmtree(folder)
+    os.replace(staging, folder)
+    return folder
+
+
+def read_pyramid(folder, region=None, shape=None):
+    '''reads a window of a radargram pyramid
+
+    arguments:
+        folder: made by build_pyramid
+        region: optional (x_min, x_max, y_min, y_max) to read
+        shape: optional (rows, columns) of the output; the coarsest level with at least this many pixels is read
+    returns:
+        uint8 xarray grid with ascending distance (x) and elevation (y) coordinates
+    '''
+    index = _read_index(folder)
+    tile = index['tile']
+    x0, dx = index['x']
+    y0, dy = index['y']
+    nrows, ncols = index['shapes'][0]
+    if region is None:
+        region = [x0, x0 + dx * (ncols - 1), y0, y0 + dy * (nrows - 1)]
+
+    level = 0
+    if shape is not None:
+        wanted = min((region[1] - region[0]) / dx / shape[1], (region[3] - region[2]) / dy / shape[0])
+        level = int(np.clip(np.floor(np.log2(max(wanted, 1))), 0, len(index['shapes']) - 1))
+    factor = 2 ** level
+    nrows, ncols = index['shapes'][level]
+    # a pixel at this level averages factor pixels of level 0
+    xl, dxl = x0 + (factor - 1) / 2 * dx, dx * factor
+    yl, dyl = y0 + (factor - 1) / 2 * dy, dy * factor
+    j0 = max(0, int(np.ceil((region[0] - xl) / dxl - 1e-9)))
+    j1 = min(ncols, int(np.floor((region[1] - xl) / dxl + 1e-9)) + 1)
+    i0 = max(0, int(np.ceil((region[2] - yl) / dyl - 1e-9)))
+    i1 = min(nrows, int(np.floor((region[3] - yl) / dyl + 1e-9)) + 1)
+    j1, i1 = max(j1, j0), max(i1, i0)
+
+    tiles = np.load(os.path.join(folder, f'level{level}.npy'), mmap_mode='r')
+    ti, tj = i0 // tile, j0 // tile
+    block = tiles[ti:-(-i1 // tile), tj:-(-j1 // tile)]
+    img = block.transpose(0, 2, 1, 3).reshape(block.shape[0] * tile, block.shape[1] * tile)
+    img = img[i0 - ti * tile:i1 - ti * tile, j0 - tj * tile:j1 - tj * tile]
+    return xr.DataArray(np.ascontiguousarray(img), dims=('y', 'x'), name=index['transect'],
+                        coords={'y': yl + dyl * np.arange(i0, i1), 'x': xl + dxl * np.arange(j0, j1)})
+
+
+def load_radargram(path, transect, region=None, size=None, dpi=300, targ=None):
+    '''a window of a radargram at the resolution it will be plotted, building its pyramid if needed
+
+    arguments:
+        path: the projected_images_COLDEX directory
+        transect: transect name, e.g. CLX/R66a
+        region: optional (x_min, x_max, y_min, y_max) to read
+        size: optional plotted (width, height) in inches; negative widths (reversed axes) are allowed
+        dpi: output resolution used with size
+        targ: directory holding the radargrams folder, defaults to targ
+    returns:
+        uint8 xarray grid, see read_pyramid
+    '''
+    folder = build_pyramid(path, transect, targ=targ)
+    shape = None if size is None else (max(1, int(abs(size[1]) * dpi)), max(1, int(abs(size[0]) * dpi)))
+    return read_pyramid(folder, region=region, shape=shape)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='builds the tiled pyramids of projected radargrams')
+    parser.add_argument('transects', nargs='*', help='transects to build, e.g. CLX/R66a; defaults to every radargram')
+    parser.add_argument('--path', default=os.path.join(os.getcwd().replace('code','orig'), 'projected_images_COLDEX'))
+    parser.add_argument('--force', action='store_true', help='rebuild pyramids that are up to date')
+    args = parser.parse_args()
+
+    transects = args.transects
+    if not transects:
+        images = sorted(f for f in os.listdir(os.path.join(args.path, 'image')) if f.endswith('_image.jpg'))
+        transects = [f[:-len('_image.jpg')].replace('_', '/', 1) for f in images]
+    for transect in transects:
+        print(f'{transect}: {build_pyramid(args.path, transect, force=args.force)}')
+
+
+if __name__ == "__main__":
+    main()
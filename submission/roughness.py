@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+'''Along track RMS roughness at several scales
+
+Tracks are split into segments wherever the segment identifier (e.g. the OPR
+FRAME or Bedmap trajectory) changes, or where consecutive points are further
+apart than max_gap. Within each segment the bed is resampled at a regular
+interval, and the RMS of the height differences over a trailing window of
+samples is interpolated back to the original points
+(see Shepard et al. 2001, http://dx.doi.org/10.1029/2000JE001429).
+
+All segments are handled together: each segment is shifted along a single
+distance axis so that np.interp never mixes segments, and the rolling mean is a
+difference of cumulative sums, so no Python loop over segments or pandas rolling
+objects are needed.
+'''
+
+import numpy as np
+
+
+def segment_starts(x, y, segments=None, max_gap=5e3):
+    '''boolean array marking the first point of every segment
+
+    arguments:
+        x, y: projected coordinates
+        segments: optional array of segment identifiers, e.g. FRAME or trajectory_id
+        max_gap: a gap between consecutive points larger than this starts a new segment
+    '''
+    n = len(x)
+    starts = np.zeros(n, dtype=bool)
+    if n == 0:
+        return starts
+    starts[0] = True
+    gaps = np.hypot(np.diff(x), np.diff(y))
+    if max_gap is not None:
+        starts[1:] |= gaps > max_gap
+    if segments is not None:
+        segments = np.asarray(segments)
+        starts[1:] |= segments[1:] != segments[:-1]
+    return starts
+
+
+def along_track_distance(x, y, starts):
+    '''distance along track, restarting at zero at the start of every segment'''
+    gaps = np.zeros(len(x))
+    gaps[1:] = np.hypot(np.diff(x), np.diff(y))
+    gaps[starts] = 0
+    total = np.cumsum(gaps)
+    segment_id = np.cumsum(starts) - 1
+    return total - total[starts][segment_id], segment_id
+
+
+def roughness(x, y, z, intervals=(400,), segments=None, max_gap=5e3, window=5):
+    '''RMS height difference between samples <interval> apart, for a bank of intervals
+
+    arguments:
+        x, y: projected coordinates of the track points, in track order
+        z: bed elevation at the track points
+        intervals: sample intervals in projected units, e.g. (100, 200, 400, 800)
+        segments: optional array of segment identifiers, e.g. FRAME or trajectory_id
+        max_gap: a gap between consecutive points larger than this starts a new segment
+        window: number of height differences in the trailing RMS window
+    returns:
+        dictionary of float32 arrays, one per interval, aligned with the input points
+    '''
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    z = np.asarray(z, dtype='float64')
+    n = len(x)
+    if n == 0:
+        return {interval: np.array([], dtype='float32') for interval in intervals}
+
+    starts = segment_starts(x, y, segments=segments, max_gap=max_gap)
+    distance, segment_id = along_track_distance(x, y, starts)
+    segment_length = np.maximum.reduceat(distance, np.flatnonzero(starts))
+
+    rmsd = {}
+    for interval in intervals:
+        '''segment k is shifted by offset[k] along a shared axis, with an interval of clearance'''
+        samples_per_segment = np.round(segment_length / interval).astype('int64')
+        offset = np.concatenate([[0], np.cumsum(segment_length + 2 * interval)[:-1]])
+        shifted = distance + offset[segment_id]
+
+        sample_segment = np.repeat(np.arange(len(segment_length)), samples_per_segment)
+        first_sample = np.concatenate([[0], np.cumsum(samples_per_segment)[:-1]])
+        sample_index = np.arange(len(sample_segment)) - np.repeat(first_sample, samples_per_segment)
+        sample_distance = sample_index * interval + offset[sample_segment]
+
+        if len(sample_distance) == 0:
+            rmsd[interval] = np.full(n, np.nan, dtype='float32')
+            continue
+
+        sampled_z = np.interp(sample_distance, shifted, z)
+
+        '''squared differences, with no difference across a segment start'''
+        squared = np.full(len(sampled_z), np.nan)
+        squared[1:] = np.diff(sampled_z) ** 2
+        squared[first_sample[samples_per_segment > 0]] = np.nan
+
+        valid = np.isfinite(squared)
+        total = np.concatenate([[0], np.cumsum(np.where(valid, squared, 0))])
+        count = np.concatenate([[0], np.cumsum(valid)])
+        end = np.arange(1, len(squared) + 1)
+        begin = end - window
+        full = begin >= 0
+        begin = np.maximum(begin, 0)
+        windowed_count = count[end] - count[begin]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sample_rmsd = np.sqrt((total[end] - total[begin]) / windowed_count)
+        sample_rmsd[~full | (windowed_count < window)] = np.nan
+
+        '''points beyond the last sample of their segment take its value, as np.interp would'''
+        last_sample = (samples_per_segment - 1) * interval + offset
+        clamped = np.minimum(shifted, last_sample[segment_id])
+        values = np.interp(clamped, sample_distance, sample_rmsd)
+        values[samples_per_segment[segment_id] == 0] = np.nan
+        rmsd[interval] = values.astype('float32')
+
+    return rmsd
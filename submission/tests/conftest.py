@@ -0,0 +1,35 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# the modules in submission are imported by name, as the scripts there do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def flight_tracks(region, spacing=500, lines=4, seed=0):
+    '''points along a few straight, randomly oriented flight lines crossing region,
+    with a smooth bed and thickness along them'''
+    rng = np.random.default_rng(seed)
+    x, y = [], []
+    centre = np.array([(region[0] + region[1]) / 2, (region[2] + region[3]) / 2])
+    extent = max(region[1] - region[0], region[3] - region[2])
+    for _ in range(lines):
+        angle = rng.uniform(0, np.pi)
+        offset = centre + rng.uniform(-0.3, 0.3, 2) * extent
+        s = np.arange(-extent, extent, spacing)
+        px, py = offset[0] + s * np.cos(angle), offset[1] + s * np.sin(angle)
+        inside = (px >= region[0]) & (px <= region[1]) & (py >= region[2]) & (py <= region[3])
+        x.append(px[inside])
+        y.append(py[inside])
+    x, y = np.concatenate(x), np.concatenate(y)
+    bed = 500 * np.sin(x / 37e3) * np.cos(y / 23e3) + rng.normal(0, 20, len(x))
+    thick = 3000 + 300 * np.cos(x / 51e3) + rng.normal(0, 20, len(x))
+    return x, y, np.stack([bed, thick])
+
+
+@pytest.fixture
+def tracks():
+    region = [0, 120e3, 0, 80e3]
+    return (region, *flight_tracks(region))
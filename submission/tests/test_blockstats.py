@@ -0,0 +1,21 @@
+import numpy as np
+
+from blockstats import block_index, block_statistics, statistic_grid
+
+
+def test_statistic_grids_match_each_block(tracks):
+    region, x, y, values = tracks
+    table = block_statistics(x, y, values[0], region, 5e3, statistics=('count', 'std'))
+    count = statistic_grid(table, 'count', region, 5e3)
+    std = statistic_grid(table, 'std', region, 5e3)
+
+    index, nx, ny = block_index(x, y, region, 5e3)
+    assert count.shape == (ny, nx)
+    assert np.nansum(count) == len(x)
+    for block in np.unique(index)[:20]:
+        row, col = divmod(block, nx)
+        inside = values[0][index == block]
+        assert count[row, col] == len(inside)
+        if len(inside) > 1:
+            np.testing.assert_allclose(std[row, col], np.std(inside, ddof=1), rtol=1e-9)
+    assert np.isnan(count[np.isnan(std) & ~np.isin(np.arange(nx * ny), index).reshape(ny, nx)]).all()
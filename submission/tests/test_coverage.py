@@ -0,0 +1,27 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from coverage import coverage_mask
+from natural_neighbour import grid_nodes
+
+
+def test_edt_matches_kdtree_for_points_on_nodes(tracks):
+    region, x, y, _ = tracks
+    x, y = np.round(x / 1e3) * 1e3, np.round(y / 1e3) * 1e3
+    kdtree = coverage_mask(x, y, region, 1e3, 4.5e3)
+    edt = coverage_mask(x, y, region, 1e3, 4.5e3, method='edt')
+    np.testing.assert_array_equal(np.isnan(edt.values), np.isnan(kdtree.values))
+
+
+def test_edt_differs_from_kdtree_only_near_maxradius(tracks):
+    region, x, y, _ = tracks
+    kdtree = coverage_mask(x, y, region, 1e3, 4.5e3)
+    edt = coverage_mask(x, y, region, 1e3, 4.5e3, method='edt')
+    differ = np.isnan(edt.values) != np.isnan(kdtree.values)
+
+    xs, ys = grid_nodes(region, 1e3)
+    xx, yy = np.meshgrid(xs, ys)
+    distance, _ = cKDTree(np.column_stack([x, y])).query(np.column_stack([xx[differ], yy[differ]]))
+    # snapping points to their nearest node moves them by at most half a cell diagonal
+    assert np.all(np.abs(distance - 4.5e3) <= 1e3 / np.sqrt(2))
+    assert differ.mean() < 0.05
@@ -0,0 +1,20 @@
+import numpy as np
+
+from filters import filter_grids
+from natural_neighbour import to_dataarray
+
+
+def test_tiles_match_filtering_whole_grids(tmp_path):
+    rng = np.random.default_rng(0)
+    grids = rng.normal(size=(2, 150, 230))
+    grids[0, 40:60, 100:170] = np.nan
+    whole = filter_grids(list(grids), kind='gaussian', width=10e3, spacing=1e3, tile=1000)
+
+    # memory mapped inputs are read a tile and its halo at a time
+    stored = np.lib.format.open_memmap(tmp_path / 'grids.npy', mode='w+', dtype='float32', shape=grids.shape)
+    stored[:] = grids
+    region = [0, 229e3, 0, 149e3]
+    tiled = filter_grids([to_dataarray(g, region, 1e3) for g in stored], kind='gaussian', width=10e3, tile=64)
+    for expected, result in zip(whole, tiled):
+        assert result.dtype == 'float32'
+        np.testing.assert_allclose(result.values, expected, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from blockstats import block_index
+from gridding import grid_fields, sibson_interpolate
+
+
+def counting(calls):
+    def interpolate(bx, by, bz, region, spacing, max_radius=None):
+        calls.append(len(bz))
+        return sibson_interpolate(bx, by, bz, region, spacing, max_radius=max_radius)
+    return interpolate
+
+
+def test_fields_with_gaps_in_the_same_blocks_share_one_interpolation(tracks):
+    region, x, y, values = tracks
+    index, _, _ = block_index(x, y, region, 2e3)
+    order = np.argsort(index, kind='stable')
+    first = np.r_[True, np.diff(index[order]) > 0]
+    last = np.r_[first[1:], True]
+    # each field misses a different point of every block holding more than one
+    values[0, order[first & ~last]] = np.nan
+    values[1, order[last & ~first]] = np.nan
+    calls = []
+    grid_fields(x, y, values, region, 2e3, 1e3, 4e3, 6e3, interpolate=counting(calls))
+    assert calls == [2]
+
+
+def test_fields_occupying_different_blocks_are_gridded_apart(tracks):
+    region, x, y, values = tracks
+    values[1, x < 39e3] = np.nan
+    calls = []
+    together = grid_fields(x, y, values, region, 2e3, 1e3, 4e3, 6e3, interpolate=counting(calls))
+    assert calls == [1, 1]
+
+    alone = grid_fields(x, y, values[1:], region, 2e3, 1e3, 4e3, 6e3)
+    np.testing.assert_array_equal(together[1][1].values, alone[0][1].values)
+    assert np.isnan(together[1][1].sel(x=slice(0, 30e3)).values).all()
@@ -0,0 +1,71 @@
+import numpy as np
+
+from natural_neighbour import nearest_points, sibson_weights, sibson_apply
+from gridding import grid_fields
+
+
+def lend(x, y, z, region, spacing, max_radius=None):
+    '''discrete Sibson interpolation straight from its definition, one lending node at a time'''
+    index, rho = nearest_points(x, y, region, spacing)
+    if max_radius is not None:
+        rho = np.minimum(rho, max_radius / spacing)
+    z = np.atleast_2d(z)
+    rows, cols = np.mgrid[0:rho.shape[0], 0:rho.shape[1]]
+    total = np.zeros((len(z), *rho.shape))
+    count = np.zeros(rho.shape)
+    for i, j in zip(rows.ravel(), cols.ravel()):
+        disk = np.hypot(rows - i, cols - j) <= rho[i, j]
+        total[:, disk] += z[:, index[i, j], None]
+        count[disk] += 1
+    return total / count
+
+
+def lend_interpolate(bx, by, bz, region, spacing, max_radius=None):
+    return lend(bx, by, bz, region, spacing, max_radius=max_radius)
+
+
+def scattered(seed=0, n=40):
+    rng = np.random.default_rng(seed)
+    region = [0, 50e3, 0, 30e3]
+    x, y = rng.uniform(0, 50e3, n), rng.uniform(0, 30e3, n)
+    # points on nodes give lending radii exactly equal to offset distances
+    x[:10], y[:10] = np.round(x[:10] / 1e3) * 1e3, np.round(y[:10] / 1e3) * 1e3
+    return region, x, y, rng.normal(size=(2, n))
+
+
+def test_sibson_matches_definition():
+    region, x, y, z = scattered()
+    grids = sibson_apply(sibson_weights(x, y, region, 1e3), z)
+    np.testing.assert_allclose(grids, lend(x, y, z, region, 1e3), rtol=0, atol=1e-12)
+
+
+def test_capped_sibson_matches_capped_definition():
+    region, x, y, z = scattered(seed=1)
+    grids = sibson_apply(sibson_weights(x, y, region, 1e3, max_radius=4e3), z)
+    np.testing.assert_allclose(grids, lend(x, y, z, region, 1e3, max_radius=4e3), rtol=0, atol=1e-9)
+
+
+def test_cap_beyond_every_lending_radius_changes_nothing():
+    region, x, y, z = scattered(seed=2)
+    exact = sibson_apply(sibson_weights(x, y, region, 1e3), z)
+    capped = sibson_apply(sibson_weights(x, y, region, 1e3, max_radius=60e3), z)
+    np.testing.assert_allclose(capped, exact, rtol=0, atol=1e-9)
+
+
+def test_grid_fields_is_exact_by_default(tracks):
+    region, x, y, values = tracks
+    args = (x, y, values, region, 2e3, 1e3, 4e3, 6e3)
+    exact = grid_fields(*args, interpolate=lend_interpolate)
+    for (filtered, masked), (exact_filtered, exact_masked) in zip(grid_fields(*args), exact):
+        np.testing.assert_allclose(masked.values, exact_masked.values, rtol=0, atol=1e-6)
+        np.testing.assert_allclose(filtered.values, exact_filtered.values, rtol=0, atol=1e-6)
+
+
+def test_cap_changes_values_inside_the_mask(tracks):
+    '''the cap is opt-in because lenders far out in the gaps reach nodes next to the data'''
+    region, x, y, values = tracks
+    args = (x, y, values, region, 2e3, 1e3, 4e3, 6e3)
+    exact = grid_fields(*args)
+    capped = grid_fields(*args, max_radius=4e3 + 6e3)
+    difference = np.abs(capped[0][1].values - exact[0][1].values)
+    assert np.nanmax(difference) > 1
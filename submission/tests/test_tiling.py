@@ -0,0 +1,55 @@
+import numpy as np
+
+from conftest import flight_tracks
+from gridding import grid_fields
+from tiling import grid_fields_tiled, tile_layout
+
+REGION = [0, 200e3, 0, 140e3]
+SETTINGS = {'blockspacing': 2e3, 'grdspacing': 1e3, 'maxradius': 4e3, 'filter': 6e3}
+
+
+def survey():
+    x, y, values = flight_tracks(REGION, lines=5, seed=3)
+    # the zero corners leave large gaps, whose lenders reach far
+    corners = np.array([[REGION[0], REGION[2]], [REGION[0], REGION[3]], [REGION[1], REGION[2]], [REGION[1], REGION[3]]])
+    return np.r_[x, corners[:, 0]], np.r_[y, corners[:, 1]], np.hstack([values, np.zeros((2, 4))])
+
+
+def test_tiles_match_the_whole_region(tmp_path):
+    x, y, values = survey()
+    whole = grid_fields(x, y, values, REGION, max_radius=SETTINGS['maxradius'] + SETTINGS['filter'], **SETTINGS)
+    tiled, updated = grid_fields_tiled(x, y, values, ['bed', 'thick'], REGION, tile_size=40e3, workers=1,
+                                       outdir=str(tmp_path), **SETTINGS)
+    assert len(updated) > 4
+    for (_, masked), (_, tiled_masked) in zip(whole, tiled):
+        inside = np.isfinite(masked.values)
+        assert inside.sum() > 1000
+        np.testing.assert_array_equal(np.isfinite(tiled_masked.values), inside)
+        np.testing.assert_allclose(tiled_masked.values[inside], masked.values[inside], rtol=0, atol=1e-3)
+
+
+def test_incremental_regrids_tiles_depending_on_an_edited_point(tmp_path):
+    x, y, values = survey()
+    settings = dict(tile_size=40e3, workers=1, **SETTINGS)
+    grid_fields_tiled(x, y, values, ['bed', 'thick'], REGION, outdir=str(tmp_path / 'incremental'), incremental=True, **settings)
+
+    # a point beyond maxradius + filter + one block from the first tile's core, which its values still depend on
+    tiles = tile_layout(REGION, SETTINGS['grdspacing'], SETTINGS['blockspacing'], 40e3, 0)
+    rows, cols = tiles[0][:2]
+    core = [REGION[0] + cols.start * 1e3, REGION[0] + (cols.stop - 1) * 1e3,
+            REGION[2] + rows.start * 1e3, REGION[2] + (rows.stop - 1) * 1e3]
+    distance = np.hypot(np.maximum(0, np.maximum(core[0] - x, x - core[1])),
+                        np.maximum(0, np.maximum(core[2] - y, y - core[3])))
+    near = SETTINGS['maxradius'] + SETTINGS['filter'] + SETTINGS['blockspacing']
+    edited = np.flatnonzero((distance > near + SETTINGS['blockspacing']) & (distance < 2 * near))[0]
+    values = values.copy()
+    values[:, edited] += 200
+
+    patched, updated = grid_fields_tiled(x, y, values, ['bed', 'thick'], REGION, outdir=str(tmp_path / 'incremental'),
+                                         incremental=True, **settings)
+    assert (0, 0) in [(rows.start, cols.start) for rows, cols in updated]
+    assert 0 < len(updated) < len(tiles)
+
+    rebuilt, _ = grid_fields_tiled(x, y, values, ['bed', 'thick'], REGION, outdir=str(tmp_path / 'rebuilt'), **settings)
+    for (_, masked), (_, rebuilt_masked) in zip(patched, rebuilt):
+        np.testing.assert_array_equal(masked.values, rebuilt_masked.values)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+'''Tiled, halo aware gridding for large regions
+
+The region is split into square tiles aligned with both the block and the grid
+lattice. Each tile is gridded on its own with the points inside a halo around
+it (sized from the capped Sibson lending radius, the filter width and the block
+size, see grid_fields_tiled), then only the tile core is kept. Cores are written straight into memory mapped
+.npy files, so peak memory is proportional to the tile size rather than the
+region, and tiles are gridded on a pool of worker processes.
+
+In incremental mode every tile's input points (everything inside its halo, which
+covers every point its masked nodes depend on) are hashed and stored in a
+manifest next to the outputs. On the next run only tiles whose points changed,
+such as those near a newly added flight, are regridded and written into the
+existing memory mapped grids. The patched grids match a full tiled rebuild
+exactly; like any tiled grids, they match gridding the whole region only with
+the same lending cap.
+'''
+
+import os
+import json
+import time
+import hashlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from gridding import grid_fields, sibson_interpolate
+from natural_neighbour import grid_nodes, to_dataarray
+
+
+def tile_layout(region, grdspacing, blockspacing, tile_size, halo):
+    '''splits region into tiles
+
+    returns:
+        list of (rows, cols, halo_region, offset) with rows and cols the slices of
+        the full grid covered by the tile core, halo_region the region gridded for
+        the tile and offset the (row, col) of the core within that grid
+    '''
+    step = max(grdspacing, blockspacing)
+    tile = max(step, round(tile_size / step) * step)
+    halo = np.ceil(halo / step) * step
+    per_tile = int(round(tile / grdspacing))
+    xs, ys = grid_nodes(region, grdspacing)
+
+    tiles = []
+    for r0, r1 in _spans(len(ys), per_tile):
+        for c0, c1 in _spans(len(xs), per_tile):
+            halo_region = [max(region[0], xs[c0] - halo), min(region[1], xs[c1 - 1] + halo),
+                           max(region[2], ys[r0] - halo), min(region[3], ys[r1 - 1] + halo)]
+            offset = (int(round((ys[r0] - halo_region[2]) / grdspacing)),
+                      int(round((xs[c0] - halo_region[0]) / grdspacing)))
+            tiles.append((slice(r0, r1), slice(c0, c1), halo_region, offset))
+    return tiles
+
+
+def _spans(n, per_tile):
+    '''(start, stop) node ranges of per_tile nodes, the last absorbing a short remainder'''
+    starts = list(range(0, n, per_tile))
+    if len(starts) > 1 and n - starts[-1] <= per_tile // 4:
+        starts.pop()
+    return list(zip(starts, starts[1:] + [n]))
+
+
+def _grid_tile(job):
+    '''grids one tile, returning the core of the filtered and masked grids'''
+    x, y, values, weights, (rows, cols, halo_region, offset), params = job
+    start = time.time()
+    results = grid_fields(x, y, values, halo_region, weights=weights, **params)
+    r0, c0 = offset
+    nr, nc = rows.stop - rows.start, cols.stop - cols.start
+    core = np.stack([np.stack([filtered.values[r0:r0+nr, c0:c0+nc], masked.values[r0:r0+nr, c0:c0+nc]])
+                     for filtered, masked in results]).astype('float32')
+    return core, time.time() - start
+
+
+def _tile_jobs(x, y, values, weights, tiles, params):
+    '''yields the points inside each tile's halo region, scanning x sorted points'''
+    order = np.argsort(x, kind='stable')
+    x_sorted = x[order]
+    for tile in tiles:
+        halo_region = tile[2]
+        lo = np.searchsorted(x_sorted, halo_region[0], side='left')
+        hi = np.searchsorted(x_sorted, halo_region[1], side='right')
+        candidates = order[lo:hi]
+        inside = (y[candidates] >= halo_region[2]) & (y[candidates] <= halo_region[3])
+        index = np.sort(candidates[inside])
+        yield x[index], y[index], values[:, index], None if weights is None else weights[index], tile, params
+
+
+def tile_key(job):
+    '''hash of the points a tile is gridded from, which are all the points inside its halo'''
+    digest = hashlib.blake2b(digest_size=16)
+    for array in job[:4]:
+        if array is not None:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def _load_manifest(path, settings):
+    '''tile hashes from an earlier run with the same settings, or None'''
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    return manifest['tiles'] if manifest.get('settings') == settings else None
+
+
+def _save_manifest(path, settings, tiles):
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump({'settings': settings, 'tiles': tiles}, f)
+    os.replace(tmp, path)
+
+
+def _open_outputs(outdir, names, shape, reuse):
+    '''memory mapped (filtered, masked) grids per name, reusing existing files if asked'''
+    outputs = []
+    for name in names:
+        pair = []
+        for suffix in ('.xyz', '.xyz_val'):
+            path = os.path.join(outdir, f'{name}{suffix}.npy')
+            if reuse and os.path.exists(path):
+                grid = np.load(path, mmap_mode='r+')
+                if grid.shape != shape or grid.dtype != 'float32':
+                    return None
+            else:
+                grid = np.lib.format.open_memmap(path, mode='w+', dtype='float32', shape=shape)
+            pair.append(grid)
+        outputs.append(pair)
+    return outputs
+
+
+def grid_fields_tiled(x, y, values, names, region, blockspacing, grdspacing, maxradius, filter,
+        rms=False, weights=None, interpolate=sibson_interpolate, tile_size=200e3, workers=None, outdir='tiles',
+        incremental=False):
+    '''grids several fields sharing the same points, tile by tile
+
+    arguments:
+        as for gridding.grid_fields, plus
+        names: output names, one per field, used for the memory mapped files
+        tile_size: approximate tile size in projected units, rounded to the block lattice
+        workers: number of worker processes, defaults to the number of cores
+        outdir: directory for the memory mapped outputs
+        incremental: only regrid tiles whose input points changed since the last run
+                     with the same settings, patching the existing outputs
+    returns:
+        list of (filtered, masked) xarray grids backed by memory mapped .npy files,
+        and the list of (rows, cols) slices of the tiles that were regridded
+
+    Tiles cap the Sibson lending radius at maxradius + filter, as without a cap a
+    node's value can depend on points anywhere across a gap. Within maxradius of the
+    data the tiles then match gridding the whole region at once with the same cap
+    (grid_fields with max_radius=maxradius + filter), to float32 rounding. The halo
+    covers everything a masked node depends on: the filter reaches filter/2, a node
+    there takes values from lenders up to the cap away, and those lenders take their
+    radius and value from their nearest point, which is no further than the cap plus
+    filter/2 plus maxradius. One block is added so every block reaching into that
+    distance is complete, and the halo is a multiple of the block size so tiles share
+    the full region's block lattice. Away from the data (the nodes the mask removes)
+    the unmasked grids may differ slightly between tiles.
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    max_radius = maxradius + filter
+    halo = 2 * max_radius + filter + maxradius + blockspacing
+    tiles = tile_layout(region, grdspacing, blockspacing, tile_size, halo)
+    params = {'blockspacing': blockspacing, 'grdspacing': grdspacing, 'maxradius': maxradius,
+              'filter': filter, 'rms': rms, 'interpolate': interpolate, 'max_radius': max_radius}
+
+    xs, ys = grid_nodes(region, grdspacing)
+    manifest = os.path.join(outdir, f'{"+".join(names)}.json')
+    settings = {'names': list(names), 'region': [float(r) for r in region], 'tile_size': tile_size,
+                'interpolate': interpolate.__name__,
+                **{k: v for k, v in params.items() if k != 'interpolate'}}
+    previous = _load_manifest(manifest, settings) if incremental else None
+    outputs = _open_outputs(outdir, names, (len(ys), len(xs)), reuse=previous is not None)
+    if outputs is None:
+        previous = None
+        outputs = _open_outputs(outdir, names, (len(ys), len(xs)), reuse=False)
+    previous = previous or {}
+
+    keys = {}
+    updated = []
+
+    def changed(jobs):
+        for job in jobs:
+            rows, cols = job[4][:2]
+            name = f'{rows.start}_{cols.start}'
+            keys[name] = tile_key(job)
+            if previous.get(name) != keys[name]:
+                updated.append((rows, cols))
+                yield job
+
+    def store(tile, core, seconds):
+        rows, cols = tile[0], tile[1]
+        for out, field in zip(outputs, core):
+            out[0][rows, cols] = field[0]
+            out[1][rows, cols] = field[1]
+        print(f'    tile rows {rows.start}-{rows.stop} cols {cols.start}-{cols.stop} {seconds:6.1f} s')
+
+    workers = max(1, min(workers or os.cpu_count(), len(tiles)))
+    print(f'Gridding {", ".join(names)} in {len(tiles)} tiles on {workers} worker(s)')
+    jobs = changed(_tile_jobs(x, y, values, weights, tiles, params))
+    if workers == 1:
+        for job in jobs:
+            store(job[4], *_grid_tile(job))
+    else:
+        # only a few tiles are queued at a time, so their points are not all held at once
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for job in jobs:
+                pending.append((job[4], pool.submit(_grid_tile, job)))
+                if len(pending) >= 2 * workers:
+                    tile, future = pending.popleft()
+                    store(tile, *future.result())
+            while pending:
+                tile, future = pending.popleft()
+                store(tile, *future.result())
+
+    results = []
+    for filtered, masked in outputs:
+        filtered.flush()
+        masked.flush()
+        results.append((to_dataarray(filtered, region, grdspacing), to_dataarray(masked, region, grdspacing)))
+    _save_manifest(manifest, settings, keys)
+    print(f'    regridded {len(updated)} of {len(tiles)} tiles')
+    return results, updated
+
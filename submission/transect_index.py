@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+'''Index of the projected radargram transects
+
+Every transect in projected_images_COLDEX/metadata is summarised once: its
+name, row count, first and last times, bounding box, distance range, and its
+track simplified (Douglas-Peucker) at a few tolerances. The index is a JSON
+file in the cache directory, refreshed for the CSV files whose size or mtime
+has changed, so listing, filtering and plotting transects reads one file
+instead of every metadata CSV:
+    index = build_index()
+    radials = select(index, pattern='CLX/R')
+    track = geometry(index, 'CLX/R66a', tolerance=100)
+'''
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import cache_dir
+
+TOLERANCES = (100, 1000, 5000)
+COLUMNS = {
+    'UNIX time [s]': 'time',
+    'Displayed_distance [km]': 'distance',
+    'EPSG 3031 Easting [m]': 'x',
+    'EPSG 3031 Northing [m]': 'y',
+    'Longitude [degrees]': 'lon',
+    'Latitude [degrees]': 'lat',
+}
+'''decimal places kept for each geometry column'''
+PRECISION = {'x': 1, 'y': 1, 'lon': 6, 'lat': 6, 'distance': 4}
+
+
+def metadata_dir():
+    return os.path.join(os.getcwd().replace('code','orig'), 'projected_images_COLDEX', 'metadata')
+
+
+def transect_name(csv):
+    '''CLX/R66a from CLX_R66a_image.csv'''
+    return f'{csv.split("_")[0]}/{csv.split("_")[1]}'
+
+
+def simplify(x, y, tolerance):
+    '''indices of the points kept by Douglas-Peucker simplification of a line'''
+    n = len(x)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    pending = [(0, n - 1)]
+    while pending:
+        i, j = pending.pop()
+        if j - i < 2:
+            continue
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        px, py = x[i + 1:j] - x[i], y[i + 1:j] - y[i]
+        length = np.hypot(dx, dy)
+        offset = np.abs(dx * py - dy * px) / length if length > 0 else np.hypot(px, py)
+        k = int(np.argmax(offset))
+        if offset[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            pending += [(i, k), (k, j)]
+    return np.flatnonzero(keep)
+
+
+def summarise(path, tolerances=TOLERANCES):
+    '''the index entry of one metadata CSV'''
+    header = pd.read_csv(path, nrows=0).columns
+    data = pd.read_csv(path, usecols=[c for c in COLUMNS if c in header]).rename(columns=COLUMNS)
+    stat = os.stat(path)
+    entry = {'file': os.path.basename(path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'rows': len(data)}
+    if 'time' in data:
+        entry['time'] = [float(data['time'].iloc[0]), float(data['time'].iloc[-1])]
+    if 'distance' in data:
+        entry['distance'] = [float(data['distance'].min()), float(data['distance'].max())]
+
+    track = data.dropna(subset=['x', 'y'])
+    x, y = track['x'].to_numpy(), track['y'].to_numpy()
+    if len(track):
+        entry['bbox'] = [float(x.min()), float(x.max()), float(y.min()), float(y.max())]
+    entry['geometry'] = {}
+    for tolerance in tolerances:
+        kept = track.iloc[simplify(x, y, tolerance)]
+        entry['geometry'][str(tolerance)] = {c: np.round(kept[c].to_numpy(), PRECISION[c]).tolist()
+                                             for c in PRECISION if c in kept}
+    return entry
+
+
+def index_path(cache=None):
+    return os.path.join(cache or cache_dir(), 'transect_index.json')
+
+
+def build_index(path=None, cache=None, tolerances=TOLERANCES):
+    '''brings the index up to date with the metadata CSVs, re-reading only new or changed files
+
+    arguments:
+        path: the metadata folder, defaults to orig/projected_images_COLDEX/metadata
+        cache: folder holding the index, defaults to the cache directory
+        tolerances: simplification tolerances in m
+    returns:
+        the index, a dictionary of entries keyed on transect name
+    '''
+    path = path or metadata_dir()
+    target = index_path(cache)
+    index = {}
+    if os.path.exists(target):
+        with open(target) as f:
+            index = json.load(f)
+        if index.get('tolerances') != list(tolerances) or index.get('path') != os.path.abspath(path):
+            index = {}
+    transects = index.get('transects', {})
+
+    found = {}
+    changed = False
+    for csv in sorted(os.listdir(path)):
+        if not csv.endswith('.csv'):
+            continue
+        name = transect_name(csv)
+        stat = os.stat(os.path.join(path, csv))
+        entry = transects.get(name)
+        if entry is None or entry['file'] != csv or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            entry = summarise(os.path.join(path, csv), tolerances)
+            changed = True
+        found[name] = entry
+    changed |= set(found) != set(transects)
+
+    index = {'path': os.path.abspath(path), 'tolerances': list(tolerances), 'transects': found}
+    if changed:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f'{target}.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, target)
+    return found
+
+
+def select(index, pattern=None, region=None):
+    '''names of the transects containing pattern and whose bounding box overlaps region'''
+    names = []
+    for name, entry in index.items():
+        if pattern is not None and pattern not in name:
+            continue
+        if region is not None:
+            bbox = entry.get('bbox')
+            if bbox is None or bbox[0] > region[1] or bbox[1] < region[0] or bbox[2] > region[3] or bbox[3] < region[2]:
+                continue
+        names.append(name)
+    return names
+
+
+def geometry(index, name, tolerance=TOLERANCES[0]):
+    '''a transect's simplified track, with the metadata CSV column names'''
+    track = pd.DataFrame(index[name]['geometry'][str(tolerance)])
+    return track.rename(columns={v: k for k, v in COLUMNS.items()})
+
+
+def time_limits(index, pattern=None):
+    '''first and last times of each transect, as datetimes'''
+    return {name: tuple(pd.to_datetime(index[name]['time'], unit='s'))
+            for name in select(index, pattern) if 'time' in index[name]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='indexes the projected radargram metadata')
+    parser.add_argument('pattern', nargs='?', default=None, help='only list transects containing this, e.g. CLX/R')
+    parser.add_argument('--path', default=None, help='metadata folder, defaults to orig/projected_images_COLDEX/metadata')
+    args = parser.parse_args()
+
+    index = build_index(args.path)
+    for name in select(index, args.pattern):
+        entry = index[name]
+        print(name, entry['rows'], *entry.get('distance', []), *entry.get('bbox', []), sep='\t')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''Streaming reader for UTIG formatted text files
+
+UTIG files carry their column names on the last line of a '#' comment header,
+followed by whitespace separated columns. The header is read lazily, stopping at
+the first data line, and the body is parsed once by the pandas C parser in fixed
+size chunks so callers can reduce each chunk before the next is read.
+'''
+
+import pandas as pd
+
+ENCODING = 'ISO-8859-1'
+
+
+def read_header(path):
+    '''returns the column names held on the last line of the comment header'''
+    previous = ''
+    with open(path,'r',encoding=ENCODING) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            previous = line
+    return previous.split()[1:]
+
+
+def iter_utig(path, names=None, usecols=None, dtype=None, chunksize=2**20):
+    '''iterates over a UTIG formatted text file in chunks
+
+    arguments:
+        path: path to the text file
+        names: column names, read from the comment header if not given
+        usecols: columns to keep; columns missing from a file are skipped
+        dtype: dictionary of column types, e.g. {'LON': 'float64', 'THK': 'float32'}
+        chunksize: number of rows per chunk
+    yields:
+        pandas dataframes of at most chunksize rows
+    '''
+    if names is None:
+        names = read_header(path)
+
+    if usecols is not None:
+        usecols = [c for c in usecols if c in names]
+    if dtype is not None:
+        keep = usecols if usecols is not None else names
+        dtype = {k: v for k, v in dtype.items() if k in keep}
+
+    '''sep=r"\s+" is handled by the C parser as a whitespace delimiter'''
+    reader = pd.read_csv(path,
+            sep=r'\s+',
+            comment='#',
+            header=None,
+            names=names,
+            usecols=usecols,
+            dtype=dtype,
+            index_col=False,
+            encoding=ENCODING,
+            engine='c',
+            chunksize=chunksize)
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+
+def read_utig_file(path, names=None, usecols=None, dtype=None, chunksize=2**20, reduce=None):
+    '''reads a UTIG formatted text file into a single dataframe
+
+    arguments:
+        as for iter_utig, plus
+        reduce: optional function applied to each chunk before it is kept
+    returns:
+        pandas dataframe
+    '''
+    chunks = []
+    for chunk in iter_utig(path, names=names, usecols=usecols, dtype=dtype, chunksize=chunksize):
+        if reduce is not None:
+            chunk = reduce(chunk)
+        chunks.append(chunk)
+    if not chunks:
+        return pd.DataFrame(columns=usecols if usecols is not None else names)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)